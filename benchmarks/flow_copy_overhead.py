@@ -0,0 +1,71 @@
+"""
+Measures the overhead of `Flow.execute` on workflows carrying large `data` payloads.
+
+`num_nodes` nodes are chained together, each of them carries a `payload_mb` MB
+payload (an embedded base64 image & a long prompt list) in its `data`, and does
+nothing but passing a tiny value to the next node. So the measured time & memory
+are (almost) purely spent on preparing the execution.
+
+Usage:
+    python benchmarks/flow_copy_overhead.py [--num_nodes 100] [--payload_mb 1]
+"""
+
+import time
+import base64
+import asyncio
+import argparse
+import tracemalloc
+
+from typing import Any
+from typing import Dict
+
+from cfdraw.core.flow import Node
+from cfdraw.core.flow import Flow
+from cfdraw.core.flow import Injection
+
+
+@Node.register("benchmark.passthrough")
+class PassthroughNode(Node):
+    async def execute(self) -> Dict[str, Any]:
+        return {"step": self.data.get("step", 0) + 1}
+
+
+def build_flow(num_nodes: int, payload_mb: float) -> Flow:
+    num_bytes = int(payload_mb * 1024 * 1024)
+    image = base64.b64encode(b"\0" * (num_bytes * 3 // 8)).decode()
+    prompts = [f"prompt {i:08d}" for i in range(num_bytes // 2 // 16)]
+    flow = Flow()
+    for i in range(num_nodes):
+        data = dict(image=image, prompts=list(prompts), meta=dict(index=i))
+        injections = [] if i == 0 else [Injection(str(i - 1), "step", "step")]
+        flow.push(PassthroughNode(str(i), data, injections))
+    return flow
+
+
+async def main(num_nodes: int, payload_mb: float, repeat: int) -> None:
+    flow = build_flow(num_nodes, payload_mb)
+    target = str(num_nodes - 1)
+    await flow.execute(target)
+    latencies = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        results = await flow.execute(target)
+        latencies.append(time.perf_counter() - t)
+    assert results[target]["step"] == num_nodes
+    tracemalloc.start()
+    await flow.execute(target)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"nodes       : {num_nodes} x {payload_mb} MB")
+    print(f"best time   : {min(latencies) * 1000.0:.1f}ms")
+    print(f"mean time   : {sum(latencies) / len(latencies) * 1000.0:.1f}ms")
+    print(f"peak memory : {peak / 1024 / 1024:.1f}MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_nodes", type=int, default=100)
+    parser.add_argument("--payload_mb", type=float, default=1.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.num_nodes, args.payload_mb, args.repeat))
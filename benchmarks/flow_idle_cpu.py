@@ -0,0 +1,65 @@
+"""
+Measures how much CPU `Flow.execute` burns while waiting for long running nodes.
+
+A single offloaded 'slow' node (which simply sleeps in a sub-thread) is followed by
+`num_dependents` nodes that depend on it. Ideally, the CPU time of the whole process
+should stay close to zero, since nothing but sleeping is happening.
+
+Usage:
+    python benchmarks/flow_idle_cpu.py [--seconds 3] [--num_dependents 50]
+"""
+
+import time
+import asyncio
+import argparse
+
+from typing import Any
+from typing import Dict
+from dataclasses import dataclass
+
+from cfdraw.core.flow import Node
+from cfdraw.core.flow import Flow
+from cfdraw.core.flow import Injection
+
+
+@dataclass
+@Node.register("benchmark.slow")
+class SlowNode(Node):
+    offload: bool = True
+
+    async def execute(self) -> Dict[str, Any]:
+        time.sleep(self.data["seconds"])
+        return {"done": True}
+
+
+@Node.register("benchmark.dependent")
+class DependentNode(Node):
+    async def execute(self) -> Dict[str, Any]:
+        return self.data
+
+
+async def main(seconds: float, num_dependents: int) -> None:
+    flow = Flow().push(SlowNode("slow", dict(seconds=seconds)))
+    keys = []
+    for i in range(num_dependents):
+        key = f"dependent_{i}"
+        keys.append(key)
+        flow.push(DependentNode(key, injections=[Injection("slow", "done", "done")]))
+    target = flow.gather(*keys)
+    wall_t = time.perf_counter()
+    cpu_t = time.process_time()
+    await flow.execute(target)
+    wall = time.perf_counter() - wall_t
+    cpu = time.process_time() - cpu_t
+    print(f"nodes      : {len(flow)}")
+    print(f"wall time  : {wall:.3f}s")
+    print(f"cpu time   : {cpu:.3f}s")
+    print(f"cpu / wall : {100.0 * cpu / wall:.2f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--num_dependents", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.seconds, args.num_dependents))
@@ -0,0 +1,80 @@
+"""
+Compares the execution backends of CPU-bound flow nodes.
+
+`num_nodes` independent nodes are executed concurrently, each of them blurs a
+`size` x `size` RGB image (a GIL-holding PIL operation) and returns the result.
+The same workflow is executed with `offload=True` (threads) and with
+`offload="process"`, the latter is executed twice: with large images sent
+through shared memory (the default), and with everything pickled.
+
+Usage:
+    python benchmarks/flow_process_offload.py [--num_nodes 8] [--size 2048]
+"""
+
+import time
+import asyncio
+import argparse
+
+import numpy as np
+
+from typing import Any
+from typing import Dict
+from typing import Union
+from PIL import Image
+from PIL import ImageFilter
+
+from cfdraw.core.flow import Node
+from cfdraw.core.flow import Flow
+from cfdraw.core.flow import setup_process_runtime
+
+
+@Node.register("benchmark.blur")
+class BlurNode(Node):
+    async def execute(self) -> Dict[str, Any]:
+        blurred = self.data["image"]
+        for _ in range(self.data["repeat"]):
+            blurred = blurred.filter(ImageFilter.GaussianBlur(4))
+        return {"image": blurred}
+
+
+def build_flow(num_nodes: int, size: int, offload: Union[bool, str]) -> Flow:
+    array = np.random.randint(0, 256, (size, size, 3), dtype=np.uint8)
+    image = Image.fromarray(array)
+    flow = Flow()
+    for i in range(num_nodes):
+        data = dict(image=image, repeat=2)
+        flow.push(BlurNode(f"blur_{i}", data, offload=offload))
+    return flow
+
+
+async def measure(flow: Flow, targets: int, repeat: int) -> float:
+    latencies = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        await asyncio.gather(*[flow.execute(f"blur_{i}") for i in range(targets)])
+        latencies.append(time.perf_counter() - t)
+    return min(latencies)
+
+
+async def main(num_nodes: int, size: int, workers: int, repeat: int) -> None:
+    thread_flow = build_flow(num_nodes, size, True)
+    process_flow = build_flow(num_nodes, size, "process")
+    print(f"nodes   : {num_nodes} x {size}x{size} RGB")
+    print(f"threads : {await measure(thread_flow, num_nodes, repeat) * 1000.0:.1f}ms")
+    for name, threshold in [("process", 1024 * 1024), ("pickled", 1 << 62)]:
+        runtime = setup_process_runtime(workers, shm_threshold=threshold)
+        await runtime.start()
+        await measure(process_flow, num_nodes, 1)
+        latency = await measure(process_flow, num_nodes, repeat)
+        print(f"{name} : {latency * 1000.0:.1f}ms ({runtime.max_workers} workers)")
+        runtime.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_nodes", type=int, default=8)
+    parser.add_argument("--size", type=int, default=2048)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.num_nodes, args.size, args.workers, args.repeat))
@@ -0,0 +1,79 @@
+"""
+Measures how long it takes to persist the images returned by a plugin.
+
+`num_images` random images are saved serially with `save_image` (which is what
+`ImageUploader.upload_image` used to do on the event loop), and then concurrently
+with `save_image_async` (which is what `ResponseMiddleware` does now). The longest
+stall of the event loop is reported as well, since it blocks every websocket.
+
+Usage:
+    python benchmarks/upload_images.py [--num_images 8] [--size 1024]
+"""
+
+import time
+import asyncio
+import argparse
+import tempfile
+
+import numpy as np
+
+from PIL import Image
+from typing import Awaitable
+from PIL.PngImagePlugin import PngInfo
+
+from cfdraw.config import get_config
+from cfdraw.utils.server import save_image
+from cfdraw.utils.server import save_image_async
+
+
+async def measure(name: str, future: Awaitable) -> None:
+    max_stall = 0.0
+    running = True
+
+    async def monitor() -> None:
+        nonlocal max_stall
+        while running:
+            t = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_stall = max(max_stall, time.perf_counter() - t - 0.001)
+
+    monitor_task = asyncio.create_task(monitor())
+    await asyncio.sleep(0.01)
+    t = time.perf_counter()
+    await future
+    elapsed = time.perf_counter() - t
+    running = False
+    await monitor_task
+    print(f"{name:<10}: {elapsed:.3f}s (max event loop stall: {max_stall:.3f}s)")
+
+
+async def main(num_images: int, size: int, compress_level: int) -> None:
+    config = get_config()
+    config.upload_root = tempfile.mkdtemp()
+    config.png_compress_level = compress_level
+    images = [
+        Image.fromarray(np.random.randint(0, 256, [size, size, 3], np.uint8))
+        for _ in range(num_images)
+    ]
+    base_url = "http://localhost"
+
+    async def serial() -> None:
+        for image in images:
+            save_image(image, PngInfo(), base_url)
+
+    async def parallel() -> None:
+        futures = [save_image_async(image, PngInfo(), base_url) for image in images]
+        await asyncio.gather(*futures)
+
+    print(f"images    : {num_images} x {size}^2, compress level {compress_level}")
+    await measure("serial", serial())
+    await measure("parallel", parallel())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_images", type=int, default=8)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--compress_level", type=int, default=6)
+    args = parser.parse_args()
+    asyncio.run(main(args.num_images, args.size, args.compress_level))
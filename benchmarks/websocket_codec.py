@@ -0,0 +1,100 @@
+"""
+Measures the (single core) throughput of the websocket message codec.
+
+* decode : an incoming `ISocketRequest`, whose `nodeData` is a group of
+`num_nodes` image nodes (each with a `Matrix2D` transform & meta).
+* encode : an outgoing progress `ISocketMessage` (with intermediate texts).
+
+`before` is the previous implementation (`json.loads` + `ISocketRequest(**...)`,
+`json.dumps(model_dump())`), `after` is the current one (`decode_model` and
+`ISocketMessage.to_frame`, with cached `TypeAdapter`s).
+
+Usage:
+    python benchmarks/websocket_codec.py [--num_nodes 8] [--duration 2.0]
+"""
+
+import json
+import time
+import argparse
+
+from typing import Any
+from typing import Callable
+
+from cfdraw.utils.codec import decode_model
+from cfdraw.schema.plugins import ISocketRequest
+from cfdraw.schema.plugins import ISocketMessage
+from cfdraw.schema.plugins import ISocketIntermediate
+
+
+def build_request(num_nodes: int) -> str:
+    transform = dict(a=1.0, b=0.0, c=0.0, d=1.0, e=12.0, f=34.0)
+    node = dict(
+        type="image",
+        x=12.0,
+        y=34.0,
+        w=512.0,
+        h=512.0,
+        z=1.0,
+        transform=transform,
+        src="http://127.0.0.1:8123/.images/7f3c9b2e.png/",
+        meta=dict(type="upload", data=dict(identifier="txt2img", w=512, h=512)),
+    )
+    group = dict(node, type="group", src=None, children=[node] * num_nodes)
+    extra_data = dict(text="a cat sitting on a chair " * 4, steps=20, seed=-1)
+    return json.dumps(
+        dict(
+            hash="6a2c4d",
+            userId="benchmark",
+            baseURL="http://127.0.0.1:8123",
+            identifier="txt2img.6a2c4d",
+            nodeData=group,
+            nodeDataList=[],
+            extraData=extra_data,
+        )
+    )
+
+
+def measure(fn: Callable[[], Any], duration: float) -> float:
+    n = 0
+    t = time.perf_counter()
+    while True:
+        for _ in range(100):
+            fn()
+        n += 100
+        elapsed = time.perf_counter() - t
+        if elapsed >= duration:
+            return n / elapsed
+
+
+def main(num_nodes: int, duration: float) -> None:
+    raw = build_request(num_nodes)
+    intermediate = ISocketIntermediate(textList=["step 10 / 20"])
+    message = ISocketMessage.make_progress("6a2c4d", 0.5, intermediate)
+    assert json.loads(message.to_frame().text) == message.model_dump()
+    cases = [
+        (
+            "decode",
+            lambda: ISocketRequest(**json.loads(raw)),
+            lambda: decode_model(ISocketRequest, raw),
+        ),
+        (
+            "encode",
+            lambda: json.dumps(message.model_dump()),
+            lambda: message.to_frame(),
+        ),
+    ]
+    for name, before, after in cases:
+        before_speed = measure(before, duration)
+        after_speed = measure(after, duration)
+        print(
+            f"{name} : {before_speed:,.0f} -> {after_speed:,.0f} msg/s "
+            f"({after_speed / before_speed:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_nodes", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=2.0)
+    args = parser.parse_args()
+    main(args.num_nodes, args.duration)
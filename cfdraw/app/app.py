@@ -1,8 +1,11 @@
+import asyncio
+
+from typing import Any
+from typing import Dict
 from typing import List
 from typing import Type
 from typing import Optional
 from typing import AsyncGenerator
-from aiohttp import ClientSession
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
 from fastapi.middleware import cors
@@ -15,7 +18,18 @@ from cfdraw.core.toolkit import console
 from cfdraw.schema.plugins import IPlugin
 from cfdraw.plugins.factory import Plugins
 from cfdraw.plugins.factory import PluginFactory
+from cfdraw.utils.misc import get_offload_stats
+from cfdraw.utils.codec import setup_json_codec
+from cfdraw.utils.server import get_image_derivatives
+from cfdraw.app.endpoints.websocket import get_outbox_stats
+from cfdraw.plugins.middlewares.cache import get_result_cache
 from cfdraw.core.toolkit.misc import random_hash
+from cfdraw.core.toolkit.web import get_http_session
+from cfdraw.core.toolkit.web import get_download_cache
+from cfdraw.core.toolkit.web import get_retry_manager
+from cfdraw.core.toolkit.web import close_http_session
+from cfdraw.core.toolkit.web import setup_retry_manager
+from cfdraw.core.toolkit.misc import setup_offload_runtime
 
 
 async def ping() -> str:
@@ -31,6 +45,15 @@ class App(IApp):
             # startup
 
             console.log(f"🚀 Starting Backend Server at {self.config.api_url} ...")
+            offload_runtime = setup_offload_runtime(self.config.offload_max_workers)
+            offload_runtime.bind_loop(asyncio.get_running_loop())
+            setup_json_codec(self.config.json_codec)
+            self.http_session = get_http_session()
+            setup_retry_manager(
+                timeout=self.config.download_timeout,
+                breaker_threshold=self.config.download_circuit_threshold,
+                breaker_cooldown=self.config.download_circuit_cooldown,
+            )
             console.log("🔨 Compiling Plugins & Endpoints...")
             tplugin_with_notification: List[Type[IPlugin]] = []
             for tplugin in self.plugins.values():
@@ -51,6 +74,9 @@ class App(IApp):
                 console.rule("")
             for endpoint in self.endpoints:
                 await endpoint.on_startup()
+            console.log("🔥 Warming up Plugins...")
+            await self.internal_plugins.warmup()
+            await self.plugins.warmup()
             upload_root_path = self.config.upload_root_path
             console.log(f"🔔 Your files will be saved to '{upload_root_path}'")
             console.log("🎉 Backend Server is Ready!")
@@ -59,19 +85,18 @@ class App(IApp):
 
             # shutdown
 
-            await self.http_session.close()
+            await close_http_session()
             for tplugin in self.plugins.values():
                 tplugin.http_session = None
             for endpoint in self.endpoints:
                 await endpoint.on_shutdown()
             self.http_session = None
+            offload_runtime.shutdown()
 
         # config
         self.config = get_config()
-        # clients
-        self.http_session = ClientSession()
         # queue
-        self.request_queue = RequestQueue()
+        self.request_queue = RequestQueue(self.config.num_queue_workers)
         # fastapi
         self.api = FastAPI(lifespan=lifespan)
         self.add_cors()
@@ -111,6 +136,22 @@ class App(IApp):
 
     def add_default_endpoints(self) -> None:
         self.api.get(str(constants.Endpoint.PING))(ping)
+        self.api.get(str(constants.Endpoint.METRICS))(self.get_metrics)
+
+    async def get_metrics(self) -> Dict[str, Any]:
+        return dict(
+            offload=get_offload_stats()._asdict(),
+            result_cache=get_result_cache().stats(),
+            image_derivatives=get_image_derivatives().stats()._asdict(),
+            downloads=get_download_cache().stats()._asdict(),
+            retries=get_retry_manager().stats()._asdict(),
+            websocket=get_outbox_stats()._asdict(),
+            plugin_pools={
+                k: v._asdict()
+                for plugins in [self.plugins, self.internal_plugins]
+                for k, v in plugins.stats().items()
+            },
+        )
 
 
 __all__ = [
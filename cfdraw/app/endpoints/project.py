@@ -2,14 +2,24 @@
 # Should be easy to replace with a more 'formal' database based one
 
 import json
+import queue
 import logging
 import sqlite3
+import threading
 
 from typing import Any
+from typing import Dict
 from typing import List
+from typing import Tuple
+from typing import Iterator
+from typing import Optional
+from pathlib import Path
 from pydantic import BaseModel
+from contextlib import contextmanager
 
+from cfdraw import constants
 from cfdraw.parsers import noli
+from cfdraw.app.schema import IApp
 from cfdraw.core.toolkit.web import raise_err
 from cfdraw.core.toolkit.web import get_responses
 from cfdraw.core.toolkit.misc import get_err_msg
@@ -30,11 +40,317 @@ class ProjectModel(ProjectMeta):
     userId: str
     graphInfo: List[Any]
     globalTransform: noli.Matrix2D
+    version: int = 0
+
+
+class ProjectPatchModel(BaseModel):
+    """
+    Node-level diffs of a project, against the project at `baseVersion`.
+
+    * upserts: the (serialized) root nodes that are added or modified, identified by
+    their `alias`. New nodes will be appended to the end.
+    * deletes: aliases of the root nodes that are removed.
+    * order: the new order of the root nodes (by their aliases), if changed.
+    """
+
+    userId: str
+    uid: str
+    baseVersion: int
+    updateTime: float
+    name: Optional[str] = None
+    globalTransform: Optional[noli.Matrix2D] = None
+    upserts: List[Dict[str, Any]] = []
+    deletes: List[str] = []
+    order: Optional[List[str]] = None
 
 
 class SaveProjectResponse(BaseModel):
     success: bool
     message: str
+    version: Optional[int] = None
+    conflict: bool = False
+
+
+def _get_alias(node: Dict[str, Any]) -> str:
+    return node["info"]["alias"]
+
+
+def apply_patch(graph: Dict[str, Any], patch: Dict[str, Any]) -> None:
+    """
+    Apply the `patch` (dumped from `ProjectPatchModel`) to the `graph` inplace.
+
+    > This method never fails on unknown aliases, so stored patches can always be
+    applied.
+    """
+
+    nodes = {_get_alias(node): node for node in graph["graphInfo"]}
+    for alias in patch["deletes"]:
+        nodes.pop(alias, None)
+    for node in patch["upserts"]:
+        nodes[_get_alias(node)] = node
+    order = patch["order"]
+    if order is not None:
+        ordered = [alias for alias in order if alias in nodes]
+        ordered_set = set(ordered)
+        ordered.extend(alias for alias in nodes if alias not in ordered_set)
+        nodes = {alias: nodes[alias] for alias in ordered}
+    graph["graphInfo"] = list(nodes.values())
+    if patch["globalTransform"] is not None:
+        graph["globalTransform"] = patch["globalTransform"]
+
+
+class ProjectStore:
+    """
+    Stores all projects in a single sqlite table.
+
+    - Metadata are stored in separate columns, and `(userId, updateTime)` is indexed,
+    so listing projects never needs to parse the (heavy) graphs.
+    - Connections are pooled and opened in WAL mode, so reads will not be blocked by
+    writes, and writes are serialized by a lock.
+    - Projects can be saved incrementally (see `ProjectPatchModel`). Each project
+    stores a snapshot of its graph, and the patches after the snapshot will be
+    compacted into a new snapshot every `compact_interval` versions.
+    - Projects stored in the legacy per-user tables will be migrated on creation.
+    """
+
+    schema = [
+        """
+        CREATE TABLE IF NOT EXISTS projects (
+            userId TEXT NOT NULL,
+            uid TEXT NOT NULL,
+            name TEXT NOT NULL,
+            createTime REAL NOT NULL,
+            updateTime REAL NOT NULL,
+            graph TEXT NOT NULL,
+            PRIMARY KEY (userId, uid)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS projects_user_update
+        ON projects (userId, updateTime DESC)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS project_patches (
+            userId TEXT NOT NULL,
+            uid TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            patch TEXT NOT NULL,
+            PRIMARY KEY (userId, uid, version)
+        )
+        """,
+    ]
+    _graph_fields = {"graphInfo", "globalTransform"}
+    _patch_fields = {"globalTransform", "upserts", "deletes", "order"}
+    # columns that are added after the `projects` table is introduced
+    columns = {
+        "version": "INTEGER NOT NULL DEFAULT 0",
+        "snapshotVersion": "INTEGER NOT NULL DEFAULT 0",
+    }
+
+    def __init__(
+        self,
+        path: Path,
+        pool_size: int = 4,
+        compact_interval: int = 32,
+    ) -> None:
+        self.path = path
+        self.compact_interval = compact_interval
+        self._lock = threading.Lock()
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._connections = [self._connect() for _ in range(pool_size)]
+        for conn in self._connections:
+            self._pool.put(conn)
+        with self.write() as conn:
+            for sql in self.schema:
+                conn.execute(sql)
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(projects)")}
+            for column, definition in self.columns.items():
+                if column not in existing:
+                    conn.execute(
+                        f"ALTER TABLE projects ADD COLUMN {column} {definition}"
+                    )
+
+    @contextmanager
+    def read(self) -> Iterator[sqlite3.Connection]:
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def write(self) -> Iterator[sqlite3.Connection]:
+        """the transaction will be committed on success, and rolled back otherwise"""
+
+        with self._lock, self.read() as conn, conn:
+            yield conn
+
+    def save(self, data: ProjectModel) -> int:
+        """save the whole project as a new snapshot, return the new version"""
+
+        with self.write() as conn:
+            return self._insert(conn, data)
+
+    def save_patch(self, patch: ProjectPatchModel) -> SaveProjectResponse:
+        with self.write() as conn:
+            sql = "SELECT version, snapshotVersion FROM projects "
+            sql += "WHERE userId = ? AND uid = ?"
+            row = conn.execute(sql, (patch.userId, patch.uid)).fetchone()
+            if row is None:
+                msg = f"project '{patch.uid}' does not exist"
+                return SaveProjectResponse(success=False, message=msg)
+            version, snapshot_version = row
+            if version != patch.baseVersion:
+                msg = f"project is at version {version}, not {patch.baseVersion}"
+                return SaveProjectResponse(
+                    success=False,
+                    message=msg,
+                    version=version,
+                    conflict=True,
+                )
+            version += 1
+            d = patch.model_dump(include=self._patch_fields)
+            sql = "INSERT INTO project_patches VALUES (?, ?, ?, ?)"
+            conn.execute(sql, (patch.userId, patch.uid, version, json.dumps(d)))
+            sql = "UPDATE projects SET version = ?, updateTime = ?, "
+            sql += "name = COALESCE(?, name) WHERE userId = ? AND uid = ?"
+            args = version, patch.updateTime, patch.name, patch.userId, patch.uid
+            conn.execute(sql, args)
+            if version - snapshot_version >= self.compact_interval:
+                self._compact(conn, patch.userId, patch.uid)
+        return SaveProjectResponse(success=True, message="", version=version)
+
+    def get(self, userId: str, uid: str) -> ProjectModel:
+        with self.read() as conn:
+            # the snapshot & the patches should be read in the same transaction
+            conn.execute("BEGIN")
+            try:
+                row = self._get_row(conn, userId, uid)
+            finally:
+                conn.rollback()
+        name, create_time, update_time, version, graph = row
+        return ProjectModel(
+            uid=uid,
+            name=name,
+            createTime=create_time,
+            updateTime=update_time,
+            userId=userId,
+            version=version,
+            **graph,
+        )
+
+    def get_all(self, userId: str) -> List[ProjectMeta]:
+        with self.read() as conn:
+            sql = "SELECT uid, name, createTime, updateTime FROM projects "
+            sql += "WHERE userId = ? ORDER BY updateTime DESC"
+            rows = conn.execute(sql, (userId,)).fetchall()
+        return [
+            ProjectMeta(uid=uid, name=name, createTime=create, updateTime=update)
+            for uid, name, create, update in rows
+        ]
+
+    def delete(self, userId: str, uid: str) -> None:
+        with self.write() as conn:
+            args = userId, uid
+            conn.execute("DELETE FROM projects WHERE userId = ? AND uid = ?", args)
+            sql = "DELETE FROM project_patches WHERE userId = ? AND uid = ?"
+            conn.execute(sql, args)
+
+    def migrate(self, legacy_path: Path) -> None:
+        """
+        Migrate projects from the legacy database, in which each user has its own
+        `(uid, json)` table. The legacy database will be renamed afterwards, so the
+        migration will only happen once.
+        """
+
+        if not legacy_path.is_file():
+            return None
+        legacy = sqlite3.connect(legacy_path)
+        try:
+            sql = "SELECT name FROM sqlite_master WHERE type='table'"
+            tables = [row[0] for row in legacy.execute(sql).fetchall()]
+            num_projects = 0
+            with self.write() as conn:
+                for table in tables:
+                    escaped = table.replace('"', '""')
+                    rows = legacy.execute(f'SELECT json FROM "{escaped}"').fetchall()
+                    for (json_string,) in rows:
+                        try:
+                            d = json.loads(json_string)
+                            d.setdefault("userId", table)
+                            self._insert(conn, ProjectModel(**d))
+                            num_projects += 1
+                        except Exception:
+                            logging.exception(
+                                f"failed to migrate a project of '{table}'"
+                            )
+        finally:
+            legacy.close()
+        legacy_path.rename(legacy_path.with_name(f"{legacy_path.name}.migrated"))
+        msg = f"migrated {num_projects} projects of {len(tables)} users"
+        logging.info(f"{msg} from '{legacy_path}'")
+
+    def close(self) -> None:
+        for conn in self._connections:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30.0)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _insert(self, conn: sqlite3.Connection, data: ProjectModel) -> int:
+        sql = "SELECT version FROM projects WHERE userId = ? AND uid = ?"
+        row = conn.execute(sql, (data.userId, data.uid)).fetchone()
+        version = 1 if row is None else row[0] + 1
+        graph = data.model_dump(include=self._graph_fields)
+        sql = "INSERT OR REPLACE INTO projects (userId, uid, name, createTime, "
+        sql += "updateTime, graph, version, snapshotVersion) "
+        sql += "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+        conn.execute(
+            sql,
+            (
+                data.userId,
+                data.uid,
+                data.name,
+                data.createTime,
+                data.updateTime,
+                json.dumps(graph),
+                version,
+                version,
+            ),
+        )
+        sql = "DELETE FROM project_patches WHERE userId = ? AND uid = ?"
+        conn.execute(sql, (data.userId, data.uid))
+        return version
+
+    def _get_row(
+        self,
+        conn: sqlite3.Connection,
+        userId: str,
+        uid: str,
+    ) -> Tuple[str, float, float, int, Dict[str, Any]]:
+        sql = "SELECT name, createTime, updateTime, version, graph FROM projects "
+        sql += "WHERE userId = ? AND uid = ?"
+        row = conn.execute(sql, (userId, uid)).fetchone()
+        if row is None:
+            raise ValueError(f"project '{uid}' does not exist")
+        name, create_time, update_time, version, graph_string = row
+        graph = json.loads(graph_string)
+        sql = "SELECT patch FROM project_patches "
+        sql += "WHERE userId = ? AND uid = ? ORDER BY version"
+        for (patch,) in conn.execute(sql, (userId, uid)):
+            apply_patch(graph, json.loads(patch))
+        return name, create_time, update_time, version, graph
+
+    def _compact(self, conn: sqlite3.Connection, userId: str, uid: str) -> None:
+        *_, version, graph = self._get_row(conn, userId, uid)
+        sql = "UPDATE projects SET graph = ?, snapshotVersion = ? "
+        sql += "WHERE userId = ? AND uid = ?"
+        conn.execute(sql, (json.dumps(graph), version, userId, uid))
+        sql = "DELETE FROM project_patches WHERE userId = ? AND uid = ?"
+        conn.execute(sql, (userId, uid))
 
 
 def add_project_managements(endpoint: "ProjectEndpoint") -> None:
@@ -42,71 +358,82 @@ def add_project_managements(endpoint: "ProjectEndpoint") -> None:
 
     @app.api.post("/save_project", responses=get_responses(SaveProjectResponse))
     def save_project(data: ProjectModel) -> SaveProjectResponse:
-        with endpoint.get_conn(data.userId) as conn:
-            try:
-                sql = f"INSERT OR REPLACE INTO '{data.userId}' VALUES (?, ?)"
-                conn.execute(sql, [data.uid, json.dumps(data.model_dump())])
-                conn.commit()
-            except Exception as err:
-                logging.exception(f"failed to save project '{data.uid}'")
-                err_msg = get_err_msg(err)
-                return SaveProjectResponse(success=False, message=err_msg)
-        return SaveProjectResponse(success=True, message="")
+        try:
+            version = endpoint.store.save(data)
+        except Exception as err:
+            logging.exception(f"failed to save project '{data.uid}'")
+            err_msg = get_err_msg(err)
+            return SaveProjectResponse(success=False, message=err_msg)
+        return SaveProjectResponse(success=True, message="", version=version)
+
+    @app.api.post(
+        "/save_project_patch",
+        responses=get_responses(SaveProjectResponse),  # type: ignore[arg-type]
+    )
+    def save_project_patch(data: ProjectPatchModel) -> SaveProjectResponse:
+        """
+        Save the project incrementally. If the project is not at `baseVersion`, the
+        patch will be rejected with `conflict=True` and the current `version`, and the
+        client should fetch the project (or save the whole project) again.
+        """
+
+        try:
+            return endpoint.store.save_patch(data)
+        except Exception as err:
+            logging.exception(f"failed to save patch of project '{data.uid}'")
+            err_msg = get_err_msg(err)
+            return SaveProjectResponse(success=False, message=err_msg)
 
     @app.api.get("/get_project/", responses=get_responses(ProjectModel))
-    async def fetch_project(userId: str, uid: str) -> ProjectModel:  # type: ignore
+    def fetch_project(userId: str, uid: str) -> ProjectModel:  # type: ignore
         # TODO: should do some url transformations in the
         # migration stage, not runtime stage. Will be fixed in the future
 
         try:
-            with endpoint.get_conn(userId) as conn:
-                sql = f"SELECT json FROM '{userId}' WHERE uid='{uid}'"
-                results = conn.execute(sql)
-                json_string = results.fetchone()[0]
-                d = json.loads(json_string)
-            return ProjectModel(**d)
+            return endpoint.store.get(userId, uid)
         except Exception as err:
             raise_err(err)
 
     @app.api.get("/all_projects/")
-    async def fetch_all_projects(userId: str) -> List[ProjectMeta]:
-        with endpoint.get_conn(userId) as conn:
-            try:
-                sql = f"SELECT json FROM '{userId}'"
-                results = conn.execute(sql)
-                json_strings = [result[0] for result in results.fetchall()]
-                json_dicts = list(map(json.loads, json_strings))
-                sorted_pairs = sorted(
-                    [
-                        (json_dict["updateTime"], i)
-                        for i, json_dict in enumerate(json_dicts)
-                    ],
-                    reverse=True,
-                )
-                metas = [ProjectMeta(**json_dicts[i]) for _, i in sorted_pairs]
-                return metas
-            except Exception:
-                logging.exception("failed to fetch all projects")
-                return []
+    def fetch_all_projects(userId: str) -> List[ProjectMeta]:
+        try:
+            return endpoint.store.get_all(userId)
+        except Exception:
+            logging.exception("failed to fetch all projects")
+            return []
 
     @app.api.delete("/projects/")
-    async def delete_project(userId: str, uid: str) -> None:
-        with endpoint.get_conn(userId) as conn:
-            sql = f"DELETE FROM '{userId}' WHERE uid='{uid}'"
-            conn.execute(sql)
-            conn.commit()
+    def delete_project(userId: str, uid: str) -> None:
+        endpoint.store.delete(userId, uid)
 
 
 class ProjectEndpoint(IEndpoint):
+    def __init__(self, app: IApp) -> None:
+        super().__init__(app)
+        self._store: Optional[ProjectStore] = None
+        self._store_lock = threading.Lock()
+
     def register(self) -> None:
         add_project_managements(self)
 
-    def get_conn(self, userId: str) -> sqlite3.Connection:
-        folder = self.app.config.upload_project_folder
-        conn = sqlite3.connect(folder / "projects.sqlite")
-        sql = f"create table if not exists '{userId}' (uid text PRIMARY KEY, json text)"
-        conn.execute(sql)
-        return conn
+    async def on_startup(self) -> None:
+        # create the store (and migrate legacy projects) eagerly
+        self.store
+
+    async def on_shutdown(self) -> None:
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+    @property
+    def store(self) -> ProjectStore:
+        with self._store_lock:
+            if self._store is None:
+                folder = self.app.config.upload_project_folder
+                store = ProjectStore(folder / constants.PROJECT_STORE_FILE)
+                store.migrate(folder / constants.LEGACY_PROJECT_STORE_FILE)
+                self._store = store
+            return self._store
 
 
 __all__ = [
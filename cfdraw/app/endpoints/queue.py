@@ -3,10 +3,12 @@ import logging
 
 from typing import Dict
 from typing import List
+from typing import Callable
 from typing import Tuple
 from typing import Generic
 from typing import Iterator
 from typing import Optional
+from dataclasses import dataclass
 
 from cfdraw.app.schema import IRequestQueue
 from cfdraw.app.schema import IRequestQueueData
@@ -15,6 +17,7 @@ from cfdraw.utils.misc import offload
 from cfdraw.schema.plugins import ISend
 from cfdraw.schema.plugins import SocketStatus
 from cfdraw.schema.plugins import ISocketMessage
+from cfdraw.schema.plugins import TaskCancelledError
 from cfdraw.core.toolkit.misc import get_err_msg
 from cfdraw.core.toolkit.misc import random_hash
 from cfdraw.core.toolkit.data_structures import Item
@@ -26,9 +29,23 @@ DEBUG = False
 
 
 class QueuesInQueue(Generic[TItemData]):
+    """
+    A queue of (per-user) queues, items are picked in a round-robin manner.
+
+    - The effective position of every item is indexed. Each mutation (push / remove /
+    moving the cursor) invalidates the index, and the next lookup rebuilds it in one
+    O(n) pass, after which `get_position` is O(1) until the next mutation.
+    - A single push or removal may shift the positions of all the items behind it
+    (and moving the cursor rotates all of them), so the rebuild is not done
+    incrementally: broadcasting the new positions is O(n) per mutation anyway.
+    """
+
     def __init__(self, *, no_mapping: bool = True) -> None:
         self._cursor = 0
+        self._num_items = 0
         self._queues: Bundle[Bundle[TItemData]] = Bundle(no_mapping=no_mapping)
+        self._order: List[Item[TItemData]] = []
+        self._positions: Optional[Dict[str, int]] = None
 
     def __iter__(self) -> Iterator[Item[Bundle[TItemData]]]:
         return iter(self._queues)
@@ -43,7 +60,7 @@ class QueuesInQueue(Generic[TItemData]):
 
     @property
     def num_items(self) -> int:
-        return sum(len(q.data) for q in self._queues)
+        return self._num_items
 
     def get(self, queue_id: str) -> Optional[Item[Bundle[TItemData]]]:
         return self._queues.get(queue_id)
@@ -56,65 +73,136 @@ class QueuesInQueue(Generic[TItemData]):
             queue = Bundle()
             self._queues.push(Item(queue_id, queue))
         queue.push(item)
+        self._num_items += 1
+        self._invalidate()
+
+    def next(
+        self,
+        condition: Optional[Callable[[Item[TItemData]], bool]] = None,
+    ) -> Tuple[Optional[str], Optional[Item[TItemData]]]:
+        """
+        Pick the next item in a round-robin manner.
 
-    def next(self) -> Tuple[Optional[str], Optional[Item[TItemData]]]:
+        - If `condition` is provided, the first item (of the current queue) which
+        satisfies the `condition` will be picked, and queues without such items
+        will be skipped.
+        """
+
+        for queue_item in list(self._queues):
+            if queue_item.data.is_empty:
+                self._queues.remove(queue_item.key)
+                self._invalidate()
         if self._queues.is_empty:
             return None, None
-        self._cursor %= len(self._queues)
-        queue = self._queues.get_index(self._cursor)
-        item = queue.data.first
-        if item is None:
-            self._queues.remove(queue.key)
-            return self.next()
-        self._cursor += 1
-        return queue.key, item
+        num_queues = len(self._queues)
+        self._cursor %= num_queues
+        for offset in range(num_queues):
+            index = (self._cursor + offset) % num_queues
+            queue = self._queues.get_index(index)
+            for item in queue.data:
+                if condition is None or condition(item):
+                    if self._cursor != index + 1:
+                        self._cursor = index + 1
+                        self._invalidate()
+                    return queue.key, item
+        return None, None
 
     def remove(self, queue_id: str, item_key: str) -> None:
         queue_item = self._queues.get(queue_id)
         if queue_item is None:
             return
-        queue_item.data.remove(item_key)
+        if queue_item.data.remove(item_key) is not None:
+            self._num_items -= 1
+            self._invalidate()
         if queue_item.data.is_empty:
             self._queues.remove(queue_id)
 
+    def get_position(self, item_key: str) -> Optional[int]:
+        """
+        Get the number of items ahead of `item_key`, return `None` if not found.
+        """
+
+        return self._get_positions().get(item_key)
+
     def get_pending(self, item_key: str) -> Optional[List[Item[TItemData]]]:
-        if self._queues.is_empty:
+        position = self.get_position(item_key)
+        if position is None:
             return None
+        return self._order[:position]
+
+    # internal
+
+    def _invalidate(self) -> None:
+        self._positions = None
+
+    def _get_positions(self) -> Dict[str, int]:
+        if self._positions is not None:
+            return self._positions
+        self._order = []
+        self._positions = {}
+        num_queues = len(self._queues)
+        if num_queues == 0:
+            return self._positions
+        # the queue before the cursor is the one which is picked most recently,
+        # so it is placed at the beginning of the round-robin order
+        init = (self._cursor + num_queues - 1) % num_queues
+        active = [
+            self._queues.get_index((init + i) % num_queues).data
+            for i in range(num_queues)
+        ]
         layer = 0
-        searched = False
-        pending: List[Item[TItemData]] = []
-        finished_searching = [False] * len(self._queues)
-
-        init = (self._cursor + len(self._queues) - 1) % len(self._queues)
-        cursor = init
-        while not all(finished_searching):
-            if not finished_searching[cursor]:
-                queue = self._queues.get_index(cursor)
-                if layer >= len(queue.data):
-                    finished_searching[cursor] = True
-                else:
-                    item = queue.data.get_index(layer)
-                    if item.key == item_key:
-                        searched = True
-                        break
-                    pending.append(item)
-            cursor = (cursor + 1) % len(self._queues)
-            if cursor == init:
-                layer += 1
+        while active:
+            remaining = []
+            for queue in active:
+                if layer < len(queue):
+                    item = queue.get_index(layer)
+                    self._positions[item.key] = len(self._order)
+                    self._order.append(item)
+                    remaining.append(queue)
+            active = remaining
+            layer += 1
+        return self._positions
 
-        return pending if searched else None
+
+DEFAULT_CONCURRENCY_KEY = "$default$"
+
+
+@dataclass
+class ConcurrencyInfo:
+    key: str
+    limit: int
 
 
 class RequestQueue(IRequestQueue):
-    def __init__(self) -> None:
+    """
+    A request queue which executes requests from different users in a
+    round-robin manner.
+
+    - At most `max_workers` requests will be executed concurrently.
+    - Requests of plugins with the same `concurrency_key` are further bounded
+    by the `max_concurrency` of the plugins.
+    """
+
+    def __init__(self, max_workers: int = 1) -> None:
+        if max_workers < 1:
+            raise ValueError(f"`max_workers` should be positive, {max_workers} found")
+        self.max_workers = max_workers
         self._queues = QueuesInQueue[IRequestQueueData]()
         self._senders: Dict[str, Tuple[str, ISend]] = {}
-        self._busy_uid: Optional[str] = None
+        self._concurrency: Dict[str, ConcurrencyInfo] = {}
+        self._running: Dict[str, str] = {}
+        self._running_counts: Dict[str, int] = {}
+        self._broadcasted: Dict[str, int] = {}
+        self._broadcasting = False
+        self._broadcast_again = False
 
     def push(self, data: IRequestQueueData, send_message: ISend) -> str:
         uid = random_hash()
         self._queues.push(data.request.userId, Item(uid, data))
         self._senders[uid] = data.request.hash, send_message
+        settings = data.plugin.settings
+        key = settings.concurrency_key or DEFAULT_CONCURRENCY_KEY
+        self._concurrency[uid] = ConcurrencyInfo(key, settings.max_concurrency)
         if DEBUG:
             print("~" * 50)
             print("> push.uid", uid)
@@ -124,37 +212,60 @@ class RequestQueue(IRequestQueue):
         return uid
 
     async def run(self) -> None:
-        if self._busy_uid is not None:
-            return
-        while True:
-            user_id, request_item = self._queues.next()
+        while len(self._running) < self.max_workers:
+            user_id, request_item = self._queues.next(self._is_ready)
             if user_id is None or request_item is None:
-                self._busy_uid = None
                 break
             uid = request_item.key
-            plugin = request_item.data.plugin
-            request = request_item.data.request
-            self._busy_uid = uid
-            if DEBUG:
-                print(">>> run", uid)
-            try:
-                plugin.elapsed_times.start()
-                if await self._broadcast_working(uid):
-                    future = plugin(request)
-                    if not plugin.settings.no_offload:
-                        future = offload(future)
-                    await future
-            except Exception as err:
-                logging.exception(f"failed to execute plugin '{plugin}'")
-                await self._broadcast_exception(uid, get_err_msg(err))
-            # cleanup
-            request_item.data.event.set()
-            self._queues.remove(user_id, uid)
-            self._senders.pop(uid, None)
-            await self._broadcast_pending()
-            await asyncio.sleep(0)
-            if DEBUG:
-                print(">>> cleanup", uid)
+            key = self._concurrency[uid].key
+            self._running[uid] = key
+            self._running_counts[key] = self._running_counts.get(key, 0) + 1
+            asyncio.create_task(self._execute(user_id, request_item))
+
+    def _is_ready(self, request_item: Item[IRequestQueueData]) -> bool:
+        uid = request_item.key
+        if uid in self._running:
+            return False
+        info = self._concurrency[uid]
+        return self._running_counts.get(info.key, 0) < info.limit
+
+    async def _execute(
+        self,
+        user_id: str,
+        request_item: Item[IRequestQueueData],
+    ) -> None:
+        uid = request_item.key
+        plugin = request_item.data.plugin
+        request = request_item.data.request
+        if DEBUG:
+            print(">>> run", uid)
+        try:
+            plugin.elapsed_times.start()
+            # the request may be cancelled right before being picked up
+            cancelled = plugin.cancel_token.cancelled
+            if not cancelled and await self._broadcast_working(uid):
+                future = plugin(request)
+                if not plugin.settings.no_offload:
+                    future = offload(future)
+                await future
+        except TaskCancelledError:
+            console.log(f"plugin '{plugin}' is cancelled ({request.hash})")
+        except Exception as err:
+            logging.exception(f"failed to execute plugin '{plugin}'")
+            await self._broadcast_exception(uid, get_err_msg(err))
+        # cleanup
+        request_item.data.event.set()
+        self._queues.remove(user_id, uid)
+        self._senders.pop(uid, None)
+        self._concurrency.pop(uid, None)
+        self._broadcasted.pop(uid, None)
+        key = self._running.pop(uid)
+        self._running_counts[key] -= 1
+        await self._broadcast_pending()
+        await asyncio.sleep(0)
+        if DEBUG:
+            print(">>> cleanup", uid)
+        await self.run()
 
     async def wait(self, user_id: str, uid: str) -> None:
         # Maybe in some rare cases, the task completes so fast that
@@ -176,13 +287,59 @@ class RequestQueue(IRequestQueue):
             print("> finished", uid)
             print("^" * 50)
 
+    async def cancel(self, user_id: str, uid: str) -> bool:
+        """
+        Cancel the request `uid`. Pending requests are removed from the queue right
+        away, running ones are signalled by their `cancel_token`, and will release
+        the slot once the plugin returns.
+        """
+
+        queue_item = self._queues.get(user_id)
+        if queue_item is None:
+            return False
+        request_item = queue_item.data.get(uid)
+        if request_item is None:
+            return False
+        if DEBUG:
+            print(">>> cancel", uid)
+        request_item.data.plugin.cancel_token.cancel()
+        if uid in self._running:
+            return True
+        self._queues.remove(user_id, uid)
+        self._senders.pop(uid, None)
+        self._concurrency.pop(uid, None)
+        self._broadcasted.pop(uid, None)
+        request_item.data.event.set()
+        # positions of the following requests are changed
+        await self._broadcast_pending()
+        return True
+
     # broadcast
 
     async def _broadcast_pending(self) -> None:
-        for uid, (hash, sender) in self._senders.items():
-            if uid == self._busy_uid:
+        # coalesce concurrent broadcasts: if a broadcast is in progress, it will
+        # simply run again after it finishes, with the latest positions
+        if self._broadcasting:
+            self._broadcast_again = True
+            return
+        self._broadcasting = True
+        try:
+            while True:
+                self._broadcast_again = False
+                await self._broadcast_pending_once()
+                if not self._broadcast_again:
+                    break
+        finally:
+            self._broadcasting = False
+
+    async def _broadcast_pending_once(self) -> None:
+        for uid, (hash, sender) in list(self._senders.items()):
+            if uid in self._running:
+                continue
+            pending = self._queues.get_position(uid)
+            # only clients whose position actually changed will be notified
+            if pending is not None and pending == self._broadcasted.get(uid):
                 continue
-            pending = self._queues.get_pending(uid)
             if DEBUG:
                 print("-" * 50)
                 print(">> uid", uid)
@@ -213,17 +370,19 @@ class RequestQueue(IRequestQueue):
                         "cannot find pending request after submitted"
                     )
                     success = await sender(ISocketMessage.make_exception(hash, message))
-                elif len(pending) > 0:
-                    message = prefix
-                    success = await sender(
-                        ISocketMessage(
-                            hash=hash,
-                            status=SocketStatus.PENDING,
-                            total=self._queues.num_items,
-                            pending=len(pending),
-                            message=message,
+                else:
+                    self._broadcasted[uid] = pending
+                    if pending > 0:
+                        message = prefix
+                        success = await sender(
+                            ISocketMessage(
+                                hash=hash,
+                                status=SocketStatus.PENDING,
+                                total=self._queues.num_items,
+                                pending=pending,
+                                message=message,
+                            )
                         )
-                    )
             except Exception:
                 logging.exception(f"{prefix} failed to send message '{message}'")
             if not success:
@@ -4,6 +4,7 @@ import logging
 from io import BytesIO
 from PIL import Image
 from typing import Union
+from typing import Mapping
 from typing import Optional
 from fastapi import File
 from fastapi import Form
@@ -16,10 +17,12 @@ from PIL.PngImagePlugin import PngInfo
 from cfdraw import constants
 from cfdraw.app.schema import IApp
 from cfdraw.utils.server import save_svg
-from cfdraw.utils.server import save_image
+from cfdraw.utils.server import save_image_async
+from cfdraw.utils.server import get_image_path
 from cfdraw.utils.server import get_svg_response
-from cfdraw.utils.server import get_image_response
+from cfdraw.utils.server import get_image_file_response
 from cfdraw.app.endpoints.base import IEndpoint
+from cfdraw.core.toolkit.web import raise_err
 from cfdraw.core.toolkit.web import get_responses
 from cfdraw.core.toolkit.web import get_image_response_kwargs
 from cfdraw.core.toolkit.misc import get_err_msg
@@ -43,13 +46,14 @@ class FetchImageModel(BaseModel):
     url: str
     jpeg: bool
     return_image: bool = False
+    max_size: Optional[int] = None
 
 
 class ImageUploader:
     """
     Modify this class if you need to customize image handling processes.
     * `upload_image`: save an image with given `contents`, will be better if `meta` can be stored.
-    * `fetch_image`: fetch an image based on `url` and `jpeg` flag.
+    * `fetch_image`: fetch an image based on `url`, `jpeg` flag and `max_size`.
     """
 
     @staticmethod
@@ -65,6 +69,9 @@ class ImageUploader:
         When this method is used in the:
         * `upload_image` endpoint, `contents` will be a `bytes` object.
         * `FieldsMiddleware`, `contents` will be an `Image.Image` object.
+
+        > Images are encoded in a bounded pool (see `get_image_encoder`), so uploads
+        will not block the event loop, and multiple uploads can run in parallel.
         """
 
         if is_svg:
@@ -76,12 +83,21 @@ class ImageUploader:
             image = contents
         else:
             image = Image.open(BytesIO(contents))
-        return ImageDataModel(**save_image(image, meta, base_url))
+        return ImageDataModel(**await save_image_async(image, meta, base_url))
 
     @staticmethod
-    async def fetch_image(data: FetchImageModel) -> Union[Response, Image.Image]:
+    async def fetch_image(  # type: ignore
+        data: FetchImageModel,
+        request_headers: Optional[Mapping[str, str]] = None,
+    ) -> Union[Response, Image.Image]:
         file = data.url.split(constants.UPLOAD_IMAGE_FOLDER_NAME)[1][1:]  # remove '/'
-        return get_image_response(file, data.jpeg, data.return_image)
+        try:
+            path = await get_image_path(file, data.jpeg, data.max_size)
+            if data.return_image:
+                return Image.open(path)
+            return get_image_file_response(path, request_headers or {})
+        except Exception as err:
+            raise_err(err)
 
 
 def add_upload_image(app: IApp) -> None:
@@ -112,17 +128,26 @@ def add_upload_image(app: IApp) -> None:
         return UploadImageResponse(success=True, message="", data=data)
 
     @app.api.post("/fetch_image", **get_image_response_kwargs())
-    async def fetch_image(data: FetchImageModel) -> Response:
-        return await ImageUploader.fetch_image(data)
+    async def fetch_image(data: FetchImageModel, request: Request) -> Response:
+        return await ImageUploader.fetch_image(data, request.headers)  # type: ignore
 
     @app.api.get(
         f"/{constants.UPLOAD_IMAGE_FOLDER_NAME}/{{file}}/",
         **get_image_response_kwargs(),
     )
-    async def get_image(file: str, jpeg: bool = False) -> Response:
+    async def get_image(  # type: ignore
+        file: str,
+        request: Request,
+        jpeg: bool = False,
+        max_size: Optional[int] = None,
+    ) -> Response:
         if file.endswith(".svg"):
             return get_svg_response(file)
-        return get_image_response(file, jpeg)
+        try:
+            path = await get_image_path(file, jpeg, max_size)
+            return get_image_file_response(path, request.headers)
+        except Exception as err:
+            raise_err(err)
 
 
 class UploadEndpoint(IEndpoint):
@@ -1,8 +1,18 @@
-import json
+import time
 import asyncio
 import logging
 
+from typing import Any
+from typing import Dict
+from typing import Deque
+from typing import Tuple
+from typing import Union
+from typing import Optional
+from typing import NamedTuple
 from fastapi import WebSocket
+from pydantic import BaseModel
+from pydantic import ValidationError
+from collections import deque
 from fastapi import WebSocketDisconnect
 from starlette.websockets import WebSocketState
 
@@ -11,80 +21,450 @@ from cfdraw.app.schema import IApp
 from cfdraw.app.schema import IRequestQueueData
 from cfdraw.core.toolkit import console
 from cfdraw.utils.misc import offload
-from cfdraw.schema.plugins import ElapsedTimes
+from cfdraw.utils.codec import decode_model
+from cfdraw.utils.codec import get_json_codec
+from cfdraw.schema.plugins import RequestContext
+from cfdraw.schema.plugins import SocketStatus
 from cfdraw.schema.plugins import ISocketRequest
+from cfdraw.schema.plugins import ISocketCancelRequest
+from cfdraw.schema.plugins import ISocketFrame
 from cfdraw.schema.plugins import ISocketMessage
+from cfdraw.schema.plugins import CancellationToken
+from cfdraw.schema.plugins import TaskCancelledError
 from cfdraw.app.endpoints.base import IEndpoint
+from cfdraw.plugins.middlewares.cache import get_result_cache
+from cfdraw.core.toolkit.web import get_responses
 from cfdraw.core.toolkit.misc import get_err_msg
 
 
-def add_websocket(app: IApp) -> None:
-    @app.api.websocket(str(constants.Endpoint.WEBSOCKET))
-    async def websocket(websocket: WebSocket) -> None:
-        async def on_failed(e: Exception, hash: str) -> None:
-            logging.exception(e)
-            await websocket.send_text(
-                json.dumps(
-                    ISocketMessage.make_exception(
-                        hash,
-                        message=f"Invalid data: {get_err_msg(e)}",
-                    ).model_dump()
-                )
-            )
+async def receive_frame(websocket: WebSocket) -> Union[str, bytes]:
+    """receive a text / bytes frame, both of which should contain a json payload"""
+
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    text = message.get("text")
+    if text is not None:
+        return text
+    return message["bytes"]
+
+
+def get_request_hash(raw_data: Union[str, bytes]) -> str:
+    try:
+        payload: Any = get_json_codec().loads(raw_data)
+    except Exception:
+        return "unknown"
+    if not isinstance(payload, dict):
+        return "unknown"
+    return str(payload.get("hash", "unknown"))
+
+
+# outbound queue
+
+
+TERMINAL_STATUSES = {
+    SocketStatus.FINISHED,
+    SocketStatus.EXCEPTION,
+    SocketStatus.INTERRUPTED,
+}
+
+
+class OutboxStats(NamedTuple):
+    connections: int
+    queued: int
+    sent: int
+    dropped: int
+    backlog: int
+    max_backlog: int
+    send_time: float
+    max_send_time: float
+
+
+class SocketOutbox:
+    """
+    The outbound queue of a websocket connection, messages are sent by a single
+    writer task, so senders (plugins, the request queue) never wait for the client.
+
+    * Terminal messages (finished / exception / interrupted) are always sent, in
+    the order they are queued.
+    * For other messages (pending / working, e.g. progress updates), only the latest
+    one of each task (hash) is kept. Queued ones are dropped when a newer one, or the
+    terminal message of the same task, arrives - which is what happens when the
+    socket is congested (the writer is still waiting for the previous sends).
+    * If `max_progress_rate` is provided, non-terminal messages of each task are sent
+    at most `max_progress_rate` times per second.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        max_progress_rate: Optional[float],
+    ) -> None:
+        self.websocket = websocket
+        if not max_progress_rate:
+            self.min_interval = 0.0
+        else:
+            self.min_interval = 1.0 / max_progress_rate
+        self.closed = False
+        self._terminals: Deque[ISocketFrame] = deque()
+        self._latest: Dict[str, ISocketFrame] = {}
+        self._last_sent: Dict[str, float] = {}
+        self._event = asyncio.Event()
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    @property
+    def backlog(self) -> int:
+        return len(self._terminals) + len(self._latest)
+
+    def start(self) -> None:
+        _stats["connections"] += 1
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def put(self, message: Union[ISocketMessage, ISocketFrame]) -> bool:
+        if self.closed or self.websocket.client_state == WebSocketState.DISCONNECTED:
+            return False
+        if isinstance(message, ISocketMessage):
+            message = message.to_frame()
+        _stats["queued"] += 1
+        backlog = self.backlog
+        if message.status in TERMINAL_STATUSES:
+            # the task is done, its pending progress is stale
+            if self._latest.pop(message.hash, None) is not None:
+                _stats["dropped"] += 1
+            self._last_sent.pop(message.hash, None)
+            self._terminals.append(message)
+        else:
+            if self._latest.pop(message.hash, None) is not None:
+                _stats["dropped"] += 1
+            self._latest[message.hash] = message
+        _stats["backlog"] += self.backlog - backlog
+        _stats["max_backlog"] = max(_stats["max_backlog"], self.backlog)
+        self._event.set()
+        return True
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        _stats["connections"] -= 1
+        _stats["backlog"] -= self.backlog
+        self._terminals.clear()
+        self._latest.clear()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while not self.closed:
+                self._event.clear()
+                frame, delay = self._next(loop.time())
+                if frame is None:
+                    if delay is None:
+                        await self._event.wait()
+                    else:
+                        try:
+                            await asyncio.wait_for(self._event.wait(), delay)
+                        except asyncio.TimeoutError:
+                            pass
+                    continue
+                _stats["backlog"] -= 1
+                t = time.time()
+                # frames are sent as text, because the frontend expects text frames
+                await self.websocket.send_text(frame.text)
+                send_time = time.time() - t
+                _stats["sent"] += 1
+                _stats["send_time"] += send_time
+                _stats["max_send_time"] = max(_stats["max_send_time"], send_time)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # the client is gone, following messages will be rejected by `put`
+            self.close()
+
+    def _next(self, now: float) -> Tuple[Optional[ISocketFrame], Optional[float]]:
+        if self._terminals:
+            return self._terminals.popleft(), None
+        delay = None
+        for hash in self._latest:
+            last_sent = self._last_sent.get(hash)
+            if last_sent is None or now - last_sent >= self.min_interval:
+                self._last_sent[hash] = now
+                return self._latest.pop(hash), None
+            remaining = last_sent + self.min_interval - now
+            delay = remaining if delay is None else min(delay, remaining)
+        return None, delay
+
+
+_stats: Dict[str, Any] = dict(
+    connections=0,
+    queued=0,
+    sent=0,
+    dropped=0,
+    backlog=0,
+    max_backlog=0,
+    send_time=0.0,
+    max_send_time=0.0,
+)
+
+
+def get_outbox_stats() -> OutboxStats:
+    return OutboxStats(**_stats)
+
+
+# connection
+
+
+class SocketConnection:
+    """
+    Serves a websocket connection. Incoming requests are handled concurrently, so
+    a long running (internal) request will not block the following ones, e.g. a
+    cancel request.
+
+    * Internal plugins are executed directly, at most `max_concurrency` of them
+    will be executed concurrently (per connection).
+    * Other plugins are pushed to the request queue, which has its own limits.
+    * A request can be cancelled by sending `{"cancel": hash, "userId": userId}` (or
+    by the `cancel` endpoint) with the `userId` of the request, an `interrupted`
+    message will be sent. Pending requests are removed
+    from the request queue, running ones are signalled by their `cancel_token`
+    (and no more messages of them will be sent).
+    * All requests of the connection are cancelled when it is disconnected.
+    """
 
-        async def send_message(data: ISocketMessage) -> bool:
-            if websocket.client_state == WebSocketState.DISCONNECTED:
+    def __init__(self, app: IApp, websocket: WebSocket) -> None:
+        self.app = app
+        self.websocket = websocket
+        self.outbox = SocketOutbox(websocket, app.config.progress_max_rate)
+        self._semaphore = asyncio.Semaphore(max(1, app.config.socket_max_concurrency))
+        self._tasks: Dict[str, "asyncio.Task[None]"] = {}
+        self._tokens: Dict[str, CancellationToken] = {}
+        self._users: Dict[str, str] = {}
+
+    async def send_message(self, data: Union[ISocketMessage, ISocketFrame]) -> bool:
+        return self.outbox.put(data)
+
+    async def serve(self) -> None:
+        await self.websocket.accept()
+        self.outbox.start()
+        try:
+            while True:
+                raw_data = data = None
+                try:
+                    raw_data = await receive_frame(self.websocket)
+                    data = decode_request(raw_data)
+                    if isinstance(data, ISocketCancelRequest):
+                        await self.cancel(data.cancel, user_id=data.userId)
+                    else:
+                        self._spawn(data)
+                except WebSocketDisconnect:
+                    break
+                except Exception as e:
+                    if isinstance(data, ISocketRequest):
+                        req_hash = data.hash
+                    elif isinstance(data, ISocketCancelRequest):
+                        req_hash = data.cancel
+                    elif raw_data is not None:
+                        req_hash = get_request_hash(raw_data)
+                    else:
+                        req_hash = "unknown"
+                    await self.on_failed(e, req_hash)
+        finally:
+            await self.close()
+
+    async def cancel(
+        self,
+        hash: str,
+        reason: str = "cancelled by user",
+        *,
+        user_id: Optional[str] = None,
+    ) -> bool:
+        """
+        Cancel the request `hash`, return `False` if it is not found. If `user_id`
+        is provided, the request will be cancelled only if it is sent by `user_id`.
+        """
+
+        if user_id is not None and self._users.get(hash) != user_id:
+            return False
+        task = self._tasks.pop(hash, None)
+        token = self._tokens.pop(hash, None)
+        self._users.pop(hash, None)
+        if task is None or token is None:
+            return False
+        _requests.pop(hash, None)
+        token.cancel(reason)
+        task.cancel()
+        message = f"[{hash}] request is {reason}"
+        return await self.send_message(ISocketMessage.make_interrupted(hash, message))
+
+    async def close(self) -> None:
+        tasks = list(self._tasks.values())
+        for hash, token in self._tokens.items():
+            token.cancel("client is disconnected")
+            _requests.pop(hash, None)
+        self._tasks.clear()
+        self._tokens.clear()
+        self._users.clear()
+        for task in tasks:
+            task.cancel()
+        # wait for the cleanups (e.g. removing the requests from the request queue)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.outbox.close()
+
+    async def on_failed(self, e: Exception, hash: str) -> None:
+        logging.exception(e)
+        message = f"Invalid data: {get_err_msg(e)}"
+        await self.send_message(ISocketMessage.make_exception(hash, message))
+
+    def _spawn(self, data: ISocketRequest) -> None:
+        previous = self._tasks.get(data.hash)
+        if previous is not None and not previous.done():
+            raise ValueError(f"request '{data.hash}' is already being processed")
+        token = CancellationToken()
+        task = asyncio.get_running_loop().create_task(self._handle(data, token))
+        self._tasks[data.hash] = task
+        self._tokens[data.hash] = token
+        self._users[data.hash] = data.userId
+        _requests[data.hash] = self
+
+        def _cleanup(_: "asyncio.Task[None]") -> None:
+            if self._tasks.get(data.hash) is task:
+                self._tasks.pop(data.hash)
+                self._tokens.pop(data.hash)
+                self._users.pop(data.hash, None)
+                _requests.pop(data.hash, None)
+
+        task.add_done_callback(_cleanup)
+
+    async def _handle(self, data: ISocketRequest, token: CancellationToken) -> None:
+        async def send_message(message: Union[ISocketMessage, ISocketFrame]) -> bool:
+            # the `interrupted` message should be the last one of a cancelled task
+            if token.cancelled:
                 return False
-            await websocket.send_text(json.dumps(data.model_dump()))
-            return True
+            return await self.send_message(message)
 
-        await websocket.accept()
-        while True:
-            raw_data = data = None
+        try:
+            if data.isInternal:
+                identifier = data.identifier
+                plugins = self.app.internal_plugins
+            else:
+                identifier = data.identifier.split(".", 1)[0]  # remove hash
+                plugins = self.app.plugins
+            target_plugin = plugins.acquire(identifier)
+            if target_plugin is None:
+                plugin_str = "internal plugin" if data.isInternal else "plugin"
+                message = (
+                    f"incoming message subscribed {plugin_str} '{identifier}', "
+                    "but it is not found"
+                )
+                exception = ISocketMessage.make_exception(data.hash, message)
+                if not await self.send_message(exception):
+                    console.error(f"\[websocket.loop] {message}")
+                return
+            # `send_message` should be handled by the plugin itself, or by the
+            # `SendSocketMessageMiddleware` which will provide a default handling
+            context = RequestContext(data.hash, send_message, data, token)
+            target_plugin.context = context
+
+            # the plugin instance can only be returned to the pool after it is no
+            # longer used, which may be later than the cancellation of this task
+            def release(_: Any) -> None:
+                if target_plugin.__dict__.get("context") is context:
+                    plugins.release(identifier, target_plugin)
+
+            if data.isInternal:
+                # the slot is held until the (offloaded) plugin actually finishes,
+                # which may be later than the cancellation of this task
+                try:
+                    await self._semaphore.acquire()
+                except BaseException:
+                    release(None)
+                    raise
+                try:
+                    target_plugin.elapsed_times.start()
+                    future = asyncio.ensure_future(offload(target_plugin(data)))
+                except BaseException:
+                    self._semaphore.release()
+                    release(None)
+                    raise
+                future.add_done_callback(lambda _: self._semaphore.release())
+                future.add_done_callback(release)
+                await asyncio.shield(future)
+                return
             try:
-                target_plugin = None
-                raw_data = await websocket.receive_text()
-                data = ISocketRequest(**json.loads(raw_data))
-                if data.isInternal:
-                    identifier = data.identifier
-                    target_plugin = app.internal_plugins.make(identifier)
-                else:
-                    identifier = data.identifier.split(".", 1)[0]  # remove hash
-                    target_plugin = app.plugins.make(identifier)
-                if target_plugin is not None:
-                    # `send_message` should be handled by the plugin itself, or by
-                    # the `SendSocketMessageMiddleware` which will provide a default handling
-                    target_plugin.task_hash = data.hash
-                    target_plugin.send_message = send_message
-                    target_plugin.elapsed_times = ElapsedTimes()
-                    if data.isInternal:
-                        target_plugin.elapsed_times.start()
-                        await offload(target_plugin(data))
-                    else:
-                        queue_data = IRequestQueueData(data, target_plugin)
-                        uid = app.request_queue.push(queue_data, send_message)
-                        asyncio.create_task(app.request_queue.wait(data.userId, uid))
-                else:
-                    plugin_str = "internal plugin" if data.isInternal else "plugin"
-                    message = (
-                        f"incoming message subscribed {plugin_str} '{identifier}', "
-                        "but it is not found"
-                    )
-                    exception = ISocketMessage.make_exception(data.hash, message)
-                    if not await send_message(exception):
-                        console.error(f"\[websocket.loop] {message}")
-            except WebSocketDisconnect:
-                break
-            except Exception as e:
-                if data is not None:
-                    req_hash = data.hash
-                elif raw_data is not None and isinstance(raw_data, dict):
-                    req_hash = raw_data.get("hash", "unknown")
-                else:
-                    req_hash = "unknown"
-                await on_failed(e, req_hash)
-            finally:
-                del target_plugin
+                cached = await get_result_cache().get(target_plugin, data)
+            except BaseException:
+                release(None)
+                raise
+            if cached is not None:
+                release(None)
+                await self.send_message(cached)
+                return
+            queue = self.app.request_queue
+            queue_data = IRequestQueueData(data, target_plugin)
+            uid = queue.push(queue_data, send_message)
+            # set when the request is finished, or removed from the queue
+            asyncio.ensure_future(queue_data.event.wait()).add_done_callback(release)
+            try:
+                await queue.wait(data.userId, uid)
+            except asyncio.CancelledError:
+                # the slot is released right away if the request is still pending
+                await queue.cancel(data.userId, uid)
+                raise
+        except (asyncio.CancelledError, TaskCancelledError):
+            raise
+        except Exception as e:
+            await self.on_failed(e, data.hash)
+
+
+# hash -> the connection which is handling the request
+_requests: Dict[str, SocketConnection] = {}
+
+
+async def cancel_request(hash: str, user_id: str) -> bool:
+    """
+    Cancel the request with `hash` sent by `user_id`, return `False` if it is not
+    found (or it is sent by another user).
+    """
+
+    connection = _requests.get(hash)
+    if connection is None:
+        return False
+    return await connection.cancel(hash, user_id=user_id)
+
+
+def decode_request(
+    raw_data: Union[str, bytes]
+) -> Union[ISocketRequest, ISocketCancelRequest]:
+    try:
+        return decode_model(ISocketRequest, raw_data)
+    except ValidationError as err:
+        # control messages are rare, so they are only checked when necessary
+        try:
+            return decode_model(ISocketCancelRequest, raw_data)
+        except ValidationError:
+            raise err
+
+
+class CancelResponse(BaseModel):
+    success: bool
+    message: str
+
+
+def add_websocket(app: IApp) -> None:
+    @app.api.websocket(str(constants.Endpoint.WEBSOCKET))
+    async def websocket(websocket: WebSocket) -> None:
+        await SocketConnection(app, websocket).serve()
+
+    @app.api.post(
+        str(constants.Endpoint.CANCEL),
+        responses=get_responses(CancelResponse),  # type: ignore[arg-type]
+    )
+    async def cancel(data: ISocketCancelRequest) -> CancelResponse:
+        if not await cancel_request(data.cancel, data.userId):
+            message = f"request '{data.cancel}' is not found (or already finished)"
+            return CancelResponse(success=False, message=message)
+        return CancelResponse(success=True, message="")
 
 
 class WebsocketEndpoint(IEndpoint):
@@ -36,6 +36,10 @@ class IRequestQueue(ABC):
     async def wait(self, user_id: str, uid: str) -> None:
         pass
 
+    @abstractmethod
+    async def cancel(self, user_id: str, uid: str) -> bool:
+        """should return `True` if the request is found (and cancelled)"""
+
 
 class IApp(ABC):
     api: FastAPI
@@ -1,5 +1,6 @@
 import os
 
+from typing import List
 from typing import Optional
 from pathlib import Path
 from importlib import import_module
@@ -24,10 +25,43 @@ class Config:
     backend_hosting_url: Optional[str] = None
     # upload
     upload_root: str = field(default_factory=constants.get_upload_root)
+    ## zlib compression level (0-9) of uploaded png images, lower levels encode faster
+    ## but produce larger files (`1` is a good choice for fast encoding)
+    png_compress_level: int = 6
+    ## number of threads used to encode uploaded images, `None` means auto
+    image_encoder_workers: Optional[int] = None
+    ## disk budget of the cached variants (jpeg / thumbnails) of uploaded images
+    derivative_cache_max_bytes: int = 1024 * 1024 * 1024
+    ## available thumbnail sizes, requested sizes will be rounded up to one of these
+    thumbnail_sizes: List[int] = field(default_factory=lambda: [128, 256, 512, 1024])
     # board
     board_settings: BoardSettings = field(default_factory=BoardSettings)
     # extra plugins
     extra_plugins: ExtraPlugins = field(default_factory=ExtraPlugins)
+    # runtime
+    ## maximum number of worker threads used by `offload`, `None` means auto
+    offload_max_workers: Optional[int] = None
+    ## maximum number of requests that can be executed concurrently by the request
+    ## queue, per-plugin limits can be set by `concurrency_key` & `max_concurrency`
+    num_queue_workers: int = 1
+    ## maximum number of internal requests (e.g. sync) that can be executed
+    ## concurrently on each websocket connection
+    socket_max_concurrency: int = 4
+    ## limits of the result cache, used by plugins with `use_cache=True`
+    result_cache_max_items: int = 512
+    result_cache_max_bytes: int = 64 * 1024 * 1024
+    ## timeout (in seconds) of each download attempt, failed downloads are retried
+    ## with exponential backoff, see `RetryManager`
+    download_timeout: Optional[float] = 60.0
+    ## number of consecutive failures before requests to a host are rejected, and
+    ## how long (in seconds) the rejection lasts before a trial request is allowed
+    download_circuit_threshold: int = 5
+    download_circuit_cooldown: float = 30.0
+    ## maximum number of progress messages sent per second for each task, only the
+    ## latest progress is kept when it is exceeded (or the client is slow)
+    progress_max_rate: Optional[float] = 10.0
+    ## codec of plain json payloads, 'auto' means `orjson` if it is installed
+    json_codec: str = "auto"
     # misc
     use_react_strict_mode: bool = False
 
@@ -69,6 +103,12 @@ class Config:
         folder.mkdir(parents=True, exist_ok=True)
         return folder
 
+    @property
+    def upload_derivative_folder(self) -> Path:
+        folder = self.upload_root_path / constants.UPLOAD_DERIVATIVE_FOLDER_NAME
+        folder.mkdir(parents=True, exist_ok=True)
+        return folder
+
     @property
     def upload_project_folder(self) -> Path:
         folder = self.upload_root_path / constants.UPLOAD_PROJECT_FOLDER_NAME
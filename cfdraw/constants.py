@@ -24,6 +24,8 @@ API_URL_KEY = "CFDRAW_API_URL"
 class Endpoint(Enum):
     PING = "ping"
     WEBSOCKET = "ws"
+    METRICS = "metrics"
+    CANCEL = "cancel"
 
     def __str__(self) -> str:
         return f"/{self.value}"
@@ -77,9 +79,12 @@ WEB_ROOT = ROOT / ".web"
 ## upload
 UPLOAD_ROOT = Path("~").expanduser() / ".cache" / "carefree-drawboard" / "_upload"
 UPLOAD_IMAGE_FOLDER_NAME = ".images"
+UPLOAD_DERIVATIVE_FOLDER_NAME = ".derivatives"
 UPLOAD_PROJECT_FOLDER_NAME = ".projects"
 BUGGY_PROJECT_FOLDER = ".buggy"
 PROJECT_META_FILE = "_meta.json"
+PROJECT_STORE_FILE = "store.sqlite"
+LEGACY_PROJECT_STORE_FILE = "projects.sqlite"
 
 # plugin
 
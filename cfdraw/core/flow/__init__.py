@@ -1,4 +1,9 @@
 from .core import *
+from .batch import *
+from .cache import *
+from .process import *
+from .remote import *
+from .schedule import *
 from .nodes import *
 from .server import *
 from .utils import *
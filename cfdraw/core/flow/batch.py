@@ -0,0 +1,185 @@
+import time
+import asyncio
+import weakref
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
+from typing import Union
+from typing import Optional
+from typing import TYPE_CHECKING
+from dataclasses import field
+from dataclasses import dataclass
+
+from .process import PROCESS_OFFLOAD
+from .process import get_process_runtime
+from .schedule import get_node_lock
+from ..toolkit.misc import offload
+
+if TYPE_CHECKING:
+    from .core import Node
+
+
+TBatchKey = Tuple[str, str, Optional[str], Union[bool, str]]
+
+
+@dataclass
+class BatchItem:
+    node: "Node"
+    order: Any
+    future: "asyncio.Future[Any]"
+    submit_time: float
+
+
+@dataclass
+class Batch:
+    items: List[BatchItem] = field(default_factory=list)
+    timer: Optional[asyncio.TimerHandle] = None
+
+
+@dataclass
+class BatcherState:
+    """The pending batches (and running tasks) of `NodeBatcher` in an event loop."""
+
+    batches: Dict[TBatchKey, Batch] = field(default_factory=dict)
+    tasks: List["asyncio.Task[None]"] = field(default_factory=list)
+
+
+class BatchResult:
+    """
+    The results of a node executed in a batch.
+
+    Attributes
+    ----------
+    results : Any
+        The (raw) results of the node, i.e. the corresponding element of the list
+        returned by `execute_batch`.
+    batch_size : int
+        The number of nodes in the batch.
+    wait : float
+        Time (in seconds) spent waiting for the batch to be formed.
+    """
+
+    def __init__(self, results: Any, batch_size: int, wait: float) -> None:
+        self.results = results
+        self.batch_size = batch_size
+        self.wait = wait
+
+
+class NodeBatcher:
+    """
+    Coalesces executions of nodes that opt in to micro-batching (see
+    `Node.batch_max_size`), across concurrent `Flow.execute` calls.
+
+    * Pending executions are grouped by the node `__identifier__`, the
+    `get_batch_key` of the node, its `lock_key` and its `offload` flag.
+    * A group is flushed as soon as it reaches `batch_max_size`, or when the first
+    execution in it has waited for `batch_max_wait_ms` milliseconds.
+    * A flushed group is executed by `execute_batch`. If `lock_key` is set, the
+    batch will hold the corresponding (process-wide) lock (see `get_node_lock`), with
+    the most urgent scheduling `order` among its executions.
+    * If `execute_batch` raises, all executions in the batch will fail.
+    * Batches are formed per event loop (futures are bound to their loops), but
+    batches of different loops still share the same (cross-loop) `lock_key` lock.
+    """
+
+    def __init__(self) -> None:
+        self._states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, BatcherState]"
+        self._states = weakref.WeakKeyDictionary()
+
+    async def submit(self, node: "Node", batch_key: str, order: Any) -> BatchResult:
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            state = self._states[loop] = BatcherState()
+        key = (node.__identifier__, batch_key, node.lock_key, node.offload)
+        batch = state.batches.get(key)
+        if batch is None:
+            batch = state.batches[key] = Batch()
+            delay = max(0.0, node.batch_max_wait_ms / 1000.0)
+            batch.timer = loop.call_later(delay, self._flush, state, key)
+        future = loop.create_future()
+        batch.items.append(BatchItem(node, order, future, time.time()))
+        if len(batch.items) >= node.batch_max_size:
+            self._flush(state, key)
+        return await future
+
+    def _flush(self, state: BatcherState, key: TBatchKey) -> None:
+        batch = state.batches.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        # executions may be cancelled while waiting (e.g. the workflow failed)
+        items = [item for item in batch.items if not item.future.done()]
+        if not items:
+            return
+        task = asyncio.get_running_loop().create_task(self._execute(key, items))
+        state.tasks.append(task)
+        task.add_done_callback(state.tasks.remove)
+
+    async def _execute(self, key: TBatchKey, items: List[BatchItem]) -> None:
+        lock_key = key[2]
+        if lock_key is None:
+            await self._execute_batch(key, items)
+        else:
+            order = min(item.order for item in items)
+            async with get_node_lock(lock_key).hold(order):
+                await self._execute_batch(key, items)
+
+    async def _execute_batch(self, key: TBatchKey, items: List[BatchItem]) -> None:
+        t = time.time()
+        nodes = [item.node for item in items]
+        t_node = nodes[0].__class__
+        for node in nodes:
+            node.executing = True
+        try:
+            if not key[3]:
+                results = await t_node.execute_batch(nodes)
+            elif key[3] == PROCESS_OFFLOAD:
+                results = await get_process_runtime().run(nodes, batch=True)
+            else:
+                results = await offload(t_node.execute_batch(nodes))
+            if len(results) != len(nodes):
+                raise ValueError(
+                    f"`execute_batch` of '{t_node.__identifier__}' returned "
+                    f"{len(results)} results for {len(nodes)} nodes"
+                )
+        except BaseException as err:
+            # executions waiting for the batch should never be left pending
+            for item in items:
+                if not item.future.done():
+                    if isinstance(err, Exception):
+                        item.future.set_exception(err)
+                    else:
+                        item.future.cancel()
+            if isinstance(err, Exception):
+                return
+            raise
+        finally:
+            for node in nodes:
+                node.executing = False
+        for item, item_results in zip(items, results):
+            if not item.future.done():
+                wait = t - item.submit_time
+                item.future.set_result(BatchResult(item_results, len(items), wait))
+
+
+_node_batcher: Optional[NodeBatcher] = None
+
+
+def get_node_batcher() -> NodeBatcher:
+    """Get the process-wide `NodeBatcher` used by `Flow.execute`."""
+
+    global _node_batcher
+    if _node_batcher is None:
+        _node_batcher = NodeBatcher()
+    return _node_batcher
+
+
+__all__ = [
+    "BatchResult",
+    "NodeBatcher",
+    "get_node_batcher",
+]
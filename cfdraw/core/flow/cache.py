@@ -0,0 +1,284 @@
+import os
+import sys
+import json
+import time
+import pickle
+import asyncio
+import hashlib
+import threading
+
+from typing import Any
+from typing import Dict
+from typing import Tuple
+from typing import Optional
+from typing import TYPE_CHECKING
+from pathlib import Path
+from collections import OrderedDict
+
+from ..toolkit import console
+from ..parameters import OPT
+from ..toolkit.types import TPath
+from ..toolkit.data_structures import LRUCache
+from ..toolkit.data_structures import CacheStats
+
+if TYPE_CHECKING:
+    from .core import FlowRun
+
+
+def _update_hash(h: Any, value: Any) -> None:
+    if value is None or isinstance(value, (bool, int, float, str)):
+        h.update(b"v")
+        h.update(json.dumps(value).encode())
+    elif isinstance(value, dict):
+        h.update(b"{")
+        for k in sorted(value, key=str):
+            _update_hash(h, str(k))
+            _update_hash(h, value[k])
+        h.update(b"}")
+    elif isinstance(value, (list, tuple)):
+        h.update(b"[")
+        for v in value:
+            _update_hash(h, v)
+        h.update(b"]")
+    elif isinstance(value, bytes):
+        h.update(f"b{len(value)}".encode())
+        h.update(value)
+    else:
+        from PIL import Image
+
+        if isinstance(value, Image.Image):
+            h.update(f"i{value.mode}{value.size}".encode())
+            h.update(value.tobytes())
+            return
+        import numpy as np
+
+        if isinstance(value, np.ndarray):
+            h.update(f"a{value.dtype}{value.shape}".encode())
+            h.update(np.ascontiguousarray(value).tobytes())
+            return
+        raise TypeError(f"cannot hash value of type '{type(value)}'")
+
+
+def hash_value(value: Any) -> str:
+    """
+    Return a canonical hash code of `value`.
+
+    * JSON values are hashed by their contents, and `dict` keys are sorted.
+    * `PIL.Image` / `np.ndarray` / `bytes` are hashed by their contents.
+    * Other values are not supported, and a `TypeError` will be raised.
+    """
+
+    h = hashlib.md5()
+    _update_hash(h, value)
+    return h.hexdigest()
+
+
+def get_size(value: Any) -> int:
+    """Return the (estimated) size in bytes of `value`."""
+
+    if isinstance(value, dict):
+        return sum(get_size(k) + get_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(map(get_size, value))
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    size = getattr(value, "size", None)
+    mode = getattr(value, "mode", None)
+    if isinstance(size, tuple) and isinstance(mode, str):
+        return size[0] * size[1] * len(mode)
+    return sys.getsizeof(value)
+
+
+class NodeResultCache:
+    """
+    Memoizes the results of nodes that opt in (see `Node.memoize`).
+
+    * Results are keyed by the node `__identifier__` & the canonical hash of the
+    (post-injection) `data` of the node, see `hash_value`.
+    * Results are kept in an in-memory LRU cache, limited by `max_items` & `max_bytes`.
+    * If `disk_folder` is provided, results will also be pickled to it, which is
+    limited by `disk_max_bytes`, so they can survive restarts.
+
+    > Memoized results will be shared across executions, so they should be treated
+    as read-only.
+    """
+
+    def __init__(
+        self,
+        max_items: Optional[int] = 256,
+        max_bytes: Optional[int] = 512 * 1024 * 1024,
+        *,
+        disk_folder: Optional[TPath] = None,
+        disk_max_bytes: int = 4 * 1024 * 1024 * 1024,
+    ) -> None:
+        self.memory = LRUCache[Any](max_items, max_bytes)
+        self.disk_folder = None if disk_folder is None else Path(disk_folder)
+        self.disk_max_bytes = disk_max_bytes
+        self._disk_lock = threading.Lock()
+        self._disk_sizes: OrderedDict[str, int] = OrderedDict()
+        self._disk_num_bytes = 0
+        if self.disk_folder is not None:
+            self.disk_folder.mkdir(parents=True, exist_ok=True)
+            existing = []
+            for path in self.disk_folder.glob("*.pkl"):
+                existing.append((path.stat(), path.stem))
+            for stat, key in sorted(existing, key=lambda pair: pair[0].st_mtime):
+                self._disk_sizes[key] = stat.st_size
+                self._disk_num_bytes += stat.st_size
+
+    def get_key(self, identifier: str, data: Any) -> Optional[str]:
+        """return `None` if `data` cannot be hashed, in which case nothing is cached"""
+
+        try:
+            return f"{identifier}-{hash_value(data)}"
+        except TypeError:
+            return None
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        results = self.memory.get(key)
+        if results is not None or self.disk_folder is None:
+            return results
+        loop = asyncio.get_running_loop()
+        loaded = await loop.run_in_executor(None, self._load, key)
+        if loaded is None:
+            return None
+        results, expire = loaded
+        ttl = None if expire is None else expire - time.time()
+        self.memory.set(key, results, size=get_size(results), ttl=ttl)
+        return results
+
+    async def set(
+        self,
+        key: str,
+        results: Dict[str, Any],
+        ttl: Optional[float] = None,
+    ) -> None:
+        self.memory.set(key, results, size=get_size(results), ttl=ttl)
+        if self.disk_folder is not None:
+            expire = None if ttl is None else time.time() + ttl
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._dump, key, results, expire)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        with self._disk_lock:
+            for key in list(self._disk_sizes):
+                self._remove(key)
+
+    def stats(self) -> CacheStats:
+        return self.memory.stats()
+
+    def _get_path(self, key: str) -> Path:
+        if self.disk_folder is None:
+            raise RuntimeError("`disk_folder` is not provided")
+        return self.disk_folder / f"{key}.pkl"
+
+    def _load(self, key: str) -> Optional[Tuple[Dict[str, Any], Optional[float]]]:
+        with self._disk_lock:
+            if key not in self._disk_sizes:
+                return None
+            self._disk_sizes.move_to_end(key)
+        try:
+            with self._get_path(key).open("rb") as f:
+                expire, results = pickle.load(f)
+        except Exception as err:
+            console.warn(f"failed to load memoized results '{key}': {err}")
+            expire, results = 0.0, None
+        if results is None or (expire is not None and expire <= time.time()):
+            with self._disk_lock:
+                self._remove(key)
+            return None
+        return results, expire
+
+    def _dump(self, key: str, results: Dict[str, Any], expire: Optional[float]) -> None:
+        path = self._get_path(key)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        try:
+            with tmp_path.open("wb") as f:
+                pickle.dump((expire, results), f)
+            os.replace(tmp_path, path)
+        except Exception as err:
+            # results that cannot be pickled will only be cached in memory
+            console.warn(f"failed to dump memoized results '{key}': {err}")
+            return
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        size = path.stat().st_size
+        with self._disk_lock:
+            self._disk_num_bytes += size - self._disk_sizes.pop(key, 0)
+            self._disk_sizes[key] = size
+            while self._disk_num_bytes > self.disk_max_bytes and self._disk_sizes:
+                self._remove(next(iter(self._disk_sizes)))
+
+    def _remove(self, key: str) -> None:
+        self._disk_num_bytes -= self._disk_sizes.pop(key, 0)
+        self._get_path(key).unlink(missing_ok=True)
+
+
+_node_cache: Optional[NodeResultCache] = None
+
+
+def get_node_cache() -> NodeResultCache:
+    """
+    Get the process-wide `NodeResultCache`.
+
+    > By default it is created from `OPT.flow_opt["node_cache"]`, and can be
+    replaced by `setup_node_cache`.
+    """
+
+    global _node_cache
+    if _node_cache is None:
+        _node_cache = NodeResultCache(**OPT.flow_opt["node_cache"])
+    return _node_cache
+
+
+def setup_node_cache(
+    max_items: Optional[int] = 256,
+    max_bytes: Optional[int] = 512 * 1024 * 1024,
+    *,
+    disk_folder: Optional[TPath] = None,
+    disk_max_bytes: int = 4 * 1024 * 1024 * 1024,
+) -> NodeResultCache:
+    """(Re)create the process-wide `NodeResultCache` used by `Flow.execute`."""
+
+    global _node_cache
+    _node_cache = NodeResultCache(
+        max_items,
+        max_bytes,
+        disk_folder=disk_folder,
+        disk_max_bytes=disk_max_bytes,
+    )
+    return _node_cache
+
+
+_run_cache: Optional[LRUCache["FlowRun"]] = None
+
+
+def get_run_cache() -> LRUCache["FlowRun"]:
+    """
+    Get the process-wide cache of the `FlowRun`s kept by `WorkflowModel.run`.
+
+    > It is created from `OPT.flow_opt["run_cache"]`.
+    """
+
+    global _run_cache
+    if _run_cache is None:
+        run_cache_opt = OPT.flow_opt["run_cache"]
+        _run_cache = LRUCache(
+            run_cache_opt["max_items"],
+            run_cache_opt["max_bytes"],
+            ttl=run_cache_opt["ttl"],
+        )
+    return _run_cache
+
+
+__all__ = [
+    "NodeResultCache",
+    "hash_value",
+    "get_node_cache",
+    "setup_node_cache",
+    "get_run_cache",
+]
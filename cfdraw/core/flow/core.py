@@ -1,4 +1,6 @@
+import copy
 import json
+import math
 import time
 import asyncio
 
@@ -9,16 +11,31 @@ from typing import Set
 from typing import Dict
 from typing import List
 from typing import Type
+from typing import Tuple
 from typing import Union
 from typing import TypeVar
+from typing import ClassVar
 from typing import Callable
+from typing import Awaitable
 from typing import Optional
+from typing import NamedTuple
 from pydantic import Field
 from pydantic import BaseModel
 from dataclasses import field
 from dataclasses import asdict
 from dataclasses import dataclass
 
+from .batch import get_node_batcher
+from .process import PROCESS_OFFLOAD
+from .process import get_process_runtime
+from .remote import get_remote_executors
+from .schedule import get_schedules
+from .schedule import get_node_lock
+from .schedule import get_latency_history
+from .schedule import NodeSchedule
+from .cache import get_size
+from .cache import get_run_cache
+from .cache import get_node_cache
 from ..toolkit import console
 from ..toolkit.web import get_err_msg
 from ..toolkit.misc import offload
@@ -41,6 +58,7 @@ warmed_up_records: Dict[str, bool] = {}
 UNDEFINED_PLACEHOLDER = "$undefined$"
 EXCEPTION_MESSAGE_KEY = "$exception$"
 ALL_LATENCIES_KEY = "$all_latencies$"
+RUN_ID_KEY = "$run_id$"
 
 LOOP_NODE = "common.loop"
 GATHER_NODE = "common.gather"
@@ -48,9 +66,28 @@ WORKFLOW_NODE = "common.workflow"
 WORKFLOW_ENDPOINT_NAME = "workflow"
 
 
+class NodeResult(NamedTuple):
+    """
+    The results of a finished node, passed to the `on_node_finished` callback of
+    `Flow.execute`.
+
+    * key: the key of the node.
+    * api_response: the API response of the node, only available if the node is the
+    `target` or one of the `intermediate` nodes, and `return_api_response` is `True`.
+    * latencies: the latency record of the node (see `ALL_LATENCIES_KEY`).
+    """
+
+    key: str
+    api_response: Optional[Any]
+    latencies: Dict[str, float]
+
+
+TNodeCallback = Callable[[NodeResult], Awaitable[None]]
+
+
 def to_hierarchies(hierarchy: Union[str, List[str]]) -> List[str]:
     if isinstance(hierarchy, list):
-        return hierarchy
+        return list(hierarchy)
     return hierarchy.split(".")
 
 
@@ -74,7 +111,51 @@ def extract_from(data: Any, hierarchy: Union[str, List[str]]) -> Any:
     return data
 
 
-def inject_leaf_data(d: Any, hierarchies: List[str], v: Any, *, verbose: bool) -> None:
+def copy_on_write(d: Any, hierarchies: List[str], copied: Set[int]) -> None:
+    """
+    Shallow copy the containers along `hierarchies` (except the leaf) inplace, so
+    `inject_leaf_data` will not modify containers that are shared with others.
+
+    > `d` itself should be private, and `copied` records the ids of the containers
+    that are already private, so they will not be copied again.
+    """
+
+    for h in hierarchies[:-1]:
+        if isinstance(d, list):
+            try:
+                ih: Union[int, str] = int(h)
+            except ValueError:
+                return
+            if len(d) <= ih:  # type: ignore
+                return
+        elif isinstance(d, dict):
+            if h not in d:
+                return
+            ih = h
+        else:
+            return
+        child = d[ih]
+        if isinstance(child, (dict, list)) and id(child) not in copied:
+            child = d[ih] = copy.copy(child)
+            copied.add(id(child))
+        d = child
+
+
+def inject_leaf_data(
+    d: Any,
+    hierarchies: List[str],
+    v: Any,
+    *,
+    verbose: bool,
+    padded: Optional[List[List[Any]]] = None,
+) -> None:
+    """
+    Inject `v` into `d` at `hierarchies`.
+
+    > If `padded` is provided, lists that are padded with `UNDEFINED_PLACEHOLDER`
+    will be appended to it.
+    """
+
     h = hierarchies.pop(0)
     is_leaf = len(hierarchies) == 0
     if isinstance(d, list):
@@ -91,13 +172,15 @@ def inject_leaf_data(d: Any, hierarchies: List[str], v: Any, *, verbose: bool) -
                     "and other elements will be set to `undefined`"
                 )
             d.extend([UNDEFINED_PLACEHOLDER] * (ih - len(d) + 1))
+            if padded is not None:
+                padded.append(d)
         if is_leaf:
             d[ih] = v
         else:
             if d[ih] == UNDEFINED_PLACEHOLDER:
                 console.warn("filling `undefined` value with an empty `dict`")
                 d[ih] = {}
-            inject_leaf_data(d[ih], hierarchies, v, verbose=verbose)
+            inject_leaf_data(d[ih], hierarchies, v, verbose=verbose, padded=padded)
     elif isinstance(d, dict):
         if is_leaf:
             d[h] = v
@@ -110,7 +193,7 @@ def inject_leaf_data(d: Any, hierarchies: List[str], v: Any, *, verbose: bool) -
                         "an empty `dict`"
                     )
                 d[h] = {}
-            inject_leaf_data(d[h], hierarchies, v, verbose=verbose)
+            inject_leaf_data(d[h], hierarchies, v, verbose=verbose, padded=padded)
     else:
         raise ValueError(
             f"hierarchy '{h}' is required but current value type "
@@ -218,6 +301,12 @@ class Schema:
     description : Optional[str]
         A description of the node.
         > This will be displayed in the auto-generated UIs / documents.
+    memoize : Optional[bool]
+        Whether the results of the node should be memoized, see `Node.memoize`.
+        > If `None`, `Node.memoize` will be used.
+    memoize_ttl : Optional[float]
+        The time-to-live (in seconds) of the memoized results.
+        > If `None`, `Node.memoize_ttl` will be used.
 
     """
 
@@ -227,6 +316,8 @@ class Schema:
     input_names: Optional[List[str]] = None
     output_names: Optional[List[str]] = None
     description: Optional[str] = None
+    memoize: Optional[bool] = None
+    memoize_ttl: Optional[float] = None
 
 
 class Hook:
@@ -254,12 +345,39 @@ class Node(ISerializableDataClass["Node"], metaclass=ABCMeta):
         The data associated with the node.
     injections : List[Injection], optional
         A list of injections of the node.
-    offload : bool, optional
+    offload : Union[bool, str], optional
         A flag indicating whether the node should be offloaded.
+        - `True` / `"thread"`: the node will be executed in a sub-thread.
+        - `"process"`: the node will be executed in a persistent pool of worker
+        processes, which is useful for CPU-bound nodes, see `ProcessOffloadRuntime`.
     lock_key : str, optional
         The lock key of the node.
     executing : bool, optional
         A runtime attribute indicating whether the node is currently executing.
+        > During execution, nodes are cloned by `fork`, in which `data` is
+        copied-on-write: only the containers that are injected into will be copied,
+        and other (nested) values will be shared with the original node. So nodes
+        should never modify nested values of their `data` inplace.
+    memoize : bool, class attribute
+        Whether the results of the node should be memoized (see `NodeResultCache`),
+        which is useful for deterministic nodes that are often executed with the same
+        inputs. Default is `False`.
+        > The memoized results are keyed by the `__identifier__` and the (post-injection)
+        `data` of the node, and will be shared across executions.
+    memoize_ttl : Optional[float], class attribute
+        The time-to-live (in seconds) of the memoized results, `None` means forever.
+    batch_max_size : int, class attribute
+        The maximum number of nodes that can be executed together by `execute_batch`.
+        Default is `1`, which means micro-batching is disabled.
+        > Executions of the same node type (and same `get_batch_key`) will be coalesced
+        across concurrent workflows, see `NodeBatcher`.
+    batch_max_wait_ms : float, class attribute
+        The maximum time (in milliseconds) an execution will wait for its batch to be
+        filled before the batch is executed.
+    remote_tags : List[str], class attribute
+        Tags of the node, if any of them is served by a `RemoteWorker`, the node will be
+        executed remotely (see `RemoteExecutors`). Nodes can also be dispatched by their
+        `__identifier__`, see `RemoteWorker.nodes`.
 
     Methods
     -------
@@ -271,6 +389,13 @@ class Node(ISerializableDataClass["Node"], metaclass=ABCMeta):
         Optional method that returns the schema of the node.
         Implement this method can help us auto-generate UIs, APIs and documents.
     @classmethod
+    async execute_batch(nodes: List[Node]) -> List[Any]
+        Optional method that returns the results of each node in `nodes`.
+        Implement this method (and set `batch_max_size`) to enable micro-batching.
+    get_batch_key() -> str
+        Optional method that returns the key of the node, only nodes with the same
+        key can be executed in the same batch.
+    @classmethod
     async warmup() -> None
         Optional method that will be called:
         - only once.
@@ -289,10 +414,18 @@ class Node(ISerializableDataClass["Node"], metaclass=ABCMeta):
     key: Optional[str] = None
     data: Dict[str, Any] = field(default_factory=dict)
     injections: List[Injection] = field(default_factory=list)
-    offload: bool = False
+    offload: Union[bool, str] = False
     lock_key: Optional[str] = None
     # runtime attribute, should not be touched and will not be serialized
     executing: bool = False
+    # memoization, can be overridden by `Schema`
+    memoize: ClassVar[bool] = False
+    memoize_ttl: ClassVar[Optional[float]] = None
+    # micro-batching, see `execute_batch`
+    batch_max_size: ClassVar[int] = 1
+    batch_max_wait_ms: ClassVar[float] = 5.0
+    # remote execution, see `RemoteExecutors`
+    remote_tags: ClassVar[List[str]] = []
 
     # optional
 
@@ -316,6 +449,27 @@ class Node(ISerializableDataClass["Node"], metaclass=ABCMeta):
         > So you can do some heavy initializations here (e.g. loading AI models).
         """
 
+    @classmethod
+    async def execute_batch(cls: Type[TNode], nodes: List[TNode]) -> List[Any]:
+        """
+        Executes a batch of nodes of this type, and returns the results of each node,
+        in the same order as `nodes`.
+
+        > `data` of each node is already injected, and the default implementation
+        simply executes the nodes one by one.
+        """
+
+        return [await node.execute() for node in nodes]
+
+    def get_batch_key(self) -> str:
+        """
+        Nodes with different keys will never be executed in the same batch, override
+        this method if only nodes with compatible parameters (e.g. image sizes) can
+        be batched together.
+        """
+
+        return ""
+
     async def initialize(self, flow: "Flow") -> None:
         """Will be called everytime before the execution."""
 
@@ -342,6 +496,31 @@ class Node(ISerializableDataClass["Node"], metaclass=ABCMeta):
         tag = f"$depend_{random_hash()[:4]}"
         self.injections.append(Injection(src_key, None, tag))
 
+    def fork(self: TNode) -> TNode:
+        """
+        Create a light-weight clone of the node for execution, see `executing` for
+        the copy-on-write behavior of `data`.
+        """
+
+        forked = copy.copy(self)
+        if isinstance(self.data, dict):
+            forked.data = dict(self.data)
+        forked.injections = list(self.injections)
+        forked.executing = False
+        return forked
+
+    def is_same_as(self, other: "Node") -> bool:
+        """whether `other` has the same definition as the current node"""
+
+        return (
+            self.__identifier__ == other.__identifier__
+            and self.key == other.key
+            and self.data == other.data
+            and self.injections == other.injections
+            and self.offload == other.offload
+            and self.lock_key == other.lock_key
+        )
+
     def to_model(self) -> "NodeModel":
         if self.key is None:
             raise ValueError("node key cannot be None")
@@ -408,6 +587,17 @@ class Node(ISerializableDataClass["Node"], metaclass=ABCMeta):
             raise ValueError("node key cannot contain '.'")
         return self
 
+    def get_memoize_settings(self) -> Tuple[bool, Optional[float]]:
+        memoize = self.memoize
+        ttl = self.memoize_ttl
+        schema = self.get_schema()
+        if schema is not None:
+            if schema.memoize is not None:
+                memoize = schema.memoize
+            if schema.memoize_ttl is not None:
+                ttl = schema.memoize_ttl
+        return memoize, ttl
+
     def check_inputs(self) -> None:
         if not isinstance(self.data, dict):
             raise ValueError(
@@ -443,7 +633,18 @@ class Node(ISerializableDataClass["Node"], metaclass=ABCMeta):
                 )
             history[dst_hierarchy_key] = injection
 
-    def fetch_injections(self, results: Dict[str, Any], verbose: bool = True) -> None:
+    def fetch_injections(
+        self,
+        results: Dict[str, Any],
+        verbose: bool = True,
+    ) -> List[List[Any]]:
+        """
+        Inject the `results` of the dependencies into `data` (copy-on-write, see
+        `executing`), return the lists that are padded with `UNDEFINED_PLACEHOLDER`.
+        """
+
+        padded: List[List[Any]] = []
+        copied = {id(self.data)}
         for injection in self.injections:
             src_key = injection.src_key
             src_out = results.get(src_key)
@@ -452,9 +653,22 @@ class Node(ISerializableDataClass["Node"], metaclass=ABCMeta):
             if injection.src_hierarchy is not None:
                 src_out = extract_from(src_out, injection.src_hierarchy)
             dst_hierarchies = to_hierarchies(injection.dst_hierarchy)
-            inject_leaf_data(self.data, dst_hierarchies, src_out, verbose=verbose)
+            copy_on_write(self.data, dst_hierarchies, copied)
+            inject_leaf_data(
+                self.data,
+                dst_hierarchies,
+                src_out,
+                verbose=verbose,
+                padded=padded,
+            )
+        return padded
+
+    def check_undefined(self, containers: Optional[List[Any]] = None) -> None:
+        """
+        Check whether there are `UNDEFINED_PLACEHOLDER`s in `containers`, which are
+        all values of `data` if not provided.
+        """
 
-    def check_undefined(self) -> None:
         def check(data: Any) -> None:
             if isinstance(data, list):
                 for item in data:
@@ -465,7 +679,11 @@ class Node(ISerializableDataClass["Node"], metaclass=ABCMeta):
             elif data == UNDEFINED_PLACEHOLDER:
                 raise ValueError(f"undefined value found in '{self.data}'")
 
-        check(self.data)
+        if containers is None:
+            check(self.data)
+        else:
+            for container in containers:
+                check(container)
 
     def check_results(self, results: Dict[str, Any]) -> Dict[str, Any]:
         if not isinstance(results, dict):
@@ -505,6 +723,27 @@ class Node(ISerializableDataClass["Node"], metaclass=ABCMeta):
         return results
 
 
+@dataclass
+class FlowRun:
+    """
+    A (finished) execution of a workflow, which can be passed to `Flow.execute` as
+    `previous` to enable incremental re-execution.
+
+    Attributes
+    ----------
+    nodes : Dict[str, Node]
+        The snapshots (see `Node.fork`) of the executed nodes, keyed by node keys.
+        > Nested values of `data` are shared with the workflow, so they should be
+        replaced instead of being modified inplace between executions.
+    results : Dict[str, Any]
+        The raw results of the successfully executed nodes, keyed by node keys.
+
+    """
+
+    nodes: Dict[str, Node]
+    results: Dict[str, Any]
+
+
 class Flow(Bundle[Node]):
     """
     A Flow class that represents a workflow.
@@ -518,6 +757,10 @@ class Flow(Bundle[Node]):
           of the destination node.
     latest_latencies : Dict[str, Dict[str, float]]
         The latest latencies of the workflow.
+        > They are also used to estimate the critical paths when scheduling, see
+        `get_estimates`.
+    latest_run : Optional[FlowRun]
+        The latest execution of the workflow, can be used for incremental re-execution.
 
     Methods
     -------
@@ -541,6 +784,10 @@ class Flow(Bundle[Node]):
         Loads a workflow from a (JSON) file.
     get_reachable(target: str) -> Set[str]:
         Gets the reachable nodes from a target.
+    get_reusable(previous: FlowRun, keys: Set[str]) -> Set[str]:
+        Gets the nodes whose results in a previous execution can be reused.
+    get_estimates(keys: Set[str]) -> Dict[str, float]:
+        Gets the estimated execution time of the nodes.
     run(...) -> None:
         Runs a single node in the workflow.
     execute(...) -> Dict[str, Any]:
@@ -551,6 +798,7 @@ class Flow(Bundle[Node]):
     def __init__(self, *, no_mapping: bool = False) -> None:
         super().__init__(no_mapping=no_mapping)
         self.latest_latencies: Dict[str, Dict[str, float]] = {}
+        self.latest_run: Optional[FlowRun] = None
 
     def __str__(self) -> str:
         body = ",\n  ".join(str(item.data) for item in self)
@@ -666,6 +914,20 @@ class Flow(Bundle[Node]):
     def copy(self) -> "Flow":
         return Flow.from_json(self.to_json())
 
+    def fork(self, keys: Optional[Set[str]] = None) -> "Flow":
+        """
+        Create a light-weight clone of the workflow (with only nodes in `keys`, if
+        provided) for execution, in which nodes are cloned by `Node.fork`.
+
+        > Unlike `copy`, no serialization / validation will be performed.
+        """
+
+        forked = Flow()
+        for item in self:
+            if keys is None or item.key in keys:
+                forked.push(item.data.fork())
+        return forked
+
     def dump(self, path: TPath) -> None:
         with open(path, "w") as f:
             json.dump(self.to_json(), f, indent=2)
@@ -696,6 +958,53 @@ class Flow(Bundle[Node]):
         dfs(target, True)
         return reachable
 
+    def get_reusable(self, previous: FlowRun, keys: Set[str]) -> Set[str]:
+        """
+        Gets the nodes (among `keys`) whose results in the `previous` execution can be
+        reused, which means neither the nodes themselves (`data`, injections, ...) nor
+        any of their (transitive) dependencies have changed.
+        """
+
+        def is_reusable(key: str) -> bool:
+            cached = reusable.get(key)
+            if cached is not None:
+                return cached
+            reusable[key] = False
+            item = self.get(key)
+            snapshot = previous.nodes.get(key)
+            reusable[key] = (
+                item is not None
+                and snapshot is not None
+                and key in previous.results
+                and snapshot.is_same_as(item.data)
+                and all(is_reusable(inj.src_key) for inj in item.data.injections)
+            )
+            return reusable[key]
+
+        reusable: Dict[str, bool] = {}
+        return {key for key in keys if is_reusable(key)}
+
+    def get_estimates(self, keys: Set[str]) -> Dict[str, float]:
+        """
+        Gets the estimated execution time (in seconds) of the nodes, which is:
+        - the latest latency of the node in this workflow, if it was executed.
+        - the historical latency of the node type (see `LatencyHistory`), otherwise.
+        - `0.0` if the node type has never been executed.
+        """
+
+        history = get_latency_history()
+        estimates = {}
+        for item in self:
+            if item.key not in keys:
+                continue
+            latencies = self.latest_latencies.get(item.key)
+            if latencies is not None and not latencies.get("reused"):
+                estimates[item.key] = latencies["execute"]
+            else:
+                estimate = history.get(item.data.__identifier__)
+                estimates[item.key] = 0.0 if estimate is None else estimate
+        return estimates
+
     async def run(
         self,
         item: Item[Node],
@@ -704,45 +1013,163 @@ class Flow(Bundle[Node]):
         return_api_response: bool,
         verbose: bool,
         all_latencies: Dict[str, Dict[str, float]],
+        finished: Dict[str, asyncio.Event],
+        schedules: Dict[str, NodeSchedule],
+        on_node_finished: Optional[TNodeCallback] = None,
     ) -> None:
+        """
+        Runs a single node in the workflow.
+
+        - The node will wait until all of its dependencies are `finished`.
+        - If `lock_key` is set, the node will hold the corresponding (process-wide)
+        lock during its execution, so nodes with the same `lock_key` will never be
+        executed concurrently, even across workflows (see `get_node_lock`).
+        - When the lock is contended, it is granted by the order of the `schedules`:
+        higher priority first, then earlier `latest_start` (deadline), then longer
+        critical path.
+        - The `finished` event of the node will be set once it is done, and then
+        `on_node_finished` will be called (if provided).
+        """
+
         if item.key in all_results:
-            return
-        start_t = time.time()
-        while not all(i.src_key in all_results for i in item.data.injections):
-            await asyncio.sleep(0)
-        if item.data.lock_key is not None:
-            while not all(
-                not other.data.executing or other.data.lock_key != item.data.lock_key
-                for other in self
+            # results are reused from a previous execution
+            if return_api_response:
+                results = await item.data.get_api_response(all_results[item.key])
+                api_results[item.key] = item.data.check_api_results(results)
+        else:
+            start_t = time.time()
+            for injection in item.data.injections:
+                await finished[injection.src_key].wait()
+            schedule = schedules[item.key]
+            lock_key = item.data.lock_key
+            remote = get_remote_executors()
+            # batches are locked by the `NodeBatcher`, and remote nodes are locked
+            # by the remote workers
+            if (
+                lock_key is None
+                or item.data.batch_max_size > 1
+                or (remote is not None and remote.serves(item.data))
             ):
-                await asyncio.sleep(0)
-        item.data.executing = True
+                await self._run(
+                    item,
+                    api_results,
+                    all_results,
+                    return_api_response,
+                    verbose,
+                    all_latencies,
+                    start_t,
+                    schedule,
+                )
+            else:
+                async with get_node_lock(lock_key).hold(schedule.order) as record:
+                    await self._run(
+                        item,
+                        api_results,
+                        all_results,
+                        return_api_response,
+                        verbose,
+                        all_latencies,
+                        start_t,
+                        schedule,
+                    )
+                latencies = all_latencies[item.key]
+                latencies["lock_wait"] = record.wait
+                latencies["overtaken"] = float(record.overtaken)
+        finished[item.key].set()
+        if on_node_finished is not None:
+            await on_node_finished(
+                NodeResult(
+                    item.key,
+                    api_results.get(item.key),
+                    all_latencies.get(item.key, {}),
+                )
+            )
+
+    async def _run(
+        self,
+        item: Item[Node],
+        api_results: Dict[str, Any],
+        all_results: Dict[str, Any],
+        return_api_response: bool,
+        verbose: bool,
+        all_latencies: Dict[str, Dict[str, float]],
+        start_t: float,
+        schedule: NodeSchedule,
+    ) -> None:
+        # `item.data` is private to the current execution (see `Flow.fork`)
+        node = item.data
+        node.executing = True
         t0 = time.time()
-        node: Node = item.data.copy()
-        node.fetch_injections(all_results, verbose)
-        node.check_undefined()
+        # placeholders can only be introduced by injections
+        node.check_undefined(node.fetch_injections(all_results, verbose))
         node.check_inputs()
+        memoize, memoize_ttl = node.get_memoize_settings()
+        cache_key = None
+        if memoize:
+            cache_key = get_node_cache().get_key(node.__identifier__, node.data)
         t1 = time.time()
-        if verbose:
-            console.debug(f"executing node '{item.key}'")
-        if not node.offload:
-            results = await node.execute()
-        else:
-            results = await offload(node.execute())
-        results = node.check_results(results)
+        cached = None
+        batch = None
+        remote = get_remote_executors()
+        if remote is not None and not remote.serves(node):
+            remote = None
+        try:
+            if cache_key is not None:
+                cached = await get_node_cache().get(cache_key)
+            if cached is not None:
+                results = cached
+                if verbose:
+                    console.debug(f"using memoized results of node '{item.key}'")
+            elif remote is not None:
+                if verbose:
+                    console.debug(f"executing node '{item.key}' remotely")
+                results = await remote.execute(node)
+            elif node.batch_max_size > 1:
+                if verbose:
+                    console.debug(f"executing node '{item.key}' in batch")
+                batch_key = node.get_batch_key()
+                batcher = get_node_batcher()
+                batch = await batcher.submit(node, batch_key, schedule.order)
+                results = batch.results
+            else:
+                if verbose:
+                    console.debug(f"executing node '{item.key}'")
+                if not node.offload:
+                    results = await node.execute()
+                elif node.offload == PROCESS_OFFLOAD:
+                    results = (await get_process_runtime().run([node]))[0]
+                else:
+                    results = await offload(node.execute())
+        finally:
+            node.executing = False
+        if cached is None:
+            results = node.check_results(results)
+            if cache_key is not None:
+                await get_node_cache().set(cache_key, results, memoize_ttl)
         all_results[item.key] = results
         if return_api_response:
             results = await node.get_api_response(results)
             results = node.check_api_results(results)
             api_results[item.key] = results
         t2 = time.time()
-        item.data.executing = False
-        all_latencies[item.key] = dict(
+        latencies = all_latencies[item.key] = dict(
             pending=t0 - start_t,
             inject=t1 - t0,
             execute=t2 - t1,
             latency=t2 - t0,
         )
+        if memoize:
+            latencies["cache_hit"] = float(cached is not None)
+        if remote is not None:
+            latencies["remote"] = float(cached is None)
+        if batch is not None:
+            latencies["batch_size"] = float(batch.batch_size)
+            latencies["batch_wait"] = batch.wait
+        if cached is None:
+            get_latency_history().update(node.__identifier__, t2 - t1)
+        latencies["critical_path"] = schedule.critical_path
+        if math.isfinite(schedule.latest_start):
+            latencies["slack"] = schedule.latest_start - t0
         if verbose:
             console.debug(f"finished executing node '{item.key}'")
 
@@ -754,6 +1181,10 @@ class Flow(Bundle[Node]):
         return_api_response: bool = False,
         return_if_exception: bool = False,
         verbose: bool = False,
+        previous: Optional[FlowRun] = None,
+        on_node_finished: Optional[TNodeCallback] = None,
+        priority: int = 0,
+        deadline: Optional[float] = None,
     ) -> Dict[str, Any]:
         """
         Executes the workflow ending at the `target` node.
@@ -774,6 +1205,22 @@ class Flow(Bundle[Node]):
             - Call `get_api_response` on the results to get the final API response.
         verbose : bool, optional
             If `True`, the function will print detailed logs. Default is `False`.
+        previous : FlowRun, optional
+            A previous execution of the workflow (e.g. `latest_run`). If provided, only
+            the nodes that changed since then (and their dependents) will be executed,
+            results of the other nodes will be reused (see `get_reusable`).
+            > This should only be used when nodes are deterministic.
+        on_node_finished : TNodeCallback, optional
+            If provided, it will be called with a `NodeResult` as soon as each node
+            finishes, which is useful for streaming the results.
+        priority : int, optional
+            The priority of the execution, higher values will be scheduled first when
+            nodes of different executions are waiting for the same lock. Default is `0`.
+        deadline : float, optional
+            The deadline (in seconds from now) of the execution. Among executions of
+            the same priority, nodes whose deadlines (minus the estimated time of
+            their remaining paths) are earlier will be scheduled first.
+            > Nodes will still be executed if the deadline is missed.
 
         Returns
         -------
@@ -792,15 +1239,38 @@ class Flow(Bundle[Node]):
         all_results: Dict[str, Any] = {}
         extra_results: Dict[str, Any] = {}
         all_latencies: Dict[str, Dict[str, float]] = {}
+        snapshots: Dict[str, Node] = {}
         if intermediate is None:
             intermediate = []
         reachable_nodes: List[Node] = []
         try:
-            workflow = self.copy()
-            if target not in workflow:
+            if target not in self:
                 raise ValueError(f"cannot find target '{target}' in the workflow")
-            reachable = workflow.get_reachable(target)
-            reachable_nodes = [item.data for item in workflow if item.key in reachable]
+            reachable = self.get_reachable(target)
+            workflow = self.fork(reachable)
+            snapshots = {item.key: item.data.fork() for item in workflow}
+            if previous is not None:
+                reused = self.get_reusable(previous, reachable)
+                for key in reused:
+                    all_results[key] = previous.results[key]
+                    all_latencies[key] = dict(
+                        pending=0.0,
+                        inject=0.0,
+                        execute=0.0,
+                        latency=0.0,
+                        reused=1.0,
+                    )
+                if verbose:
+                    console.debug(f"reusing results of {len(reused)} nodes")
+            # reused nodes will not be executed, but they still need to be initialized
+            # if their API responses are required (e.g. `GatherNode` needs the flow)
+            api_keys = {target, *intermediate} if return_api_response else set()
+            reachable_nodes = [
+                item.data
+                for item in workflow
+                if item.key in reachable
+                and (item.key not in all_results or item.key in api_keys)
+            ]
             for node in reachable_nodes:
                 node.check_injections()
                 await warmup(node.__class__, verbose)
@@ -808,8 +1278,23 @@ class Flow(Bundle[Node]):
                 if verbose:
                     console.debug(f"initializing node '{node.key}'")
                 await node.initialize(workflow)
-            await asyncio.gather(
-                *(
+            finished = {key: asyncio.Event() for key in reachable}
+            estimates = self.get_estimates(reachable)
+            dependents: Dict[str, List[str]] = {}
+            for item in workflow:
+                if item.key in all_results:
+                    estimates[item.key] = 0.0
+                elif item.key in reachable:
+                    for injection in item.data.injections:
+                        dependents.setdefault(injection.src_key, []).append(item.key)
+            schedules = get_schedules(
+                estimates,
+                dependents,
+                priority=priority,
+                deadline=None if deadline is None else time.time() + deadline,
+            )
+            tasks = [
+                asyncio.create_task(
                     workflow.run(
                         item,
                         api_results,
@@ -818,11 +1303,22 @@ class Flow(Bundle[Node]):
                         and (item.key == target or item.key in intermediate),
                         verbose,
                         all_latencies,
+                        finished,
+                        schedules,
+                        on_node_finished,
                     )
-                    for item in workflow
-                    if item.key in reachable
                 )
-            )
+                for item in workflow
+                if item.key in reachable
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                # if any node fails, its dependents will never be able to start,
+                # so we cancel them instead of leaving them waiting forever
+                for task in tasks:
+                    if not task.done():
+                        task.cancel()
             extra_results[EXCEPTION_MESSAGE_KEY] = None
         except Exception as err:
             if not return_if_exception:
@@ -841,6 +1337,10 @@ class Flow(Bundle[Node]):
                     msg = f"error occurred when cleaning up node '{node.key}': {get_err_msg(err)}"
                     console.error(msg)
         self.latest_latencies = all_latencies
+        self.latest_run = FlowRun(
+            nodes={k: v for k, v in snapshots.items() if k in all_results},
+            results=dict(all_results),
+        )
         extra_results[ALL_LATENCIES_KEY] = all_latencies
         final_results = api_results if return_api_response else all_results
         final_results.update(extra_results)
@@ -897,9 +1397,12 @@ class NodeModel(BaseModel):
         default_factory=list,
         description="A list of injections of the node.",
     )
-    offload: bool = Field(
+    offload: Union[bool, str] = Field(
         False,
-        description="A flag indicating whether the node should be offloaded.",
+        description=(
+            "A flag indicating whether the node should be offloaded.\n"
+            "> `True` / `'thread'` for sub-threads, `'process'` for worker processes."
+        ),
     )
     lock_key: Optional[str] = Field(None, description="The lock key of the node.")
 
@@ -916,6 +1419,28 @@ class WorkflowModel(BaseModel):
         description="Whether to return partial results if exception occurs.",
     )
     verbose: bool = Field(False, description="Whether to print debug logs.")
+    keep_results: bool = Field(
+        False,
+        description="Whether to keep the results on the server, so they can be "
+        "reused by following executions (see `previous_run_id`).\n"
+        "> If `True`, the run id will be returned under the `$run_id$` key.",
+    )
+    previous_run_id: Optional[str] = Field(
+        None,
+        description="The run id of a previous execution (with `keep_results=True`). "
+        "If provided, only the nodes that changed since then (and their dependents) "
+        "will be executed.",
+    )
+    priority: int = Field(
+        0,
+        description="The priority of the execution, higher values will be scheduled "
+        "first when nodes are waiting for the same lock (e.g. `$cuda$`).",
+    )
+    deadline: Optional[float] = Field(
+        None,
+        description="The deadline (in seconds after the request is received) of the "
+        "execution, nodes of executions with earlier deadlines will be scheduled first.",
+    )
 
     def get_workflow(self) -> Flow:
         workflow_json = []
@@ -924,24 +1449,52 @@ class WorkflowModel(BaseModel):
             workflow_json.append(node_json)
         return Flow.from_json(workflow_json)
 
-    async def run(self, *, return_api_response: bool = False) -> Dict[str, Any]:
-        return await self.get_workflow().execute(
+    async def run(
+        self,
+        *,
+        return_api_response: bool = False,
+        previous: Optional[FlowRun] = None,
+        on_node_finished: Optional[TNodeCallback] = None,
+    ) -> Dict[str, Any]:
+        if previous is None and self.previous_run_id is not None:
+            previous = get_run_cache().get(self.previous_run_id)
+            if previous is None:
+                console.warn(
+                    f"previous run '{self.previous_run_id}' is not found (or has "
+                    "expired), the workflow will be fully executed"
+                )
+        workflow = self.get_workflow()
+        results = await workflow.execute(
             self.target,
             self.intermediate,
             return_api_response=return_api_response,
             return_if_exception=self.return_if_exception,
             verbose=self.verbose,
+            previous=previous,
+            on_node_finished=on_node_finished,
+            priority=self.priority,
+            deadline=self.deadline,
         )
+        if self.keep_results and workflow.latest_run is not None:
+            run_id = random_hash()
+            size = get_size(workflow.latest_run.results)
+            get_run_cache().set(run_id, workflow.latest_run, size=size)
+            results[RUN_ID_KEY] = run_id
+        return results
 
 
 __all__ = [
     "UNDEFINED_PLACEHOLDER",
     "EXCEPTION_MESSAGE_KEY",
     "ALL_LATENCIES_KEY",
+    "RUN_ID_KEY",
     "Injection",
     "LoopBackInjection",
     "Schema",
     "Node",
+    "NodeResult",
+    "TNodeCallback",
+    "FlowRun",
     "Flow",
     "BaseModel",
     "SrcKey",
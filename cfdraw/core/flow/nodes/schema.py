@@ -20,6 +20,7 @@ from ..core import Hook
 from ..core import Node
 from ..core import Schema
 from ...toolkit.cv import to_base64
+from ...toolkit.web import get_http_session
 from ...toolkit.web import download_raw_with_retry
 from ...toolkit.web import download_image_with_retry
 
@@ -73,18 +74,17 @@ class EmptyOutput(BaseModel):
 
 
 class HttpSessionHook(Hook):
-    @classmethod
-    async def initialize(cls, shared_pool: Dict[str, Any]) -> None:
-        if HTTP_SESSION_KEY not in shared_pool:
-            shared_pool[HTTP_SESSION_KEY] = ClientSession()
+    """
+    Prepares the pooled `ClientSession` of the running event loop (see
+    `get_http_session`), which is shared across executions.
+
+    > The pooled sessions are closed by `close_http_session` instead of `cleanup`,
+    because `shared_pool` is shared by executions of different event loops.
+    """
 
     @classmethod
-    async def cleanup(cls, shared_pool: Dict[str, Any]) -> None:
-        http_session = shared_pool.pop(HTTP_SESSION_KEY, None)
-        if http_session is not None:
-            if not isinstance(http_session, ClientSession):
-                raise TypeError(f"invalid http session type: {type(http_session)}")
-            await http_session.close()
+    async def initialize(cls, shared_pool: Dict[str, Any]) -> None:
+        get_http_session()
 
 
 class IWithHttpSessionNode(Node):
@@ -93,8 +93,10 @@ class IWithHttpSessionNode(Node):
 
     Notes
     -----
-    - This interface provides `http_session` to get the `ClientSession` from the `shared_pool`.
+    - This interface provides `http_session` to get the pooled `ClientSession` of the running event loop
+      (or the one provided in the `shared_pool`).
     - This interface provides `download_raw` and `download_image` to download data from the internet.
+      - Downloads are cached & deduplicated by url, see `DownloadCache`.
 
     """
 
@@ -104,12 +106,10 @@ class IWithHttpSessionNode(Node):
 
     @property
     def http_session(self) -> ClientSession:
+        # a custom session can still be provided in the `shared_pool`
         session = self.shared_pool.get(HTTP_SESSION_KEY)
         if session is None:
-            raise ValueError(
-                f"`{HTTP_SESSION_KEY}` should be provided in the `shared_pool` "
-                f"for `{self.__class__.__name__}`"
-            )
+            return get_http_session()
         if not isinstance(session, ClientSession):
             raise TypeError(f"invalid http session type: {type(session)}")
         return session
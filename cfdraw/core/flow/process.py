@@ -0,0 +1,312 @@
+import os
+import asyncio
+
+from typing import Any
+from typing import List
+from typing import Type
+from typing import Tuple
+from typing import Optional
+from typing import NamedTuple
+from typing import TYPE_CHECKING
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+
+from ..parameters import OPT
+from ..toolkit.array import SharedArray
+
+if TYPE_CHECKING:
+    from .core import Node
+
+
+PROCESS_OFFLOAD = "process"
+# modes that can be restored by `Image.fromarray` without losing information
+SHAREABLE_IMAGE_MODES = {"L", "LA", "RGB", "RGBA", "I", "F"}
+
+
+class SharedArrayRef(NamedTuple):
+    """
+    A picklable reference to a `SharedArray`, which is used in place of large
+    `np.ndarray` / `PIL.Image` values when they are sent across processes.
+    """
+
+    name: str
+    dtype: str
+    shape: Tuple[int, ...]
+    image_mode: Optional[str] = None
+
+
+def share(value: Any, threshold: int, shared: List[SharedArray]) -> Any:
+    """
+    Replace large (>= `threshold` bytes) `np.ndarray` / `PIL.Image` values in `value`
+    with `SharedArrayRef`s, the created `SharedArray`s will be appended to `shared`.
+
+    > Only `dict`s, `list`s & `tuple`s will be traversed.
+    """
+
+    if isinstance(value, dict):
+        return {k: share(v, threshold, shared) for k, v in value.items()}
+    if isinstance(value, list):
+        return [share(v, threshold, shared) for v in value]
+    if isinstance(value, tuple) and not isinstance(value, SharedArrayRef):
+        return tuple(share(v, threshold, shared) for v in value)
+    import numpy as np
+    from PIL import Image
+
+    image_mode = None
+    if isinstance(value, Image.Image):
+        if value.mode not in SHAREABLE_IMAGE_MODES:
+            return value
+        w, h = value.size
+        if w * h * len(value.getbands()) < threshold:
+            return value
+        image_mode = value.mode
+        value = np.asarray(value)
+    if not isinstance(value, np.ndarray) or value.dtype.hasobject:
+        return value
+    if image_mode is None and value.nbytes < threshold:
+        return value
+    array = SharedArray.from_data(np.ascontiguousarray(value))
+    shared.append(array)
+    return SharedArrayRef(array.name, value.dtype.str, value.shape, image_mode)
+
+
+def restore(value: Any, *, destroy: bool) -> Any:
+    """
+    The inverse of `share`, the referenced `SharedArray`s will be copied out, and
+    will be destroyed if `destroy` is `True` (otherwise they will only be closed).
+    """
+
+    if isinstance(value, SharedArrayRef):
+        array = SharedArray(value.name, value.dtype, value.shape, create=False)
+        try:
+            data = array.value.copy()
+        finally:
+            if destroy:
+                array.destroy()
+            else:
+                array.close()
+        if value.image_mode is None:
+            return data
+        from PIL import Image
+
+        return Image.fromarray(data)
+    if isinstance(value, dict):
+        return {k: restore(v, destroy=destroy) for k, v in value.items()}
+    if isinstance(value, list):
+        return [restore(v, destroy=destroy) for v in value]
+    if isinstance(value, tuple):
+        return tuple(restore(v, destroy=destroy) for v in value)
+    return value
+
+
+def release(value: Any) -> None:
+    """Destroy the `SharedArray`s referenced in `value` without restoring them."""
+
+    if isinstance(value, SharedArrayRef):
+        try:
+            SharedArray(value.name, value.dtype, value.shape, create=False).destroy()
+        except FileNotFoundError:
+            pass
+    elif isinstance(value, dict):
+        for v in value.values():
+            release(v)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            release(v)
+
+
+# worker side
+
+
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_worker_loop() -> asyncio.AbstractEventLoop:
+    global _worker_loop
+    if _worker_loop is None:
+        _worker_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_worker_loop)
+    return _worker_loop
+
+
+def _init_worker(warmup_nodes: List[Type["Node"]]) -> None:
+    from .core import warmup
+
+    loop = _get_worker_loop()
+    for t_node in warmup_nodes:
+        loop.run_until_complete(warmup(t_node, False))
+
+
+def _ping() -> None:
+    pass
+
+
+def _execute_in_worker(nodes: List["Node"], batch: bool, threshold: int) -> Any:
+    from .core import warmup
+
+    loop = _get_worker_loop()
+    for node in nodes:
+        node.data = restore(node.data, destroy=False)
+    t_node = nodes[0].__class__
+    loop.run_until_complete(warmup(t_node, False))
+    if batch:
+        results = loop.run_until_complete(t_node.execute_batch(nodes))
+    else:
+        results = [loop.run_until_complete(node.execute()) for node in nodes]
+    shared: List[SharedArray] = []
+    try:
+        return share(results, threshold, shared)
+    except Exception:
+        for array in shared:
+            array.destroy()
+        shared = []
+        raise
+    finally:
+        # the main process will destroy them after restoring
+        for array in shared:
+            array.close()
+
+
+# main process side
+
+
+class ProcessOffloadRuntime:
+    """
+    A process-wide runtime for executing nodes (whose `offload` is `"process"`) in a
+    persistent pool of worker processes, so CPU-bound nodes will not fight for the GIL.
+
+    - Nodes are pickled to the workers, so node classes should be importable and
+    their `data` should be picklable.
+    - Large `np.ndarray` / `PIL.Image` values (in `data` & results) are sent through
+    shared memory (see `SharedArray`) instead of being pickled, see `shm_threshold`.
+    - Each worker owns its own event loop, and will `warmup` the node class before
+    its first execution in that worker (if it is not warmed up yet).
+    - `execute` runs in the worker, so it cannot access `shared_pool` / hooks /
+    states of the main process, and modifications to the node will not be synced back.
+
+    Parameters
+    ----------
+    max_workers : {int, None}, maximum number of worker processes.
+    * If None, the default of `concurrent.futures.ProcessPoolExecutor` will be used.
+    shm_threshold : int, arrays / images smaller than this (in bytes) will be pickled.
+    mp_context : {str, None}, the multiprocessing start method (e.g. "spawn").
+    warmup_nodes : {list, None}, node classes to warmup when each worker starts.
+
+    """
+
+    def __init__(
+        self,
+        max_workers: Optional[int] = None,
+        *,
+        shm_threshold: int = 1024 * 1024,
+        mp_context: Optional[str] = None,
+        warmup_nodes: Optional[List[Type["Node"]]] = None,
+    ) -> None:
+        import multiprocessing
+
+        if os.name == "posix":
+            # workers should share the resource tracker of the main process, which
+            # owns (and destroys) all the shared memories
+            from multiprocessing import resource_tracker
+
+            resource_tracker.ensure_running()
+        context = None
+        if mp_context is not None:
+            context = multiprocessing.get_context(mp_context)
+        self.shm_threshold = shm_threshold
+        self._executor = ProcessPoolExecutor(
+            max_workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(list(warmup_nodes or []),),
+        )
+        self.max_workers: int = self._executor._max_workers  # type: ignore
+
+    async def start(self) -> None:
+        """Spawn the worker processes ahead of time, so the first executions are fast."""
+
+        futures = [self._executor.submit(_ping) for _ in range(self.max_workers)]
+        await asyncio.gather(*map(asyncio.wrap_future, futures))
+
+    async def run(self, nodes: List["Node"], *, batch: bool = False) -> List[Any]:
+        """
+        Execute `nodes` (which should be of the same class) in a worker process, and
+        return their results.
+
+        * If `batch` is `True`, `execute_batch` will be used, otherwise each node will
+        be executed one by one.
+        """
+
+        shared: List[SharedArray] = []
+        handle: Optional[Future] = None
+        try:
+            packed = []
+            for node in nodes:
+                node = node.fork()
+                node.data = share(node.data, self.shm_threshold, shared)
+                packed.append(node)
+            args = packed, batch, self.shm_threshold
+            handle = self._executor.submit(_execute_in_worker, *args)
+            results = await asyncio.wrap_future(handle)
+        finally:
+            for array in shared:
+                array.destroy()
+            if handle is not None and not handle.done():
+                # cancelled while executing, results should still be released
+                handle.add_done_callback(_release_results)
+        return restore(results, destroy=True)
+
+    def shutdown(self, *, wait: bool = False) -> None:
+        self._executor.shutdown(wait=wait)
+
+
+def _release_results(handle: Future) -> None:
+    if not handle.cancelled() and handle.exception() is None:
+        release(handle.result())
+
+
+_process_runtime: Optional[ProcessOffloadRuntime] = None
+
+
+def get_process_runtime() -> ProcessOffloadRuntime:
+    """
+    Get the process-wide `ProcessOffloadRuntime`.
+
+    > By default it is created from `OPT.flow_opt["process_pool"]`, and can be
+    replaced by `setup_process_runtime`.
+    """
+
+    global _process_runtime
+    if _process_runtime is None:
+        _process_runtime = ProcessOffloadRuntime(**OPT.flow_opt["process_pool"])
+    return _process_runtime
+
+
+def setup_process_runtime(
+    max_workers: Optional[int] = None,
+    *,
+    shm_threshold: int = 1024 * 1024,
+    mp_context: Optional[str] = None,
+    warmup_nodes: Optional[List[Type["Node"]]] = None,
+) -> ProcessOffloadRuntime:
+    """(Re)create the process-wide `ProcessOffloadRuntime` used by `Flow.execute`."""
+
+    global _process_runtime
+    if _process_runtime is not None:
+        _process_runtime.shutdown()
+    _process_runtime = ProcessOffloadRuntime(
+        max_workers,
+        shm_threshold=shm_threshold,
+        mp_context=mp_context,
+        warmup_nodes=warmup_nodes,
+    )
+    return _process_runtime
+
+
+__all__ = [
+    "PROCESS_OFFLOAD",
+    "SharedArrayRef",
+    "ProcessOffloadRuntime",
+    "get_process_runtime",
+    "setup_process_runtime",
+]
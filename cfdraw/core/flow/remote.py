@@ -0,0 +1,466 @@
+import re
+import sys
+import time
+import socket
+import asyncio
+import subprocess
+
+from io import BytesIO
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Type
+from typing import Optional
+from typing import Iterator
+from typing import TYPE_CHECKING
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import field
+from dataclasses import dataclass
+
+from ..parameters import OPT
+from ..toolkit.cv import to_base64
+from ..toolkit.cv import from_base64
+from ..toolkit.web import get_http_session
+from ..toolkit.constants import WEB_ERR_CODE
+
+if TYPE_CHECKING:
+    from .core import Node
+
+
+REMOTE_ENDPOINT_NAME = "node_executor"
+VALUE_TYPE_KEY = "$type$"
+
+
+# codec
+
+
+def encode_value(value: Any) -> Any:
+    """
+    Encode `value` to a JSON serializable object, so it can be sent to / from remote
+    workers. `PIL.Image`, `np.ndarray` and `bytes` values are supported (as tagged
+    base64 strings), besides the JSON values.
+    """
+
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, dict):
+        return {k: encode_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(v) for v in value]
+    if isinstance(value, bytes):
+        return {VALUE_TYPE_KEY: "bytes", "data": to_base64_bytes(value)}
+    from PIL import Image
+
+    if isinstance(value, Image.Image):
+        return {VALUE_TYPE_KEY: "image", "data": to_base64(value)}
+    import numpy as np
+
+    if isinstance(value, np.ndarray):
+        buffer = BytesIO()
+        np.save(buffer, value, allow_pickle=False)
+        return {VALUE_TYPE_KEY: "array", "data": to_base64_bytes(buffer.getvalue())}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"cannot encode value of type '{type(value)}'")
+
+
+def decode_value(value: Any) -> Any:
+    """The inverse of `encode_value`."""
+
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    value_type = value.get(VALUE_TYPE_KEY)
+    if value_type is None:
+        return {k: decode_value(v) for k, v in value.items()}
+    if value_type == "image":
+        return from_base64(value["data"])
+    import base64
+
+    data = base64.b64decode(value["data"])
+    if value_type == "bytes":
+        return data
+    if value_type == "array":
+        import numpy as np
+
+        return np.load(BytesIO(data), allow_pickle=False)
+    raise ValueError(f"unrecognized value type '{value_type}'")
+
+
+def to_base64_bytes(data: bytes) -> str:
+    import base64
+
+    return base64.b64encode(data).decode()
+
+
+# coordinator side
+
+
+class RemoteNodeError(RuntimeError):
+    """The node failed on the remote worker, which will not be retried."""
+
+
+@dataclass
+class RemoteWorker:
+    """
+    A remote worker which serves the `node_executor` API (see `API`).
+
+    Attributes
+    ----------
+    url : str
+        The base url of the worker, e.g. `http://localhost:8123`.
+    nodes : List[str]
+        Regex patterns, nodes whose `__identifier__` fully matches any of them will be
+        dispatched to this worker.
+    tags : List[str]
+        Nodes whose `remote_tags` contain any of them will be dispatched to this worker.
+    max_concurrency : int
+        The expected concurrency of the worker, used for load-aware routing.
+    healthy / inflight / latency : runtime states, should not be touched.
+
+    """
+
+    url: str
+    nodes: List[str] = field(default_factory=list)
+    tags: List[str] = field(default_factory=list)
+    max_concurrency: int = 4
+    healthy: bool = True
+    inflight: int = 0
+    latency: Optional[float] = None
+
+    @property
+    def load(self) -> float:
+        return self.inflight / max(1, self.max_concurrency)
+
+    def serves(self, t_node: Type["Node"]) -> bool:
+        if set(self.tags) & set(t_node.remote_tags):
+            return True
+        identifier = t_node.__identifier__
+        return any(re.fullmatch(pattern, identifier) for pattern in self.nodes)
+
+
+class RemoteExecutors:
+    """
+    Dispatches the executions of nodes to `RemoteWorker`s, see `Node.remote_tags`.
+
+    - The post-injection `data` (with the `offload` & `lock_key`) of the node is sent
+    to the `node_executor` API of the worker, and the (raw) results are sent back,
+    see `encode_value`.
+    - Among the healthy workers which serve the node, the least loaded one (then the
+    fastest one) will be selected.
+    - If a worker cannot be reached (or returns unexpected responses), it will be
+    marked as unhealthy and the execution will be retried (on other workers if
+    possible) with exponential backoff. Errors raised by the node itself will not
+    be retried.
+    - Workers are health checked every `health_interval` seconds in the background,
+    unhealthy workers will be used again once they pass the health check.
+    - Requests are sent with the pooled session of the running event loop, see
+    `get_http_session`.
+
+    """
+
+    def __init__(
+        self,
+        workers: List[RemoteWorker],
+        *,
+        timeout: float = 300.0,
+        retries: int = 2,
+        retry_interval: float = 0.5,
+        health_interval: float = 5.0,
+    ) -> None:
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_interval = retry_interval
+        self.health_interval = health_interval
+        self._matched: Dict[str, List[RemoteWorker]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._health_task: Optional["asyncio.Task[None]"] = None
+
+    def match(self, t_node: Type["Node"]) -> List[RemoteWorker]:
+        identifier = t_node.__identifier__
+        matched = self._matched.get(identifier)
+        if matched is None:
+            matched = [w for w in self.workers if w.serves(t_node)]
+            self._matched[identifier] = matched
+        return matched
+
+    def serves(self, node: "Node") -> bool:
+        return bool(self.match(node.__class__))
+
+    async def execute(self, node: "Node") -> Any:
+        workers = self.match(node.__class__)
+        if not workers:
+            raise ValueError(f"no remote worker serves '{node.__identifier__}'")
+        self._ensure_started()
+        payload = dict(
+            type=node.__identifier__,
+            data=encode_value(node.data),
+            offload=node.offload,
+            lock_key=node.lock_key,
+        )
+        tried: List[RemoteWorker] = []
+        msg = ""
+        for i in range(self.retries + 1):
+            worker = self._select(workers, tried)
+            if i > 0:
+                await asyncio.sleep(self.retry_interval * 2 ** (i - 1))
+            tried.append(worker)
+            try:
+                return decode_value(await self._post(worker, payload))
+            except RemoteNodeError:
+                raise
+            except Exception as err:
+                worker.healthy = False
+                msg = f"{worker.url} | {type(err).__name__}: {err}"
+        raise RuntimeError(
+            f"failed to execute '{node.__identifier__}' remotely after "
+            f"{len(tried)} attempts ({msg})"
+        )
+
+    async def check_health(self) -> None:
+        await asyncio.gather(*map(self._ping, self.workers))
+
+    async def close(self) -> None:
+        self._stop_health_check()
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        task = self._health_task
+        if task is not None and not task.done():
+            # the health check keeps running in its own loop as long as it is alive
+            if self._loop is loop or (
+                self._loop is not None and self._loop.is_running()
+            ):
+                return
+        self._stop_health_check()
+        self._loop = loop
+        self._health_task = loop.create_task(self._check_health_forever())
+
+    def _stop_health_check(self) -> None:
+        task = self._health_task
+        loop = self._loop
+        self._health_task = None
+        self._loop = None
+        if task is None or task.done() or loop is None or loop.is_closed():
+            return
+        # the task is bound to its own loop, which may be of another thread
+        loop.call_soon_threadsafe(task.cancel)
+
+    def _select(
+        self,
+        workers: List[RemoteWorker],
+        tried: List[RemoteWorker],
+    ) -> RemoteWorker:
+        # tried / unhealthy workers are used only if there are no other choices
+        candidates = [w for w in workers if w not in tried] or workers
+        healthy = [w for w in candidates if w.healthy]
+        if healthy:
+            candidates = healthy
+        return min(candidates, key=lambda w: (w.load, w.latency or 0.0))
+
+    async def _post(self, worker: RemoteWorker, payload: Dict[str, Any]) -> Any:
+        from aiohttp import ClientTimeout
+
+        session = get_http_session()
+        url = f"{worker.url}/{REMOTE_ENDPOINT_NAME}"
+        t = time.time()
+        worker.inflight += 1
+        try:
+            timeout = ClientTimeout(total=self.timeout)
+            async with session.post(url, json=payload, timeout=timeout) as res:
+                if res.status == WEB_ERR_CODE:
+                    detail = (await res.json()).get("detail")
+                    raise RemoteNodeError(f"[{worker.url}] {detail}")
+                res.raise_for_status()
+                results = (await res.json())["results"]
+        finally:
+            worker.inflight -= 1
+        latency = time.time() - t
+        if worker.latency is None:
+            worker.latency = latency
+        else:
+            worker.latency = 0.8 * worker.latency + 0.2 * latency
+        worker.healthy = True
+        return results
+
+    async def _ping(self, worker: RemoteWorker) -> None:
+        from aiohttp import ClientTimeout
+
+        try:
+            timeout = ClientTimeout(total=max(1.0, self.health_interval))
+            url = f"{worker.url}/server_status"
+            async with get_http_session().get(url, timeout=timeout) as res:
+                worker.healthy = res.status == 200
+        except Exception:
+            worker.healthy = False
+
+    async def _check_health_forever(self) -> None:
+        while True:
+            await self.check_health()
+            await asyncio.sleep(self.health_interval)
+
+
+_remote_executors: Optional[RemoteExecutors] = None
+_local_execution: ContextVar[bool] = ContextVar("local_execution", default=False)
+
+
+@contextmanager
+def local_execution() -> Iterator[None]:
+    """
+    Within this context, `get_remote_executors` will return `None`, so nodes will be
+    executed locally. This is used by the remote workers themselves, which may share
+    the same settings (e.g. `CFCORE_ENV`) with the coordinator.
+    """
+
+    token = _local_execution.set(True)
+    try:
+        yield
+    finally:
+        _local_execution.reset(token)
+
+
+def get_remote_executors() -> Optional[RemoteExecutors]:
+    """
+    Get the process-wide `RemoteExecutors`, `None` if there are no remote workers
+    (or if it is called within `local_execution`).
+
+    > By default it is created from `OPT.flow_opt["remote"]`, and can be replaced by
+    `setup_remote_executors`.
+    """
+
+    global _remote_executors
+    if _local_execution.get():
+        return None
+    if _remote_executors is None:
+        remote_opt = dict(OPT.flow_opt["remote"])
+        workers = [RemoteWorker(**w) for w in remote_opt.pop("workers")]
+        if not workers:
+            return None
+        _remote_executors = RemoteExecutors(workers, **remote_opt)
+    return _remote_executors
+
+
+def setup_remote_executors(
+    workers: List[RemoteWorker],
+    *,
+    timeout: float = 300.0,
+    retries: int = 2,
+    retry_interval: float = 0.5,
+    health_interval: float = 5.0,
+) -> RemoteExecutors:
+    """(Re)create the process-wide `RemoteExecutors` used by `Flow.execute`."""
+
+    global _remote_executors
+    _remote_executors = RemoteExecutors(
+        workers,
+        timeout=timeout,
+        retries=retries,
+        retry_interval=retry_interval,
+        health_interval=health_interval,
+    )
+    return _remote_executors
+
+
+# local deployment
+
+
+def get_free_port(host: str = "127.0.0.1") -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+class LocalWorkers:
+    """
+    A reference deployment which launches `num_workers` worker processes on this
+    machine, mainly for testing. Each worker imports `modules` (to register the
+    nodes) and serves the node APIs (see `API`) on a free port.
+
+    Examples
+    --------
+    >>> workers = LocalWorkers(2, ["my_nodes"], nodes=["my\\..*"])
+    >>> await workers.wait_ready()
+    >>> setup_remote_executors(workers.workers)
+    >>> ...
+    >>> workers.close()
+
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        modules: List[str],
+        *,
+        host: str = "127.0.0.1",
+        nodes: Optional[List[str]] = None,
+        tags: Optional[List[str]] = None,
+        max_concurrency: int = 4,
+    ) -> None:
+        self.workers = []
+        self.processes = []
+        for _ in range(num_workers):
+            port = get_free_port(host)
+            args = f"{host!r}, {port}, {modules!r}"
+            code = f"from {__name__} import serve_worker; serve_worker({args})"
+            self.processes.append(subprocess.Popen([sys.executable, "-c", code]))
+            worker = RemoteWorker(
+                f"http://{host}:{port}",
+                list(nodes or []),
+                list(tags or []),
+                max_concurrency,
+            )
+            self.workers.append(worker)
+
+    async def wait_ready(self, timeout: float = 60.0) -> None:
+        from aiohttp import ClientSession
+
+        t = time.time()
+        async with ClientSession() as session:
+            for worker, process in zip(self.workers, self.processes):
+                while True:
+                    if process.poll() is not None:
+                        raise RuntimeError(f"worker '{worker.url}' exited unexpectedly")
+                    try:
+                        async with session.get(f"{worker.url}/server_status") as res:
+                            if res.status == 200:
+                                break
+                    except Exception:
+                        pass
+                    if time.time() - t > timeout:
+                        raise TimeoutError(f"worker '{worker.url}' is not ready")
+                    await asyncio.sleep(0.2)
+
+    def close(self) -> None:
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+
+
+def serve_worker(host: str, port: int, modules: List[str]) -> None:
+    import uvicorn
+    import importlib
+
+    from .server import api
+
+    for module in modules:
+        importlib.import_module(module)
+    api.initialize()
+    uvicorn.run(api.app, host=host, port=port, log_level="warning")
+
+
+__all__ = [
+    "RemoteNodeError",
+    "RemoteWorker",
+    "RemoteExecutors",
+    "LocalWorkers",
+    "encode_value",
+    "decode_value",
+    "local_execution",
+    "get_remote_executors",
+    "setup_remote_executors",
+    "serve_worker",
+]
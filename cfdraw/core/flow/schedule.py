@@ -0,0 +1,260 @@
+import math
+import time
+import heapq
+import asyncio
+import threading
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Tuple
+from typing import Optional
+from typing import NamedTuple
+from typing import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+
+class NodeSchedule(NamedTuple):
+    """
+    Scheduling information of a node in an execution, see `Flow.execute`.
+
+    Attributes
+    ----------
+    priority : int
+        The priority of the execution, higher values will be scheduled first.
+    critical_path : float
+        The estimated time (in seconds) of the longest path starting from the node
+        (inclusive) to the end of the execution.
+    latest_start : float
+        The latest (absolute) time the node should start to meet the deadline of the
+        execution, `inf` if there is no deadline.
+    """
+
+    priority: int
+    critical_path: float
+    latest_start: float
+
+    @property
+    def order(self) -> Tuple[float, float, float]:
+        """smaller values will be scheduled first"""
+
+        return -self.priority, self.latest_start, -self.critical_path
+
+
+class LatencyHistory:
+    """
+    Records (exponential moving averages of) the execution latencies of each node
+    type, which are used to estimate the critical paths when scheduling.
+    """
+
+    def __init__(self, momentum: float = 0.8) -> None:
+        self.momentum = momentum
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, float] = {}
+
+    def update(self, identifier: str, latency: float) -> None:
+        with self._lock:
+            previous = self._latencies.get(identifier)
+            if previous is None:
+                self._latencies[identifier] = latency
+            else:
+                m = self.momentum
+                self._latencies[identifier] = m * previous + (1.0 - m) * latency
+
+    def get(self, identifier: str) -> Optional[float]:
+        return self._latencies.get(identifier)
+
+
+@dataclass
+class LockRecord:
+    """
+    The queueing record of an acquisition of a `PriorityLock`.
+
+    Attributes
+    ----------
+    wait : float
+        Time (in seconds) spent waiting for the lock.
+    overtaken : int
+        The number of acquisitions that were queued later but granted earlier.
+    """
+
+    wait: float = 0.0
+    overtaken: int = 0
+
+
+class _LockWaiter:
+    """A waiter of a `PriorityLock`, bound to the event loop it is waiting in."""
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        future: "asyncio.Future[None]",
+        record: LockRecord,
+    ) -> None:
+        self.loop = loop
+        self.future = future
+        self.record = record
+        self.granted = False
+        self.cancelled = False
+
+
+class PriorityLock:
+    """
+    An `asyncio.Lock` alternative which grants the lock to the waiter with the
+    smallest `order` (ties are broken by arrival), instead of the first arrived one.
+
+    - The lock can be shared across event loops (e.g. the loops of the offload worker
+    threads), the lock is handed over to waiters of other loops thread-safely.
+
+    > Even if the lock is free, it will be granted in the next iteration of the event
+    loop, so acquisitions that become ready at the same time will all be considered.
+    """
+
+    def __init__(self) -> None:
+        self._mutex = threading.Lock()
+        self._locked = False
+        self._counter = 0
+        self._waiters: List[Tuple[Any, int, _LockWaiter]] = []
+
+    def locked(self) -> bool:
+        return self._locked
+
+    async def acquire(self, order: Any) -> LockRecord:
+        record = LockRecord()
+        t = time.time()
+        loop = asyncio.get_running_loop()
+        waiter = _LockWaiter(loop, loop.create_future(), record)
+        with self._mutex:
+            self._counter += 1
+            heapq.heappush(self._waiters, (order, self._counter, waiter))
+            schedule = not self._locked
+            self._locked = True
+        if schedule:
+            loop.call_soon(self.release)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._mutex:
+                waiter.cancelled = True
+                granted = waiter.granted
+            if granted:
+                # the lock was granted right before the cancellation
+                self.release()
+            raise
+        record.wait = time.time() - t
+        return record
+
+    def release(self) -> None:
+        while True:
+            with self._mutex:
+                waiter = self._pop_waiter()
+                if waiter is None:
+                    self._locked = False
+                    return
+            try:
+                # the lock is handed over directly, so it remains locked
+                waiter.loop.call_soon_threadsafe(self._wake, waiter)
+                return
+            except RuntimeError:
+                # the event loop of the waiter is closed, try the next one
+                continue
+
+    @asynccontextmanager
+    async def hold(self, order: Any) -> AsyncIterator[LockRecord]:
+        record = await self.acquire(order)
+        try:
+            yield record
+        finally:
+            self.release()
+
+    def _pop_waiter(self) -> Optional[_LockWaiter]:
+        while self._waiters:
+            _, counter, waiter = heapq.heappop(self._waiters)
+            if waiter.cancelled:
+                continue
+            for _, other_counter, other in self._waiters:
+                if other_counter < counter and not other.cancelled:
+                    other.record.overtaken += 1
+            waiter.granted = True
+            return waiter
+        return None
+
+    def _wake(self, waiter: _LockWaiter) -> None:
+        # if the future is cancelled, the lock will be released by `acquire`
+        if not waiter.future.done():
+            waiter.future.set_result(None)
+
+
+_latency_history = LatencyHistory()
+_node_locks: Dict[str, PriorityLock] = {}
+_node_locks_lock = threading.Lock()
+
+
+def get_latency_history() -> LatencyHistory:
+    return _latency_history
+
+
+def get_node_lock(lock_key: str) -> PriorityLock:
+    """
+    Get the process-wide `PriorityLock` of `lock_key`, so nodes with the same
+    `lock_key` will never be executed concurrently, even across workflows (and
+    across event loops, e.g. flows executed in different offload worker threads).
+    """
+
+    with _node_locks_lock:
+        lock = _node_locks.get(lock_key)
+        if lock is None:
+            lock = _node_locks[lock_key] = PriorityLock()
+        return lock
+
+
+def get_schedules(
+    estimates: Dict[str, float],
+    dependents: Dict[str, List[str]],
+    *,
+    priority: int = 0,
+    deadline: Optional[float] = None,
+) -> Dict[str, NodeSchedule]:
+    """
+    Compute the `NodeSchedule` of each node.
+
+    Parameters
+    ----------
+    estimates : Dict[str, float]
+        The estimated execution time (in seconds) of each node.
+    dependents : Dict[str, List[str]]
+        The keys of the nodes that depend on each node.
+    priority : int
+        The priority of the execution.
+    deadline : float, optional
+        The (absolute) deadline of the execution.
+
+    """
+
+    def get_critical_path(key: str) -> float:
+        path = critical_paths.get(key)
+        if path is None:
+            downstream = [get_critical_path(k) for k in dependents.get(key, [])]
+            path = estimates[key] + max(downstream, default=0.0)
+            critical_paths[key] = path
+        return path
+
+    critical_paths: Dict[str, float] = {}
+    schedules = {}
+    for key in estimates:
+        critical_path = get_critical_path(key)
+        latest_start = math.inf if deadline is None else deadline - critical_path
+        schedules[key] = NodeSchedule(priority, critical_path, latest_start)
+    return schedules
+
+
+__all__ = [
+    "NodeSchedule",
+    "LatencyHistory",
+    "LockRecord",
+    "PriorityLock",
+    "get_latency_history",
+    "get_node_lock",
+    "get_schedules",
+]
@@ -1,27 +1,43 @@
 import re
+import json
 import asyncio
 
+from enum import Enum
 from typing import Any
 from typing import Dict
 from typing import List
 from typing import Type
+from typing import Tuple
+from typing import Union
 from typing import Optional
+from typing import AsyncIterator
 from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from pydantic import create_model
 from pydantic import Field
 from pydantic import BaseModel
 
+from .core import RUN_ID_KEY
+from .core import ALL_LATENCIES_KEY
+from .core import EXCEPTION_MESSAGE_KEY
 from .core import WORKFLOW_ENDPOINT_NAME
 from .core import warmup
 from .core import Node
 from .core import Flow
 from .core import WorkflowModel
+from .core import NodeResult
 from .core import InjectionModel
+from .remote import encode_value
+from .remote import decode_value
+from .remote import local_execution
+from .remote import REMOTE_ENDPOINT_NAME
 from .nodes.common import to_endpoint
 from ..parameters import OPT
 from ..toolkit.web import raise_err
 from ..toolkit.web import get_responses
 from ..toolkit.misc import random_hash
+from ..toolkit.misc import get_err_msg
 
 
 def parse_endpoint(t_node: Type[Node]) -> str:
@@ -105,6 +121,64 @@ def register_nodes_api(app: FastAPI) -> None:
         register_api(app, t_node, focus)
 
 
+class StreamFormat(str, Enum):
+    SSE = "sse"
+    NDJSON = "ndjson"
+
+
+def encode_event(event: str, payload: Dict[str, Any], fmt: StreamFormat) -> str:
+    if fmt == StreamFormat.SSE:
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps(dict(event=event, **payload)) + "\n"
+
+
+async def stream_workflow(data: WorkflowModel, fmt: StreamFormat) -> AsyncIterator[str]:
+    """
+    Execute the workflow and stream the events:
+
+    * `node`: emitted as soon as each node finishes, with its `key` & `latencies`,
+    and its `result` (API response) if it is the `target` or one of the
+    `intermediate` nodes.
+    * `done`: emitted once the whole workflow finishes, with the `target`, the
+    `exception` message (if any), all `latencies` and the `run_id` (if kept).
+
+    > If the client disconnects, the execution will be cancelled.
+    """
+
+    queue: "asyncio.Queue[Tuple[str, Dict[str, Any]]]" = asyncio.Queue()
+
+    async def on_node_finished(result: NodeResult) -> None:
+        payload = dict(key=result.key, latencies=result.latencies)
+        if result.api_response is not None:
+            payload["result"] = jsonable_encoder(result.api_response)
+        await queue.put(("node", payload))
+
+    async def run() -> None:
+        summary: Dict[str, Any] = dict(target=data.target)
+        try:
+            results = await data.run(
+                return_api_response=True,
+                on_node_finished=on_node_finished,
+            )
+            summary["exception"] = results.get(EXCEPTION_MESSAGE_KEY)
+            summary["latencies"] = results.get(ALL_LATENCIES_KEY)
+            summary["run_id"] = results.get(RUN_ID_KEY)
+        except Exception as err:
+            summary["exception"] = get_err_msg(err)
+        await queue.put(("done", summary))
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            event, payload = await queue.get()
+            yield encode_event(event, payload, fmt)
+            if event == "done":
+                break
+    finally:
+        if not task.done():
+            task.cancel()
+
+
 def register_workflow_api(app: FastAPI) -> None:
     @app.post(f"/{WORKFLOW_ENDPOINT_NAME}")
     async def workflow(data: WorkflowModel) -> Dict[str, Any]:
@@ -114,6 +188,68 @@ def register_workflow_api(app: FastAPI) -> None:
             raise_err(err)
             return {}
 
+    @app.post(f"/{WORKFLOW_ENDPOINT_NAME}/stream")
+    async def workflow_stream(
+        data: WorkflowModel,
+        format: StreamFormat = StreamFormat.SSE,
+    ) -> StreamingResponse:
+        """
+        Streaming version of the `workflow` API, see `stream_workflow` for the events.
+        * format: `sse` for Server-Sent Events, `ndjson` for newline delimited JSON.
+        """
+
+        if format == StreamFormat.SSE:
+            media_type = "text/event-stream"
+        else:
+            media_type = "application/x-ndjson"
+        return StreamingResponse(
+            stream_workflow(data, format),
+            media_type=media_type,
+            headers={"cache-control": "no-cache"},
+        )
+
+
+class RemoteNodeModel(BaseModel):
+    type: str = Field(..., description="The type of the node.")
+    data: Dict[str, Any] = Field(
+        default_factory=dict,
+        description="The (post-injection) data of the node, see `encode_value`.",
+    )
+    offload: Union[bool, str] = Field(False, description="The `offload` of the node.")
+    lock_key: Optional[str] = Field(None, description="The `lock_key` of the node.")
+
+
+def register_node_executor_api(app: FastAPI) -> None:
+    """
+    Register the API which executes a single node and returns its raw results, it is
+    used by `RemoteExecutors` to dispatch nodes to this server.
+
+    > The node is always executed locally (see `local_execution`), with its own
+    `offload` & `lock_key`.
+    """
+
+    @app.post(f"/{REMOTE_ENDPOINT_NAME}", include_in_schema=False)
+    async def node_executor(data: RemoteNodeModel) -> Dict[str, Any]:
+        try:
+            if not Node.has(data.type):
+                raise ValueError(f"node '{data.type}' is not registered")
+            key = random_hash()
+            t_node = Node.get(data.type)
+            node = t_node(
+                key,
+                decode_value(data.data),
+                offload=data.offload,
+                lock_key=data.lock_key,
+            )
+            flow = Flow().push(node)
+            with local_execution():
+                results = await flow.execute(key)
+            latencies = results[ALL_LATENCIES_KEY][key]
+            return dict(results=encode_value(results[key]), latencies=latencies)
+        except Exception as err:
+            raise_err(err)
+            return {}
+
 
 class ServerStatus(BaseModel):
     num_nodes: int = Field(
@@ -141,6 +277,7 @@ class API:
         register_server_api(self.app)
         register_nodes_api(self.app)
         register_workflow_api(self.app)
+        register_node_executor_api(self.app)
 
 
 api = API()
@@ -153,6 +290,10 @@ __all__ = [
     "use_all_t_nodes",
     "register_api",
     "register_nodes_api",
+    "StreamFormat",
+    "stream_workflow",
     "register_workflow_api",
+    "RemoteNodeModel",
+    "register_node_executor_api",
     "API",
 ]
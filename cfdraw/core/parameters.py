@@ -18,7 +18,38 @@ class OPTClass(OPTBase):
     def defaults(self) -> Dict[str, Any]:
         user_dir = Path.home()
         return dict(
-            flow_opt=dict(focus="", verbose=True),
+            flow_opt=dict(
+                focus="",
+                verbose=True,
+                # kwargs of the default `NodeResultCache`
+                node_cache=dict(
+                    max_items=256,
+                    max_bytes=512 * 1024 * 1024,
+                    disk_folder=None,
+                    disk_max_bytes=4 * 1024 * 1024 * 1024,
+                ),
+                # limits of the results kept for incremental re-execution
+                run_cache=dict(
+                    max_items=32,
+                    max_bytes=1024 * 1024 * 1024,
+                    ttl=3600.0,
+                ),
+                # kwargs of the default `ProcessOffloadRuntime`
+                process_pool=dict(
+                    max_workers=None,
+                    shm_threshold=1024 * 1024,
+                    mp_context=None,
+                ),
+                # remote workers (kwargs of `RemoteWorker`) & kwargs of the
+                # default `RemoteExecutors`
+                remote=dict(
+                    workers=[],
+                    timeout=300.0,
+                    retries=2,
+                    retry_interval=0.5,
+                    health_interval=5.0,
+                ),
+            ),
             learn_opt=dict(
                 cache_dir=user_dir / ".cache" / "carefree-core" / "learn",
                 data_cache_dir=user_dir / ".cache" / "carefree-core" / "learn" / "data",
@@ -662,7 +662,7 @@ class SharedArray:
     def __init__(
         self,
         name: str,
-        dtype: Union[type, "np.dtype"],
+        dtype: Union[str, type, "np.dtype"],
         shape: Union[List[int], Tuple[int, ...]],
         *,
         create: bool = True,
@@ -1,4 +1,6 @@
 import gc
+import time
+import threading
 
 from typing import Any
 from typing import Dict
@@ -10,7 +12,9 @@ from typing import TypeVar
 from typing import Callable
 from typing import Iterator
 from typing import Optional
+from typing import NamedTuple
 from datetime import datetime
+from collections import OrderedDict
 
 from . import console
 from .misc import sort_dict_by_value
@@ -137,6 +141,122 @@ class Types(Generic[TTypes]):
         return self._types.values()  # type: ignore
 
 
+class CacheStats(NamedTuple):
+    num_items: int
+    num_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+
+
+class CacheEntry(Generic[TItemData]):
+    def __init__(self, data: TItemData, size: int, expire: Optional[float]) -> None:
+        self.data = data
+        self.size = size
+        self.expire = expire
+
+
+class LRUCache(Generic[TItemData]):
+    """
+    A thread-safe LRU cache with both item-count-based & size-based eviction.
+
+    * max_items : Optional[int], maximum number of items, `None` means no limit.
+    * max_bytes : Optional[int], maximum total size of items, `None` means no limit.
+    > the size of each item should be provided when calling `set`.
+    * ttl : Optional[float], default time-to-live (in seconds) of each item,
+    `None` means items will never expire.
+    """
+
+    def __init__(
+        self,
+        max_items: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        *,
+        ttl: Optional[float] = None,
+    ) -> None:
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: OrderedDict[str, CacheEntry[TItemData]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._num_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key, record=False) is not None
+
+    def get(self, key: str, *, record: bool = True) -> Optional[TItemData]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expire is not None:
+                if entry.expire <= time.time():
+                    self._pop(key)
+                    entry = None
+            if entry is None:
+                if record:
+                    self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if record:
+                self._hits += 1
+            return entry.data
+
+    def set(
+        self,
+        key: str,
+        data: TItemData,
+        *,
+        size: int = 0,
+        ttl: Optional[float] = None,
+    ) -> None:
+        if ttl is None:
+            ttl = self.ttl
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expire = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = CacheEntry(data, size, expire)
+            self._num_bytes += size
+            while self._entries and (
+                (self.max_items is not None and len(self._entries) > self.max_items)
+                or (self.max_bytes is not None and self._num_bytes > self.max_bytes)
+            ):
+                self._pop(next(iter(self._entries)))
+                self._evictions += 1
+
+    def remove(self, key: str) -> Optional[TItemData]:
+        with self._lock:
+            entry = self._pop(key)
+        return None if entry is None else entry.data
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._num_bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                num_items=len(self._entries),
+                num_bytes=self._num_bytes,
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+            )
+
+    def _pop(self, key: str) -> Optional[CacheEntry[TItemData]]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._num_bytes -= entry.size
+        return entry
+
+
 class IPoolItem:
     """
     Life cycle of a pool item:
@@ -9,6 +9,8 @@ import decimal
 import inspect
 import hashlib
 import operator
+import weakref
+import threading
 import unicodedata
 
 from abc import abstractmethod
@@ -51,7 +53,10 @@ from .types import np_dict_type
 from .constants import TIME_FORMAT
 
 if TYPE_CHECKING:
+    from asyncio import AbstractEventLoop
     from accelerate import InitProcessGroupKwargs
+    from concurrent.futures import Future
+    from concurrent.futures import ThreadPoolExecutor
 
 
 # torch distributed utils
@@ -646,18 +651,215 @@ async def retry(
     raise ValueError(f"failed after {num_retry} retries")
 
 
-async def offload(future: Coroutine[Any, Any, TFutureResponse]) -> TFutureResponse:
-    import asyncio
-    from concurrent.futures import ThreadPoolExecutor
+class OffloadStats(NamedTuple):
+    max_workers: int
+    pending: int
+    running: int
+    finished: int
+    mean_wait: float
+    max_wait: float
+
+
+def _close_worker_loops(
+    executor: "ThreadPoolExecutor",
+    loops: List["AbstractEventLoop"],
+) -> None:
+    # worker loops can only be closed after the workers are all finished
+    executor.shutdown(wait=True)
+    while loops:
+        loop = loops.pop()
+        if not loop.is_closed():
+            loop.close()
+
+
+class OffloadRuntime:
+    """
+    A process-wide runtime for offloading coroutines to sub-threads.
+
+    - Worker threads are created once and reused, each of them owns its own event loop.
+    - At most `max_workers` coroutines will be executed concurrently, others will wait
+    in the queue (see `stats` for the queue depth & wait times).
+    - Offloading inside a worker thread will simply await the coroutine, since we are
+    already off the 'main' event loop.
+    - `run_threadsafe` can be used to hand off coroutines from worker threads back to the
+    'main' event loop (e.g. sending websocket messages) without blocking.
+
+    Parameters
+    ----------
+    max_workers : {int, None}, maximum number of worker threads.
+    * If None, the default of `concurrent.futures.ThreadPoolExecutor` will be used.
+    window_size : int, window size of the running statistics of the wait times.
+
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, *, window_size: int = 100):
+        from concurrent.futures import ThreadPoolExecutor
 
-    loop = asyncio.get_event_loop()
-    with ThreadPoolExecutor() as executor:
-        return await loop.run_in_executor(
-            executor,
-            lambda new_loop, f: new_loop.run_until_complete(f),
-            asyncio.new_event_loop(),
-            future,
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers,
+            thread_name_prefix="offload",
+            initializer=self._init_worker,
         )
+        self.max_workers: int = self._executor._max_workers
+        self._loops: List["AbstractEventLoop"] = []
+        # also closes the worker loops at exit, if `shutdown` is never called
+        self._finalizer = weakref.finalize(
+            self,
+            _close_worker_loops,
+            self._executor,
+            self._loops,
+        )
+        self.main_loop: Optional["AbstractEventLoop"] = None
+        self._pending = 0
+        self._running = 0
+        self._finished = 0
+        self._max_wait = 0.0
+        self._wait_times = Incrementer(window_size)
+
+    @property
+    def in_worker(self) -> bool:
+        return getattr(self._local, "loop", None) is not None
+
+    def bind_loop(self, loop: "AbstractEventLoop") -> "OffloadRuntime":
+        self.main_loop = loop
+        return self
+
+    def stats(self) -> OffloadStats:
+        with self._lock:
+            num_waits = self._wait_times.num_record
+            return OffloadStats(
+                max_workers=self.max_workers,
+                pending=self._pending,
+                running=self._running,
+                finished=self._finished,
+                mean_wait=self._wait_times.mean if num_waits > 0 else 0.0,
+                max_wait=self._max_wait,
+            )
+
+    async def run(
+        self, future: Coroutine[Any, Any, TFutureResponse]
+    ) -> TFutureResponse:
+        import asyncio
+
+        if self.in_worker:
+            return await future
+        if self.main_loop is None:
+            self.main_loop = asyncio.get_running_loop()
+        with self._lock:
+            self._pending += 1
+        handle = self._executor.submit(self._execute, future, time.time())
+        handle.add_done_callback(lambda h: self._on_done(h, future))
+        return await asyncio.wrap_future(handle)
+
+    def run_threadsafe(
+        self,
+        future: Coroutine[Any, Any, TFutureResponse],
+        callback: Optional[Callable[[Optional[TFutureResponse]], None]] = None,
+    ) -> bool:
+        """
+        Schedule `future` on the 'main' event loop and return immediately.
+
+        - Return `False` if there is no available 'main' event loop.
+        - `callback` will be called with the result of `future` (or `None` if it fails).
+        """
+
+        import asyncio
+
+        loop = self.main_loop
+        if loop is None or loop.is_closed():
+            return False
+        try:
+            handle = asyncio.run_coroutine_threadsafe(future, loop)
+        except RuntimeError:
+            return False
+
+        def _done(h: "Future") -> None:
+            if h.cancelled():
+                result = None
+            elif h.exception() is not None:
+                console.error(f"failed to execute future: {h.exception()}")
+                result = None
+            else:
+                result = h.result()
+            if callback is not None:
+                callback(result)
+
+        handle.add_done_callback(_done)
+        return True
+
+    def shutdown(self, *, wait: bool = False) -> None:
+        """
+        Shutdown the worker threads and close their event loops.
+
+        - If `wait` is False, the event loops will be closed in a background thread
+        after all the submitted coroutines are finished.
+        """
+
+        if wait:
+            self._finalizer()
+        else:
+            self._executor.shutdown(wait=False)
+            threading.Thread(target=self._finalizer, name="offload-shutdown").start()
+
+    def _init_worker(self) -> None:
+        import asyncio
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self._local.loop = loop
+        with self._lock:
+            self._loops.append(loop)
+
+    def _execute(
+        self,
+        future: Coroutine[Any, Any, TFutureResponse],
+        submit_time: float,
+    ) -> TFutureResponse:
+        wait = time.time() - submit_time
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+            self._wait_times.update(wait)
+            self._max_wait = max(self._max_wait, wait)
+        try:
+            return self._local.loop.run_until_complete(future)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._finished += 1
+
+    def _on_done(self, handle: "Future", future: Coroutine) -> None:
+        # cancelled before being picked up by any worker
+        if handle.cancelled():
+            with self._lock:
+                self._pending -= 1
+            future.close()
+
+
+_offload_runtime: Optional[OffloadRuntime] = None
+
+
+def get_offload_runtime() -> OffloadRuntime:
+    global _offload_runtime
+    if _offload_runtime is None:
+        _offload_runtime = OffloadRuntime()
+    return _offload_runtime
+
+
+def setup_offload_runtime(max_workers: Optional[int] = None) -> OffloadRuntime:
+    """(Re)create the process-wide `OffloadRuntime` with the given `max_workers`."""
+
+    global _offload_runtime
+    if _offload_runtime is not None:
+        _offload_runtime.shutdown()
+    _offload_runtime = OffloadRuntime(max_workers)
+    return _offload_runtime
+
+
+async def offload(future: Coroutine[Any, Any, TFutureResponse]) -> TFutureResponse:
+    return await get_offload_runtime().run(future)
 
 
 def compress(absolute_folder: TPath, remove_original: bool = True) -> None:
@@ -1,6 +1,11 @@
+import re
 import json
 import time
+import random
+import asyncio
 import logging
+import weakref
+import threading
 
 from io import BytesIO
 from typing import Any
@@ -10,12 +15,15 @@ from typing import TypeVar
 from typing import Callable
 from typing import Optional
 from typing import Awaitable
+from typing import NamedTuple
 from typing import TYPE_CHECKING
+from urllib.parse import urlparse
 from pydantic import BaseModel
 from pydantic import ConfigDict
 
 from .misc import get_err_msg
 from .constants import WEB_ERR_CODE
+from .data_structures import LRUCache
 
 if TYPE_CHECKING:
     from PIL import Image
@@ -107,13 +115,277 @@ def log_times(endpoint: str, times: Dict[str, float]) -> None:
     logging.debug(f"elapsed time of endpoint {endpoint} : {json.dumps(times)}")
 
 
+# pooled http session
+
+
+class HttpSessionSettings(NamedTuple):
+    limit: int = 100
+    limit_per_host: int = 16
+    keepalive_timeout: float = 60.0
+    dns_cache_ttl: int = 300
+
+
+_http_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ClientSession]"
+_http_sessions = weakref.WeakKeyDictionary()
+_http_sessions_lock = threading.Lock()
+_http_session_settings = HttpSessionSettings()
+
+
+def get_http_session() -> "ClientSession":
+    """
+    Get the (connection pooled, keep-alive) `ClientSession` of the running event
+    loop, so connections (and TLS handshakes) can be reused across requests. It can
+    be configured by `setup_http_session`.
+
+    - Sessions are bound to event loops, so each event loop (e.g. the main loop and
+    the loops of the offload worker threads) has its own session.
+    > The sessions should not be closed by the users, see `close_http_session`.
+    """
+
+    from aiohttp import TCPConnector
+    from aiohttp import ClientSession
+
+    loop = asyncio.get_running_loop()
+    with _http_sessions_lock:
+        session = _http_sessions.get(loop)
+        if session is None or session.closed:
+            settings = _http_session_settings
+            connector = TCPConnector(
+                limit=settings.limit,
+                limit_per_host=settings.limit_per_host,
+                keepalive_timeout=settings.keepalive_timeout,
+                ttl_dns_cache=settings.dns_cache_ttl,
+            )
+            session = _http_sessions[loop] = ClientSession(connector=connector)
+        return session
+
+
+def setup_http_session(
+    limit: int = 100,
+    limit_per_host: int = 16,
+    keepalive_timeout: float = 60.0,
+    dns_cache_ttl: int = 300,
+) -> None:
+    """
+    Configure the connection pool of `get_http_session`.
+
+    > Takes effect when the next session is created, see `close_http_session`.
+    """
+
+    global _http_session_settings
+    _http_session_settings = HttpSessionSettings(
+        limit,
+        limit_per_host,
+        keepalive_timeout,
+        dns_cache_ttl,
+    )
+
+
+async def close_http_session() -> None:
+    """
+    Close the sessions (of all event loops) created by `get_http_session`.
+
+    - Sessions are closed in their own event loops. If such a loop is not running,
+    it will be run (in the default executor) to close the session.
+    - Sessions of closed event loops can only be detached, their connections are
+    already unusable.
+    """
+
+    current = asyncio.get_running_loop()
+    with _http_sessions_lock:
+        sessions = list(_http_sessions.items())
+        _http_sessions.clear()
+    for loop, session in sessions:
+        if session.closed:
+            continue
+        try:
+            if loop is current:
+                await session.close()
+            elif loop.is_closed():
+                session.detach()
+            elif loop.is_running():
+                handle = asyncio.run_coroutine_threadsafe(session.close(), loop)
+                await asyncio.wrap_future(handle)
+            else:
+                await current.run_in_executor(None, _close_idle_session, loop, session)
+        except Exception as err:
+            logging.warning(f"failed to close http session: {get_err_msg(err)}")
+
+
+def _close_idle_session(
+    loop: asyncio.AbstractEventLoop,
+    session: "ClientSession",
+) -> None:
+    coroutine = session.close()
+    try:
+        loop.run_until_complete(coroutine)
+    except BaseException:
+        # the loop is picked up by its owner in the meantime
+        coroutine.close()
+        raise
+
+
+# download cache
+
+
+class HttpStatusError(ValueError):
+    """Raised when a download responds with an error status code."""
+
+    def __init__(self, url: str, status: int, body: bytes) -> None:
+        try:
+            detail = body[:200].decode("utf-8")
+        except UnicodeDecodeError:
+            detail = repr(body[:20])
+        super().__init__(f"[{status}] {url} | {detail}")
+        self.status = status
+
+
+class CachedDownload(NamedTuple):
+    data: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fresh_until: Optional[float]
+
+
+class DownloadStats(NamedTuple):
+    num_items: int
+    num_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+    revalidated: int
+    deduplicated: int
+
+
+class DownloadCache:
+    """
+    Caches the downloaded contents by url.
+
+    * Contents are cached only if the response has validators (`ETag` and / or
+    `Last-Modified`) or a `max-age`, and `no-store` is not specified.
+    * Cached contents are reused directly while they are fresh (`max-age`), and are
+    revalidated with conditional requests (`If-None-Match` / `If-Modified-Since`)
+    otherwise, so unchanged contents will not be downloaded again.
+    * Concurrent downloads of the same url are deduplicated (single-flight).
+    * Requests with extra kwargs (e.g. headers) bypass the cache.
+    """
+
+    def __init__(
+        self,
+        max_items: Optional[int] = 1024,
+        max_bytes: Optional[int] = 256 * 1024 * 1024,
+    ) -> None:
+        self.cache = LRUCache[CachedDownload](max_items, max_bytes)
+        self._pending: Dict[str, "asyncio.Task[bytes]"] = {}
+        self._revalidated = 0
+        self._deduplicated = 0
+
+    async def get(self, session: "ClientSession", url: str, **kw: Any) -> bytes:
+        if kw:
+            return await get(url, session, **kw)
+        task = self._pending.get(url)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self._deduplicated += 1
+        else:
+            task = asyncio.get_running_loop().create_task(self._fetch(session, url))
+            self._pending[url] = task
+            task.add_done_callback(lambda t: self._on_done(url, t))
+        # the download should not be cancelled by any single caller
+        return await asyncio.shield(task)
+
+    def stats(self) -> DownloadStats:
+        return DownloadStats(*self.cache.stats(), self._revalidated, self._deduplicated)
+
+    def _on_done(self, url: str, task: "asyncio.Task[bytes]") -> None:
+        if self._pending.get(url) is task:
+            self._pending.pop(url)
+        # the error will be raised to the callers, if any
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch(self, session: "ClientSession", url: str) -> bytes:
+        cached = self.cache.get(url)
+        headers = {}
+        if cached is not None:
+            if cached.fresh_until is not None and cached.fresh_until > time.time():
+                return cached.data
+            if cached.etag is not None:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified is not None:
+                headers["If-Modified-Since"] = cached.last_modified
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and cached is not None:
+                self._revalidated += 1
+                self._store(url, cached.data, response.headers, cached)
+                return cached.data
+            data = await response.read()
+            if response.status >= 400:
+                raise HttpStatusError(url, response.status, data)
+            if response.status == 200:
+                self._store(url, data, response.headers)
+            return data
+
+    def _store(
+        self,
+        url: str,
+        data: bytes,
+        headers: Any,
+        cached: Optional[CachedDownload] = None,
+    ) -> None:
+        cache_control = headers.get("Cache-Control", "").lower()
+        if "no-store" in cache_control:
+            self.cache.remove(url)
+            return
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        if cached is not None:
+            etag = etag or cached.etag
+            last_modified = last_modified or cached.last_modified
+        fresh_until = None
+        match = re.search(r"max-age=(\d+)", cache_control)
+        if match is not None and "no-cache" not in cache_control:
+            fresh_until = time.time() + int(match.group(1))
+        if etag is None and last_modified is None and fresh_until is None:
+            return
+        entry = CachedDownload(data, etag, last_modified, fresh_until)
+        self.cache.set(url, entry, size=len(data))
+
+
+_download_cache: Optional[DownloadCache] = None
+
+
+def get_download_cache() -> DownloadCache:
+    """Get the process-wide `DownloadCache` used by `download_raw`."""
+
+    global _download_cache
+    if _download_cache is None:
+        _download_cache = DownloadCache()
+    return _download_cache
+
+
+def setup_download_cache(
+    max_items: Optional[int] = 1024,
+    max_bytes: Optional[int] = 256 * 1024 * 1024,
+) -> DownloadCache:
+    """(Re)create the process-wide `DownloadCache` used by `download_raw`."""
+
+    global _download_cache
+    _download_cache = DownloadCache(max_items, max_bytes)
+    return _download_cache
+
+
 async def download_raw(session: "ClientSession", url: str, **kw: Any) -> bytes:
     try:
-        return await get(url, session, **kw)
+        return await get_download_cache().get(session, url, **kw)
+    except (HttpStatusError, asyncio.TimeoutError):
+        raise
     except Exception:
         import requests
 
-        return requests.get(url, **kw).content
+        def _fallback() -> bytes:
+            return requests.get(url, **kw).content
+
+        return await asyncio.get_running_loop().run_in_executor(None, _fallback)
 
 
 async def download_image(
@@ -141,25 +413,243 @@ async def download_image(
         raise ValueError(msg)
 
 
+# retry
+
+
+class CircuitOpenError(ValueError):
+    """Raised when requests to a host are rejected because its circuit is open."""
+
+
+class RetryStats(NamedTuple):
+    requests: int
+    attempts: int
+    retries: int
+    failures: int
+    budget_exhausted: int
+    circuit_rejections: int
+    open_circuits: int
+
+
+class HostState:
+    def __init__(self, budget: float) -> None:
+        self.budget = budget
+        self.consecutive_failures = 0
+        self.open_until: Optional[float] = None
+        self.trial_inflight = False
+
+
+class RetryManager:
+    """
+    Shared states of `retry_with`, tracked per host.
+
+    * Retry budget: each request deposits `budget_ratio` tokens (up to `budget_min`)
+    and each retry consumes one, so retries are limited to a fraction of the requests
+    once a host keeps failing, instead of multiplying the load on it.
+    * Circuit breaker: after `breaker_threshold` consecutive failures, the circuit of
+    the host opens and requests are rejected immediately for `breaker_cooldown`
+    seconds. After that, one trial request is let through (half-open), and the
+    circuit closes again if it succeeds.
+    * Backoff: retries wait `interval * 2 ** i` seconds (capped by `max_interval`),
+    of which a random `jitter` fraction is dropped, without blocking the event loop.
+    * timeout : default timeout (in seconds) of each attempt.
+    """
+
+    def __init__(
+        self,
+        *,
+        timeout: Optional[float] = 60.0,
+        max_interval: float = 8.0,
+        jitter: float = 0.5,
+        budget_ratio: float = 0.2,
+        budget_min: int = 10,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 30.0,
+    ) -> None:
+        self.timeout = timeout
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.budget_ratio = budget_ratio
+        self.budget_min = budget_min
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, HostState] = {}
+        self._requests = 0
+        self._attempts = 0
+        self._retries = 0
+        self._failures = 0
+        self._budget_exhausted = 0
+        self._circuit_rejections = 0
+
+    def get_interval(self, interval: float, i: int) -> float:
+        interval = min(self.max_interval, interval * 2**i)
+        return interval * (1.0 - self.jitter * random.random())
+
+    def on_request(self, host: str) -> None:
+        with self._lock:
+            self._requests += 1
+            state = self._get_state(host)
+            state.budget = min(self.budget_min, state.budget + self.budget_ratio)
+
+    def before_attempt(self, host: str) -> None:
+        with self._lock:
+            state = self._get_state(host)
+            if state.open_until is not None:
+                if time.time() < state.open_until or state.trial_inflight:
+                    self._circuit_rejections += 1
+                    raise CircuitOpenError(f"circuit of '{host}' is open")
+                # half-open, let one trial request through
+                state.trial_inflight = True
+            self._attempts += 1
+
+    def on_success(self, host: str) -> None:
+        with self._lock:
+            state = self._get_state(host)
+            state.consecutive_failures = 0
+            state.open_until = None
+            state.trial_inflight = False
+
+    def on_failure(self, host: str) -> None:
+        with self._lock:
+            self._failures += 1
+            state = self._get_state(host)
+            state.consecutive_failures += 1
+            if state.trial_inflight or (
+                state.consecutive_failures >= self.breaker_threshold
+            ):
+                state.open_until = time.time() + self.breaker_cooldown
+                state.trial_inflight = False
+
+    def try_retry(self, host: str) -> bool:
+        with self._lock:
+            state = self._get_state(host)
+            if state.budget < 1.0:
+                self._budget_exhausted += 1
+                return False
+            state.budget -= 1.0
+            self._retries += 1
+            return True
+
+    def stats(self) -> RetryStats:
+        with self._lock:
+            now = time.time()
+            return RetryStats(
+                requests=self._requests,
+                attempts=self._attempts,
+                retries=self._retries,
+                failures=self._failures,
+                budget_exhausted=self._budget_exhausted,
+                circuit_rejections=self._circuit_rejections,
+                open_circuits=sum(
+                    1
+                    for state in self._hosts.values()
+                    if state.open_until is not None and state.open_until > now
+                ),
+            )
+
+    def _get_state(self, host: str) -> HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = HostState(float(self.budget_min))
+        return state
+
+
+_retry_manager: Optional[RetryManager] = None
+
+
+def get_retry_manager() -> RetryManager:
+    global _retry_manager
+    if _retry_manager is None:
+        _retry_manager = RetryManager()
+    return _retry_manager
+
+
+def setup_retry_manager(
+    *,
+    timeout: Optional[float] = 60.0,
+    max_interval: float = 8.0,
+    jitter: float = 0.5,
+    budget_ratio: float = 0.2,
+    budget_min: int = 10,
+    breaker_threshold: int = 5,
+    breaker_cooldown: float = 30.0,
+) -> RetryManager:
+    """(Re)create the process-wide `RetryManager` used by `retry_with`."""
+
+    global _retry_manager
+    _retry_manager = RetryManager(
+        timeout=timeout,
+        max_interval=max_interval,
+        jitter=jitter,
+        budget_ratio=budget_ratio,
+        budget_min=budget_min,
+        breaker_threshold=breaker_threshold,
+        breaker_cooldown=breaker_cooldown,
+    )
+    return _retry_manager
+
+
+def is_retryable(err: Exception) -> bool:
+    if isinstance(err, HttpStatusError):
+        return err.status >= 500 or err.status in (408, 429)
+    return True
+
+
 async def retry_with(
     download_fn: Callable[["ClientSession", str], Awaitable[TResponse]],
     session: "ClientSession",
     url: str,
     retry: int = 3,
-    interval: int = 1,
+    interval: float = 1,
+    *,
+    timeout: Optional[float] = None,
     **kw: Any,
 ) -> TResponse:
+    """
+    Call `download_fn` for at most `retry` times, see `RetryManager` for the backoff,
+    retry budgets & circuit breaking.
+
+    * Client errors (4xx responses, except 408 / 429) will not be retried.
+    * timeout : timeout (in seconds) of each attempt, `RetryManager.timeout` will
+    be used if not provided.
+    """
+
+    manager = get_retry_manager()
+    if timeout is None:
+        timeout = manager.timeout
+    host = urlparse(url).netloc
+    manager.on_request(host)
     msg = ""
+    attempts = 0
     for i in range(retry):
         try:
-            res = await download_fn(session, url, **kw)
-            if i > 0:
-                logging.warning(f"succeeded after {i} retries")
-            return res
+            manager.before_attempt(host)
+        except CircuitOpenError as err:
+            if i == 0:
+                raise
+            msg = f"{msg}\n({err})"
+            break
+        attempts += 1
+        try:
+            res = await asyncio.wait_for(download_fn(session, url, **kw), timeout)
         except Exception as err:
-            msg = str(err)
-        time.sleep(interval)
-    raise ValueError(f"{msg}\n(After {retry} retries)")
+            if isinstance(err, asyncio.TimeoutError):
+                msg = f"timeout after {timeout}s"
+            else:
+                msg = str(err)
+            if not is_retryable(err):
+                manager.on_success(host)
+                break
+            manager.on_failure(host)
+            if i == retry - 1 or not manager.try_retry(host):
+                break
+            await asyncio.sleep(manager.get_interval(interval, i))
+            continue
+        manager.on_success(host)
+        if i > 0:
+            logging.warning(f"succeeded after {i} retries")
+        return res
+    raise ValueError(f"{msg}\n(After {attempts} attempts)")
 
 
 async def download_raw_with_retry(
@@ -167,10 +657,12 @@ async def download_raw_with_retry(
     url: str,
     *,
     retry: int = 3,
-    interval: int = 1,
+    interval: float = 1,
+    timeout: Optional[float] = None,
     **kw: Any,
 ) -> bytes:
-    return await retry_with(download_raw, session, url, retry, interval, **kw)
+    args = download_raw, session, url, retry, interval
+    return await retry_with(*args, timeout=timeout, **kw)
 
 
 async def download_image_with_retry(
@@ -178,7 +670,9 @@ async def download_image_with_retry(
     url: str,
     *,
     retry: int = 3,
-    interval: int = 1,
+    interval: float = 1,
+    timeout: Optional[float] = None,
     **kw: Any,
 ) -> "Image.Image":
-    return await retry_with(download_image, session, url, retry, interval, **kw)
+    args = download_image, session, url, retry, interval
+    return await retry_with(*args, timeout=timeout, **kw)
@@ -4,6 +4,7 @@ from PIL import Image
 from typing import Any
 from typing import Dict
 from typing import List
+from typing import Union
 from typing import Optional
 
 from cfdraw import constants
@@ -14,33 +15,46 @@ from cfdraw.plugins.middlewares import *
 from cfdraw.parsers.noli import SingleNodeType
 from cfdraw.app.endpoints.upload import ImageUploader
 from cfdraw.app.endpoints.upload import FetchImageModel
+from cfdraw.core.toolkit.web import get_http_session
+from cfdraw.core.toolkit.web import download_image_with_retry
 from cfdraw.core.toolkit.misc import shallow_copy_dict
 
 
 class ISocketPlugin(IPlugin, metaclass=ABCMeta):
+    _middlewares: Optional[List[IMiddleware]] = None
+
     @abstractmethod
     async def process(self, data: ISocketRequest) -> Any:
         pass
 
     # internal APIs
 
-    @property
-    def middlewares(self) -> List[IMiddleware]:
+    @classmethod
+    def build_middlewares(cls) -> List[IMiddleware]:
         return [
-            ResponseMiddleware(self),
-            TimerMiddleware(self),
-            SendSocketMessageMiddleware(self),
+            ResponseMiddleware(),
+            TimerMiddleware(),
+            SendSocketMessageMiddleware(),
+            CacheMiddleware(),
         ]
 
+    @property
+    def middlewares(self) -> List[IMiddleware]:
+        # built once per plugin class, and shared by all its instances
+        t_plugin = type(self)
+        middlewares = t_plugin.__dict__.get("_middlewares")
+        if middlewares is None:
+            middlewares = t_plugin._middlewares = t_plugin.build_middlewares()
+        return middlewares
+
     async def __call__(self, data: ISocketRequest) -> None:
-        self.injections = {}
-        self.extra_responses = {}
         middlewares = self.middlewares
         for middleware in middlewares:
-            await middleware.before(data)
+            if middleware.is_legacy:
+                await middleware.before(data)
         response = await self.process(data)
         for middleware in middlewares:
-            response = await middleware(response)
+            response = await middleware(self, response)
 
     def to_react(self) -> Dict[str, Any]:
         return self.settings.to_react(
@@ -60,6 +74,9 @@ class ISocketPlugin(IPlugin, metaclass=ABCMeta):
         if src.startswith("http://") and constants.UPLOAD_IMAGE_FOLDER_NAME in src:
             file = src.split(constants.UPLOAD_IMAGE_FOLDER_NAME)[1][1:]  # remove '/'
             return server.get_image(file)
+        if constants.UPLOAD_IMAGE_FOLDER_NAME not in src:
+            # plugins may be offloaded, so the session of the running loop is used
+            return await download_image_with_retry(get_http_session(), src)
         data = FetchImageModel(url=src, jpeg=False, return_image=True)
         return await ImageUploader.fetch_image(data)
 
@@ -70,16 +87,38 @@ class ISocketPlugin(IPlugin, metaclass=ABCMeta):
         textList: Optional[List[str]] = None,
         imageList: Optional[List[str]] = None,
     ) -> bool:
+        """
+        Send the progress of the current task, return `False` if it failed to be sent,
+        or the task is cancelled (so it can be returned by the step callbacks directly
+        to stop the sampling).
+        """
+
+        if self.cancel_token.cancelled:
+            return False
         if textList is None and imageList is None:
             intermediate = None
         else:
             intermediate = ISocketIntermediate(textList=textList, imageList=imageList)
         message = ISocketMessage.make_progress(self.task_hash, progress, intermediate)
-        return offload_run(self.send_message(message))
+        # serialized here (usually in a worker thread) instead of in the event loop
+        return self._send_threadsafe(message.to_frame())
 
     def send_exception(self, message: str) -> bool:
-        message = ISocketMessage.make_exception(self.task_hash, message)
-        return offload_run(self.send_message(message))
+        exception = ISocketMessage.make_exception(self.task_hash, message)
+        return self._send_threadsafe(exception)
+
+    def _send_threadsafe(self, message: Union[ISocketMessage, ISocketFrame]) -> bool:
+        # messages are handed off to the main loop without waiting for them to be
+        # sent, so failures can only be reported on the subsequent calls
+        context = self.context
+        if context.send_failed:
+            return False
+
+        def _callback(success: bool) -> None:
+            if not success:
+                context.send_failed = True
+
+        return offload_run(self.send_message(message), _callback)
 
     def set_extra_response(self, key: str, value: Any) -> None:
         self.extra_responses[key] = value
@@ -1,5 +1,8 @@
+from typing import Dict
+from typing import List
 from typing import Type
 from typing import Callable
+from typing import Optional
 from typing import NamedTuple
 
 from cfdraw.schema.plugins import IPlugin
@@ -11,8 +14,87 @@ from cfdraw.core.toolkit.data_structures import Types
 TPlugin = Type[IPlugin]
 
 
+class PoolStats(NamedTuple):
+    created: int
+    reused: int
+    idle: int
+
+
+class PluginPool:
+    """
+    A pool of (warm) instances of a plugin class.
+
+    * Instances are checked out exclusively by `acquire`, so an instance handles one
+    request at a time, and its `context` holds the states of that request.
+    * Instances are returned by `release` after the request is done, at most
+    `settings.pool_size` idle instances will be kept for reuse.
+    """
+
+    def __init__(self, plugin_type: TPlugin) -> None:
+        self.plugin_type = plugin_type
+        self.max_idle: Optional[int] = None
+        self._idle: List[IPlugin] = []
+        self._created = 0
+        self._reused = 0
+
+    def acquire(self) -> IPlugin:
+        if self._idle:
+            self._reused += 1
+            return self._idle.pop()
+        plugin = self.plugin_type()
+        if self.max_idle is None:
+            self.max_idle = plugin.settings.pool_size
+        self._created += 1
+        return plugin
+
+    def release(self, plugin: IPlugin) -> None:
+        # drop the states of the finished request
+        plugin.__dict__.pop("context", None)
+        if self.max_idle is None or len(self._idle) < self.max_idle:
+            self._idle.append(plugin)
+
+    async def warmup(self) -> None:
+        """Warmup the plugin class and prepare an idle instance for the first request."""
+
+        await self.plugin_type.warmup()
+        if not self._idle:
+            self.release(self.acquire())
+
+    def stats(self) -> PoolStats:
+        return PoolStats(self._created, self._reused, len(self._idle))
+
+
 class Plugins(Types[IPlugin]):
-    pass
+    def __init__(self) -> None:
+        super().__init__()
+        self._pools: Dict[str, PluginPool] = {}
+
+    def acquire(self, key: str) -> Optional[IPlugin]:
+        pool = self.get_pool(key)
+        return None if pool is None else pool.acquire()
+
+    def release(self, key: str, plugin: IPlugin) -> None:
+        pool = self.get_pool(key)
+        if pool is not None:
+            pool.release(plugin)
+
+    def get_pool(self, key: str) -> Optional[PluginPool]:
+        pool = self._pools.get(key)
+        if pool is None:
+            plugin_type = self._types.get(key)
+            if plugin_type is None:
+                return None
+            pool = self._pools[key] = PluginPool(plugin_type)
+        return pool
+
+    async def warmup(self) -> None:
+        for key in self:
+            pool = self.get_pool(key)
+            if pool is not None:
+                await pool.warmup()
+
+    def stats(self) -> Dict[str, PoolStats]:
+        return {key: pool.stats() for key, pool in self._pools.items()}
 
 
 class PluginInfo(NamedTuple):
@@ -61,5 +143,6 @@ class PluginFactory:
 __all__ = [
     "Plugins",
     "PluginInfo",
+    "PluginPool",
     "PluginFactory",
 ]
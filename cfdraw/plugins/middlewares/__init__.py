@@ -1,3 +1,4 @@
 from .response import *
 from .timer import *
 from .send_message import *
+from .cache import *
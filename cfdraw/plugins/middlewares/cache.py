@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Union
+from typing import Optional
+from pathlib import Path
+
+from cfdraw import constants
+from cfdraw.config import get_config
+from cfdraw.utils.cache import cache_resource
+from cfdraw.utils.codec import encode_model
+from cfdraw.utils.server import get_upload_image_path
+from cfdraw.schema.plugins import IPlugin
+from cfdraw.schema.plugins import INodeData
+from cfdraw.schema.plugins import PluginType
+from cfdraw.schema.plugins import IMiddleware
+from cfdraw.schema.plugins import Subscription
+from cfdraw.schema.plugins import ElapsedTimes
+from cfdraw.schema.plugins import SocketStatus
+from cfdraw.schema.plugins import ISocketMessage
+from cfdraw.schema.plugins import ISocketRequest
+from cfdraw.core.toolkit.misc import hash_code
+from cfdraw.core.toolkit.misc import hash_dict
+from cfdraw.core.toolkit.data_structures import LRUCache
+
+
+TResponse = Optional[ISocketMessage]
+
+
+class ResultCache:
+    """
+    Caches the final `ISocketMessage` of plugins with `use_cache=True`.
+
+    The cache key is built from:
+    * the identifier of the plugin.
+    * the `userId` & `baseURL` of the request.
+    > responses may contain absolute urls built from `baseURL`, and should never be
+    shared across users.
+    * the canonicalized `extraData` of the request.
+    * the contents (hashes) of the images referenced by `nodeData` / `nodeDataList`.
+    > for images that are not uploaded to this server, their urls will be used instead.
+    * the texts of the text nodes.
+
+    > the hashes of the uploaded images are keyed by (path, mtime, size) and cached
+    in a bounded LRU cache, and they are computed in the default executor.
+    """
+
+    max_image_hashes = 4096
+
+    def __init__(self, max_items: Optional[int], max_bytes: Optional[int]) -> None:
+        self._cache = LRUCache[ISocketMessage](max_items, max_bytes)
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._image_hashes = LRUCache[str](self.max_image_hashes)
+
+    async def get(self, plugin: IPlugin, request: ISocketRequest) -> TResponse:
+        key = await self.get_key(plugin, request)
+        if key is None:
+            return None
+        message = self._cache.get(key)
+        counter = self._counters.setdefault(plugin.identifier, dict(hits=0, misses=0))
+        if message is None:
+            counter["misses"] += 1
+            return None
+        counter["hits"] += 1
+        message = message.model_copy(update=dict(hash=request.hash), deep=True)
+        if message.data.elapsedTimes is not None:
+            elapsed_times = ElapsedTimes()
+            elapsed_times.start()
+            elapsed_times.end()
+            message.data.elapsedTimes = elapsed_times
+        return message
+
+    async def set(
+        self,
+        plugin: IPlugin,
+        request: ISocketRequest,
+        message: ISocketMessage,
+    ) -> None:
+        if message.status != SocketStatus.FINISHED:
+            return
+        key = await self.get_key(plugin, request)
+        if key is None:
+            return
+        size = len(encode_model(message))
+        ttl = plugin.settings.cache_ttl
+        self._cache.set(key, message.model_copy(deep=True), size=size, ttl=ttl)
+
+    async def get_key(
+        self,
+        plugin: IPlugin,
+        request: ISocketRequest,
+    ) -> Optional[str]:
+        if not plugin.settings.use_cache:
+            return None
+        nodes = [request.nodeData] + request.nodeDataList
+        node_hashes = [await self._hash_node(node) for node in nodes]
+        return hash_code(
+            "$".join(
+                [
+                    plugin.identifier,
+                    request.userId,
+                    request.baseURL,
+                    hash_dict(request.extraData),
+                    *node_hashes,
+                ]
+            )
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(**self._cache.stats()._asdict(), plugins=self._counters)
+
+    async def _hash_node(self, node: INodeData) -> str:
+        hashes: List[str] = []
+        if node.src:
+            hashes.append(await self._hash_image(node.src))
+        if node.text is not None:
+            hashes.append(hash_code(node.text))
+        for child in node.children or []:
+            hashes.append(await self._hash_node(child))
+        return hash_code("|".join(hashes))
+
+    async def _hash_image(self, src: str) -> str:
+        if constants.UPLOAD_IMAGE_FOLDER_NAME not in src:
+            return hash_code(src)
+        file = src.split(constants.UPLOAD_IMAGE_FOLDER_NAME)[1][1:]  # remove '/'
+        try:
+            path = get_upload_image_path(file)
+        except ValueError:
+            return hash_code(src)
+        loop = asyncio.get_running_loop()
+        image_hash = await loop.run_in_executor(None, self._hash_file, path)
+        if image_hash is None:
+            return hash_code(src)
+        return image_hash
+
+    def _hash_file(self, path: Path) -> Optional[str]:
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        stat_key = f"{path}:{stat.st_mtime}:{stat.st_size}"
+        image_hash = self._image_hashes.get(stat_key, record=False)
+        if image_hash is None:
+            with path.open("rb") as f:
+                image_hash = hashlib.md5(f.read()).hexdigest()
+            self._image_hashes.set(stat_key, image_hash)
+        return image_hash
+
+
+@cache_resource
+def get_result_cache() -> ResultCache:
+    config = get_config()
+    return ResultCache(config.result_cache_max_items, config.result_cache_max_bytes)
+
+
+class CacheMiddleware(IMiddleware):
+    @property
+    def subscriptions(self) -> Union[List[PluginType], Subscription]:
+        return Subscription.ALL
+
+    @property
+    def can_handle_message(self) -> bool:
+        return True
+
+    async def process(self, plugin: IPlugin, response: TResponse) -> TResponse:
+        request = plugin.context.request
+        if response is not None and request is not None:
+            await get_result_cache().set(plugin, request, response)
+        return response
+
+
+__all__ = [
+    "ResultCache",
+    "CacheMiddleware",
+    "get_result_cache",
+]
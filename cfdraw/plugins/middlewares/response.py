@@ -7,11 +7,11 @@ from typing import Optional
 from PIL.Image import Image
 from PIL.PngImagePlugin import PngInfo
 
+from cfdraw.schema.plugins import IPlugin
 from cfdraw.schema.plugins import PluginType
 from cfdraw.schema.plugins import IMiddleware
 from cfdraw.schema.plugins import Subscription
 from cfdraw.schema.plugins import ISocketMessage
-from cfdraw.schema.plugins import ISocketRequest
 from cfdraw.app.endpoints.upload import ImageUploader
 
 
@@ -20,12 +20,9 @@ class ResponseMiddleware(IMiddleware):
     def subscriptions(self) -> Union[List[PluginType], Subscription]:
         return Subscription.ALL
 
-    async def before(self, request: ISocketRequest) -> None:
-        await super().before(request)
-        self.request = request
-
     async def process(
         self,
+        plugin: IPlugin,
         response: Optional[Union[str, List[str], Image, List[Image]]],
     ) -> Optional[ISocketMessage]:
         if response is None:
@@ -34,23 +31,27 @@ class ResponseMiddleware(IMiddleware):
             response = [response]
         if isinstance(response[0], str):
             return self.make_success(
+                plugin,
                 dict(
                     type="text",
                     value=[dict(text=text, safe=True, reason="") for text in response],
-                )
+                ),
             )
+        request = plugin.context.request
+        if request is None:
+            raise ValueError("`request` of the context should be provided")
         meta = PngInfo()
-        meta.add_text("request", self.request.model_dump_json())
+        meta.add_text("request", request.model_dump_json())
         t = time.time()
-        audit = self.plugin.image_should_audit
+        audit = plugin.image_should_audit
         upload = ImageUploader.upload_image
-        base_url = self.request.baseURL
-        user_json = self.request.get_user_json()
+        base_url = request.baseURL
+        user_json = request.get_user_json()
         args = user_json, meta, base_url, False, audit
         futures = [upload(im, *args) for im in response]
         urls = [data.model_dump() for data in await asyncio.gather(*futures)]
-        self.plugin.elapsed_times.upload = time.time() - t
-        return self.make_success(dict(type="image", value=urls))
+        plugin.elapsed_times.upload = time.time() - t
+        return self.make_success(plugin, dict(type="image", value=urls))
 
 
 __all__ = [
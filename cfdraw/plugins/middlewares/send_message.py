@@ -2,6 +2,7 @@ from typing import List
 from typing import Union
 from typing import Optional
 
+from cfdraw.schema.plugins import IPlugin
 from cfdraw.schema.plugins import PluginType
 from cfdraw.schema.plugins import IMiddleware
 from cfdraw.schema.plugins import Subscription
@@ -20,15 +21,15 @@ class SendSocketMessageMiddleware(IMiddleware):
     def can_handle_message(self) -> bool:
         return True
 
-    async def process(self, response: TResponse) -> TResponse:
+    async def process(self, plugin: IPlugin, response: TResponse) -> TResponse:
         if response is None:
             return None
-        if self.plugin.extra_responses:
+        if plugin.extra_responses:
             if response.data.final is None:
                 response.data.final = {}
-            response.data.final["extra"] = self.plugin.extra_responses
-        response.data.injections = self.plugin.injections
-        await self.plugin.send_message(response)
+            response.data.final["extra"] = plugin.extra_responses
+        response.data.injections = plugin.injections
+        await plugin.send_message(response)
         return response
 
 
@@ -1,5 +1,6 @@
 from typing import List
 
+from cfdraw.schema.plugins import IPlugin
 from cfdraw.schema.plugins import PluginType
 from cfdraw.schema.plugins import IMiddleware
 from cfdraw.plugins.middlewares.send_message import TResponse
@@ -14,11 +15,11 @@ class TimerMiddleware(IMiddleware):
     def subscriptions(self) -> List[PluginType]:
         return [PluginType.FIELDS]
 
-    async def process(self, response: TResponse) -> TResponse:
+    async def process(self, plugin: IPlugin, response: TResponse) -> TResponse:
         if response is None:
             return None
-        self.plugin.elapsed_times.end()
-        response.data.elapsedTimes = self.plugin.elapsed_times
+        plugin.elapsed_times.end()
+        response.data.elapsedTimes = plugin.elapsed_times
         return response
 
 
@@ -1,6 +1,8 @@
 import io
 import json
 import time
+import inspect
+import threading
 
 import networkx as nx
 import matplotlib.pyplot as plt
@@ -25,8 +27,11 @@ from typing import NamedTuple
 from aiohttp import ClientSession
 from pydantic import Field
 from pydantic import BaseModel
+from dataclasses import field
+from dataclasses import dataclass
 
 from cfdraw import constants
+from cfdraw.utils.codec import encode_model
 from cfdraw.schema.fields import IFieldDefinition
 from cfdraw.parsers.noli import IStr
 from cfdraw.parsers.noli import Matrix2D
@@ -42,7 +47,10 @@ from cfdraw.core.toolkit.data_structures import Bundle
 
 
 TPluginModel = TypeVar("TPluginModel")
-ISend = Callable[["ISocketMessage"], Coroutine[Any, Any, bool]]
+ISend = Callable[
+    [Union["ISocketMessage", "ISocketFrame"]],
+    Coroutine[Any, Any, bool],
+]
 
 
 class InjectionPack(BaseModel):
@@ -493,6 +501,53 @@ Pivot of the plugin.
             "need to be executed in the main thread."
         ),
     )
+    concurrency_key: Optional[str] = Field(
+        None,
+        description=(
+            "Plugins with the same `concurrency_key` share the same concurrency limit "
+            "in the request queue.\n"
+            "> If not specified, the plugin will fall into the default group, which "
+            "(by default) only allows one request to be executed at a time."
+        ),
+    )
+    max_concurrency: int = Field(
+        1,
+        ge=1,
+        description=(
+            "Maximum number of requests of the `concurrency_key` group that can be "
+            "executed concurrently.\n"
+            "> Plugins sharing the same `concurrency_key` should use the same value.\n"
+            "> The total concurrency is also bounded by `num_queue_workers` in `Config`."
+        ),
+    )
+    use_cache: bool = Field(
+        False,
+        description=(
+            "Whether to cache the results of identical requests, a cache hit will "
+            "return the cached results directly without entering the request queue.\n"
+            "> Requests are considered identical if they have the same plugin, "
+            "`extraData` and contents of the referenced images.\n"
+            "> Do NOT enable this if the plugin has randomness and you want "
+            "different results for identical requests."
+        ),
+    )
+    cache_ttl: Optional[float] = Field(
+        None,
+        gt=0,
+        description=(
+            "Time-to-live (in seconds) of the cached results, only take effect when "
+            "`use_cache` is `True`. `None` means the results will never expire."
+        ),
+    )
+    pool_size: int = Field(
+        1,
+        ge=0,
+        description=(
+            "Maximum number of idle plugin instances kept for reuse.\n"
+            "> Each instance handles one request at a time, more instances will be "
+            "created when needed, but only `pool_size` of them will be kept."
+        ),
+    )
 
     def to_react(self, type: str, hash: str, identifier: str) -> Dict[str, Any]:
         def _pop_none(_d: Dict[str, Any]) -> None:
@@ -669,6 +724,13 @@ List of data extracted from `nodes`.
         return json.dumps(dict(userId=self.userId))
 
 
+class ISocketCancelRequest(BaseModel):
+    """Cancel a request, only the user who sent the request can cancel it"""
+
+    cancel: str = Field(..., description="The hash of the request to be cancelled")
+    userId: str = Field(..., description="The `userId` of the request")
+
+
 class SocketStatus(str, Enum):
     """This should align with `PythonSocketStatus` at `src/schema/_python.ts`"""
 
@@ -757,6 +819,77 @@ class ISocketMessage(BaseModel, use_enum_values=True):  # type: ignore
             message=message,
         )
 
+    @classmethod
+    def make_interrupted(cls, hash: str, message: str) -> "ISocketMessage":
+        return cls(
+            hash=hash,
+            status=SocketStatus.INTERRUPTED,
+            total=0,
+            pending=0,
+            message=message,
+        )
+
+    def to_frame(self) -> "ISocketFrame":
+        return ISocketFrame(self.hash, self.status, encode_model(self).decode("utf-8"))
+
+
+class ISocketFrame(NamedTuple):
+    """
+    A pre-serialized `ISocketMessage`, which can be sent (to any number of clients)
+    as-is, without being serialized again. This is useful for high frequency
+    messages (e.g. progress updates), which can then be serialized once, outside
+    of the event loop.
+    """
+
+    hash: str
+    status: SocketStatus
+    text: str
+
+
+class TaskCancelledError(Exception):
+    """Raised by `CancellationToken.raise_if_cancelled`"""
+
+
+class CancellationToken:
+    """
+    A thread-safe flag which is set when the task (request) is cancelled, e.g. by
+    the user, or because the client is disconnected.
+
+    > Cancellation is cooperative, plugins should check `cancelled` (or call
+    `raise_if_cancelled`) periodically, e.g. in the callbacks of each sampling step.
+    """
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+        self.reason = ""
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "task is cancelled") -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def raise_if_cancelled(self) -> None:
+        if self._event.is_set():
+            raise TaskCancelledError(self.reason)
+
+
+@dataclass
+class RequestContext:
+    """States of the request (task) that a plugin instance is handling"""
+
+    task_hash: str
+    send_message: ISend
+    request: Optional[ISocketRequest] = None
+    cancel_token: CancellationToken = field(default_factory=CancellationToken)
+    elapsed_times: ElapsedTimes = field(default_factory=ElapsedTimes)
+    extra_responses: Dict[str, Any] = field(default_factory=dict)
+    injections: Dict[str, Any] = field(default_factory=dict)
+    send_failed: bool = False
+
 
 # plugin interface
 
@@ -765,15 +898,38 @@ class IPlugin(ABC):
     hash: str
     identifier: str
     http_session: ClientSession
-    # task specific
-    task_hash: str
-    send_message: ISend
-    elapsed_times: ElapsedTimes
-    extra_responses: Dict[str, Any]
-    injections: Dict[str, Any]
+    # task specific, plugin instances are pooled and reused (one request at a time),
+    # so states of the current request live in the `context` (see `PluginPool`)
+    context: RequestContext
     # internal
     _in_group: bool = False
 
+    # task specific shortcuts
+
+    @property
+    def task_hash(self) -> str:
+        return self.context.task_hash
+
+    @property
+    def send_message(self) -> ISend:
+        return self.context.send_message
+
+    @property
+    def cancel_token(self) -> CancellationToken:
+        return self.context.cancel_token
+
+    @property
+    def elapsed_times(self) -> ElapsedTimes:
+        return self.context.elapsed_times
+
+    @property
+    def extra_responses(self) -> Dict[str, Any]:
+        return self.context.extra_responses
+
+    @property
+    def injections(self) -> Dict[str, Any]:
+        return self.context.injections
+
     # abstract
 
     @property
@@ -814,6 +970,19 @@ class IPlugin(ABC):
 
     # optional
 
+    @classmethod
+    async def warmup(cls) -> None:
+        """
+        This is used to warmup the plugin, and will be called:
+        - only once.
+        - before the server starts.
+
+        > So you can do some heavy initializations here (e.g. loading AI models), and
+        store them on the class.
+        > Instances are pooled and reused, so states cached on the instances (e.g. in
+        `__init__`) are reused across requests as well.
+        """
+
     ## Whether the images generated by this plugin should be audited
     image_should_audit: bool = True
     ## The notification (introductions, hardware requirements, etc.) you want to print out
@@ -825,6 +994,19 @@ class Subscription(str, Enum):
 
 
 class IMiddleware(ABC):
+    """
+    Middlewares are built once per plugin class (see `ISocketPlugin.build_middlewares`),
+    and are shared by all the requests. So states of the request should be accessed
+    from the `plugin` (and its `context`), instead of being stored on the middleware.
+
+    > Legacy middlewares, which implement `process(self, response)` and are bound to
+    a plugin instance (`Middleware(plugin)`, often created in an overridden `middlewares`
+    property), are still supported: `before` will be called with the request, and
+    `plugin` / `hash` will be set before calling `process`. Since they hold states of
+    the request, they should never be shared across plugin instances.
+    """
+
+    # legacy, states of the request
     hash: str
     plugin: IPlugin
 
@@ -836,7 +1018,7 @@ class IMiddleware(ABC):
         pass
 
     @abstractmethod
-    async def process(self, response: Any) -> Any:
+    async def process(self, plugin: IPlugin, response: Any) -> Any:
         """
         If `can_handle_message` is `False`, the `response` here could be anything except
         `ISocketMessage`, because in this case if `response` is already an `ISocketMessage`,
@@ -850,25 +1032,56 @@ class IMiddleware(ABC):
         return False
 
     async def before(self, request: ISocketRequest) -> None:
+        """Only called for legacy middlewares, see `is_legacy`."""
+
         self.hash = request.hash
 
     # api
 
-    def __init__(self, plugin: IPlugin) -> None:
-        self.plugin = plugin
+    def __init__(self, plugin: Optional[IPlugin] = None) -> None:
+        if plugin is not None:
+            self.plugin = plugin
+
+    @property
+    def is_legacy(self) -> bool:
+        """Whether the middleware implements the legacy `process(self, response)`."""
+
+        return _is_legacy_middleware(type(self))
 
-    async def __call__(self, response: Any) -> Any:
+    async def __call__(self, plugin: IPlugin, response: Any) -> Any:
         if (
             self.subscriptions != Subscription.ALL
-            and self.plugin.type not in self.subscriptions
+            and plugin.type not in self.subscriptions
         ):
             return response
         if isinstance(response, ISocketMessage) and not self.can_handle_message:
             return response
-        return await self.process(response)
+        if self.is_legacy:
+            self.plugin = plugin
+            return await self.process(response)  # type: ignore
+        return await self.process(plugin, response)
+
+    def make_success(
+        self,
+        plugin: IPlugin,
+        final: Optional[Dict[str, Any]] = None,
+    ) -> ISocketMessage:
+        # legacy middlewares call `make_success(final)`
+        if final is None:
+            return ISocketMessage.make_success(self.hash, plugin)  # type: ignore
+        return ISocketMessage.make_success(plugin.task_hash, final)
+
+
+_legacy_middlewares: Dict[Type[IMiddleware], bool] = {}
+
 
-    def make_success(self, final: Dict[str, Any]) -> ISocketMessage:
-        return ISocketMessage.make_success(self.hash, final)
+def _is_legacy_middleware(t_middleware: Type[IMiddleware]) -> bool:
+    is_legacy = _legacy_middlewares.get(t_middleware)
+    if is_legacy is None:
+        parameters = inspect.signature(t_middleware.process).parameters
+        is_legacy = len(parameters) == 2  # (self, response)
+        _legacy_middlewares[t_middleware] = is_legacy
+    return is_legacy
 
 
 # (react) bindings
@@ -960,10 +1173,15 @@ __all__ = [
     # web
     "INodeData",
     "ISocketRequest",
+    "ISocketCancelRequest",
     "SocketStatus",
     "ISocketIntermediate",
     "ISocketResponse",
     "ISocketMessage",
+    "ISocketFrame",
+    "TaskCancelledError",
+    "CancellationToken",
+    "RequestContext",
     # plugin interface
     "IPlugin",
     "IMiddleware",
@@ -0,0 +1,115 @@
+import json
+
+from typing import Any
+from typing import Dict
+from typing import Type
+from typing import Union
+from typing import TypeVar
+from typing import Optional
+from pydantic import TypeAdapter
+
+
+TModel = TypeVar("TModel")
+TJsonData = Union[str, bytes, bytearray]
+
+
+class JsonCodec:
+    """
+    Encodes / decodes plain (dict / list / ...) JSON payloads.
+
+    > Pydantic models should be handled by `encode_model` / `decode_model` instead,
+    which (de)serialize them natively in `pydantic-core` and are even faster.
+    """
+
+    name = "json"
+
+    def dumps(self, value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+    def loads(self, data: TJsonData) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    def __init__(self) -> None:
+        import orjson
+
+        self._orjson = orjson
+
+    def dumps(self, value: Any) -> bytes:
+        return self._orjson.dumps(value, option=self._orjson.OPT_SERIALIZE_NUMPY)
+
+    def loads(self, data: TJsonData) -> Any:
+        return self._orjson.loads(data)
+
+
+json_codecs: Dict[str, Type[JsonCodec]] = {
+    JsonCodec.name: JsonCodec,
+    OrjsonCodec.name: OrjsonCodec,
+}
+_json_codec: Optional[JsonCodec] = None
+
+
+def setup_json_codec(name: str = "auto") -> JsonCodec:
+    """
+    (Re)create the process-wide `JsonCodec`.
+
+    * name : one of `json_codecs`, or 'auto' - which means `orjson` if it is
+    installed, otherwise the stdlib `json`.
+    """
+
+    global _json_codec
+    if name != "auto":
+        codec_type = json_codecs.get(name)
+        if codec_type is None:
+            raise ValueError(f"unrecognized json codec '{name}' found")
+        _json_codec = codec_type()
+    else:
+        try:
+            _json_codec = OrjsonCodec()
+        except ImportError:
+            _json_codec = JsonCodec()
+    return _json_codec
+
+
+def get_json_codec() -> JsonCodec:
+    if _json_codec is None:
+        return setup_json_codec()
+    return _json_codec
+
+
+_type_adapters: Dict[Any, TypeAdapter] = {}
+
+
+def get_type_adapter(t: Type[TModel]) -> "TypeAdapter[TModel]":
+    """
+    Get the (cached) `TypeAdapter` of `t`, building a `TypeAdapter` compiles the
+    validator / serializer of the type, which is too expensive to be done per call.
+    """
+
+    adapter = _type_adapters.get(t)
+    if adapter is None:
+        adapter = _type_adapters[t] = TypeAdapter(t)
+    return adapter
+
+
+def decode_model(t: Type[TModel], data: TJsonData) -> TModel:
+    return get_type_adapter(t).validate_json(data)
+
+
+def encode_model(value: Any) -> bytes:
+    return get_type_adapter(type(value)).dump_json(value)
+
+
+__all__ = [
+    "JsonCodec",
+    "OrjsonCodec",
+    "json_codecs",
+    "get_json_codec",
+    "setup_json_codec",
+    "get_type_adapter",
+    "decode_model",
+    "encode_model",
+]
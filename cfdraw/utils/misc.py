@@ -5,10 +5,12 @@ import threading
 from typing import Any
 from typing import TypeVar
 from typing import Callable
+from typing import Optional
 from typing import Coroutine
-from concurrent.futures import ThreadPoolExecutor
 
 from cfdraw.core.toolkit import console
+from cfdraw.core.toolkit.misc import get_offload_runtime
+from cfdraw.core.toolkit.misc import OffloadStats
 
 
 TFutureResponse = TypeVar("TFutureResponse")
@@ -30,28 +32,55 @@ def deprecated(message: str) -> Callable[[type], type]:
     return _deprecated
 
 
-# TODO : maybe there will be better solutions?
 async def offload(future: Coroutine[Any, Any, TFutureResponse]) -> TFutureResponse:
-    loop = asyncio.get_event_loop()
-    with ThreadPoolExecutor() as executor:
-        return await loop.run_in_executor(
-            executor,
-            lambda new_loop, _future: new_loop.run_until_complete(_future),
-            asyncio.new_event_loop(),
-            future,
-        )
-
-
-# TODO : maybe there will be better solutions?
-def offload_run(future: Coroutine[Any, Any, bool]) -> bool:
     """
-    Return `True` if the `future` is successfully executed.
+    Execute the `future` in the process-wide worker pool (see `OffloadRuntime`).
+
+    > The maximum concurrency can be configured by `offload_max_workers` in `Config`.
+    """
+
+    return await get_offload_runtime().run(future)
+
+
+def offload_run(
+    future: Coroutine[Any, Any, bool],
+    callback: Optional[Callable[[bool], None]] = None,
+) -> bool:
+    """
+    Hand off the `future` to the 'main' event loop without blocking the current thread.
+
+    Return `True` if the `future` is successfully handed off.
 
     * future: Coroutine[Any, Any, bool]
         should return `True` if successfully executed, and `False` otherwise.
+    * callback: Callable[[bool], None], optional
+        will be called (in the 'main' event loop) with whether the `future` is
+        successfully executed.
+
+    > If there is no available 'main' event loop, the `future` will be executed
+    in a new thread and this function will block until it is finished.
 
     """
 
+    def _callback(success: Optional[bool]) -> None:
+        if not success:
+            console.error("\[offload_run] Failed to execute future")
+        if callback is not None:
+            callback(bool(success))
+
+    if get_offload_runtime().run_threadsafe(future, _callback):
+        return True
+    return _blocking_run(future, callback)
+
+
+def get_offload_stats() -> OffloadStats:
+    return get_offload_runtime().stats()
+
+
+def _blocking_run(
+    future: Coroutine[Any, Any, bool],
+    callback: Optional[Callable[[bool], None]],
+) -> bool:
     def _run() -> None:
         try:
             loop = asyncio.new_event_loop()
@@ -65,8 +94,11 @@ def offload_run(future: Coroutine[Any, Any, bool]) -> bool:
         except Exception:
             logging.exception("[offload_run] failed to execute future")
 
-    event = asyncio.Event()
+    event = threading.Event()
     progress = threading.Thread(target=_run)
     progress.start()
     progress.join()
-    return event.is_set()
+    success = event.is_set()
+    if callback is not None:
+        callback(success)
+    return success
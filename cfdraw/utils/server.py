@@ -1,52 +1,125 @@
+import os
 import random
+import asyncio
+import threading
 
-import numpy as np
-
-from io import BytesIO
 from PIL import Image
 from typing import Any
 from typing import Dict
 from typing import Union
+from typing import Mapping
+from typing import Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import Response
+from pathlib import Path
+from email.utils import parsedate_to_datetime
+from fastapi.responses import FileResponse
 from PIL.PngImagePlugin import PngInfo
 from cfdraw.core.toolkit.cv import to_rgb
-from cfdraw.core.toolkit.cv import np_to_bytes
 from cfdraw.core.toolkit.web import raise_err
 from cfdraw.core.toolkit.misc import random_hash
+from cfdraw.core.toolkit.data_structures import CacheStats
 
 from cfdraw.config import get_config
+from cfdraw.utils.misc import offload
+from cfdraw.utils.cache import cache_resource
 
 
-def save_svg(svg: str, base_url: str) -> Dict[str, Any]:
-    config = get_config()
+# uploaded files are named by random hashes, so they will never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _get_upload_path(suffix: str) -> Path:
+    # should be called in the event loop thread, since `random` states are global
     state = random.getstate()
     random.seed()
-    path = config.upload_image_folder / f"{random_hash()}.svg"
+    path = get_config().upload_image_folder / f"{random_hash()}{suffix}"
     random.setstate(state)
+    return path
+
+
+def _get_upload_url(path: Path, base_url: str) -> str:
+    base_url = base_url.rstrip("/")
+    return f"{base_url}/{path.relative_to(get_config().upload_root_path).as_posix()}"
+
+
+def _write_image(image: Image.Image, meta: PngInfo, path: Path) -> None:
+    # the file will only be visible after it is fully written and flushed to disk
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    compress_level = get_config().png_compress_level
+    try:
+        with tmp_path.open("wb") as f:
+            image.save(f, "PNG", pnginfo=meta, compress_level=compress_level)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+@cache_resource
+def get_image_encoder() -> ThreadPoolExecutor:
+    """
+    The bounded pool used to encode uploaded images.
+
+    > `PIL` releases the GIL when encoding, so multiple cores can be utilized.
+    """
+
+    max_workers = get_config().image_encoder_workers
+    if max_workers is None:
+        max_workers = min(4, os.cpu_count() or 1)
+    return ThreadPoolExecutor(max_workers, thread_name_prefix="cfdraw-encoder")
+
+
+def save_svg(svg: str, base_url: str) -> Dict[str, Any]:
+    path = _get_upload_path(".svg")
     with path.open("w") as f:
         f.write(svg)
-    base_url = base_url.rstrip("/")
-    url = f"{base_url}/{path.relative_to(config.upload_root_path).as_posix()}"
-    return dict(w=0, h=0, url=url)
+    return dict(w=0, h=0, url=_get_upload_url(path, base_url))
 
 
 def save_image(image: Image.Image, meta: PngInfo, base_url: str) -> Dict[str, Any]:
     w, h = image.size
-    config = get_config()
-    state = random.getstate()
-    random.seed()
-    path = config.upload_image_folder / f"{random_hash()}.png"
-    random.setstate(state)
-    image.save(path, pnginfo=meta)
-    base_url = base_url.rstrip("/")
-    url = f"{base_url}/{path.relative_to(config.upload_root_path).as_posix()}"
-    return dict(w=w, h=h, url=url)
+    path = _get_upload_path(".png")
+    _write_image(image, meta, path)
+    return dict(w=w, h=h, url=_get_upload_url(path, base_url))
+
+
+async def save_image_async(
+    image: Image.Image,
+    meta: PngInfo,
+    base_url: str,
+) -> Dict[str, Any]:
+    """
+    Same as `save_image`, but the encoding will be executed in the image encoder pool
+    (see `get_image_encoder`), so the event loop will not be blocked.
+    """
+
+    w, h = image.size
+    path = _get_upload_path(".png")
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(get_image_encoder(), _write_image, image, meta, path)
+    return dict(w=w, h=h, url=_get_upload_url(path, base_url))
+
+
+def get_upload_image_path(file: str) -> Path:
+    """
+    Return the path of the uploaded `file`, which should be a plain file name
+    (a trailing '/' is allowed, since it is contained in the image urls).
+
+    > this ensures that only files inside the image upload folder can be accessed.
+    """
+
+    name = file.rstrip("/")
+    if not name or name in (".", "..") or Path(name).name != name:
+        raise ValueError(f"invalid image file '{file}'")
+    return get_config().upload_image_folder / name
 
 
 def get_svg_response(file: str) -> Response:
-    config = get_config()
     try:
-        svg_path = config.upload_image_folder / file
+        svg_path = get_upload_image_path(file)
         with svg_path.open("r") as f:
             content = f.read()
         return Response(content=content, media_type="image/svg+xml")
@@ -55,40 +128,294 @@ def get_svg_response(file: str) -> Response:
 
 
 def get_image(file: str, jpeg: bool = False) -> Image.Image:
-    config = get_config()
     try:
-        image = Image.open(config.upload_image_folder / file)
+        path = get_upload_image_path(file)
         if not jpeg:
-            return image
-        with BytesIO() as f:
-            to_rgb(image).save(f, format="JPEG", quality=95)
-            f.seek(0)
-            image = Image.open(f)
-            image.load()
-            return image
+            return Image.open(path)
+        return Image.open(get_image_derivatives().make(path.name, "jpeg"))
     except Exception as err:
         raise_err(err)
 
 
+def is_not_modified(
+    response_headers: Mapping[str, str],
+    request_headers: Mapping[str, str],
+) -> bool:
+    """Check the conditional headers of the request (RFC 9110, section 13)."""
+
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = response_headers.get("etag")
+        if etag is None:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        strip_weak = lambda tag: tag[2:] if tag.startswith("W/") else tag
+        tags = [strip_weak(tag.strip()) for tag in if_none_match.split(",")]
+        return strip_weak(etag) in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    last_modified = response_headers.get("last-modified")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+        modified = parsedate_to_datetime(last_modified)
+    except (TypeError, ValueError):
+        return False
+    return modified <= since
+
+
+def get_image_file_response(
+    path: Path,
+    request_headers: Mapping[str, str],
+) -> Response:
+    """
+    Stream the stored file directly, with caching headers.
+
+    - `ETag` / `Last-Modified` are derived from the file stats.
+    - Conditional requests (`If-None-Match` / `If-Modified-Since`) will get a `304`.
+    - Range requests are handled by `FileResponse`.
+    """
+
+    if not path.is_file():
+        raise ValueError(f"image '{path.name}' does not exist")
+    response = FileResponse(
+        path,
+        headers={"cache-control": IMMUTABLE_CACHE_CONTROL},
+        stat_result=path.stat(),
+    )
+    if is_not_modified(response.headers, request_headers):
+        keys = ["cache-control", "etag", "last-modified"]
+        headers = {k: response.headers[k] for k in keys if k in response.headers}
+        return Response(status_code=304, headers=headers)
+    return response
+
+
 def get_image_response(  # type: ignore
     file: str,
     jpeg: bool = False,
     return_image: bool = False,
+    max_size: Optional[int] = None,
+    request_headers: Optional[Mapping[str, str]] = None,
 ) -> Union[Response, Image.Image]:
-    config = get_config()
     try:
-        image = Image.open(config.upload_image_folder / file)
-        if not jpeg:
-            if return_image:
-                return image
-            content = np_to_bytes(np.array(image))
-        else:
-            with BytesIO() as f:
-                to_rgb(image).save(f, format="JPEG", quality=95)
-                f.seek(0)
-                if return_image:
-                    return Image.open(f)
-                content = f.read()
-        return Response(content=content, media_type="image/png")
+        path = get_upload_image_path(file)
+        max_size = get_thumbnail_size(max_size)
+        if jpeg or max_size is not None:
+            fmt = "jpeg" if jpeg else "png"
+            path = get_image_derivatives().make(path.name, fmt, max_size)
+        if return_image:
+            return Image.open(path)
+        return get_image_file_response(path, request_headers or {})
     except Exception as err:
         raise_err(err)
+
+
+async def get_image_path(
+    file: str,
+    jpeg: bool = False,
+    max_size: Optional[int] = None,
+) -> Path:
+    """
+    Return the path of the uploaded image, or of its (cached) variant if `jpeg` or
+    `max_size` is specified.
+    """
+
+    path = get_upload_image_path(file)
+    max_size = get_thumbnail_size(max_size)
+    if not jpeg and max_size is None:
+        return path
+    fmt = "jpeg" if jpeg else "png"
+    return await get_image_derivatives().get(path.name, fmt, max_size)
+
+
+# derivatives
+
+
+def get_thumbnail_size(max_size: Optional[int]) -> Optional[int]:
+    """
+    Round `max_size` up to one of the `thumbnail_sizes` in `Config`, so the number
+    of variants of each image is bounded.
+
+    > `None` means the original resolution, which is also used when `max_size` is
+    larger than all available sizes.
+    """
+
+    if max_size is None:
+        return None
+    if max_size <= 0:
+        raise ValueError(f"`max_size` should be positive, but got {max_size}")
+    for size in sorted(get_config().thumbnail_sizes):
+        if size >= max_size:
+            return size
+    return None
+
+
+class ImageDerivatives:
+    """
+    On-disk cache of the encoded variants (jpeg / thumbnails) of uploaded images.
+
+    - Variants are keyed by (file, format, max size, quality), and are stored in
+    `folder`, which is next to the image upload folder.
+    - Variants are generated lazily on their first requests, and concurrent misses of
+    the same variant (in `get`) will share a single encoding.
+    - Least recently used variants will be removed once the total size of the
+    variants exceeds `max_bytes`.
+
+    > Uploaded images are never modified (see `IMMUTABLE_CACHE_CONTROL`), so the
+    variants never need to be invalidated.
+    """
+
+    formats = {"jpeg": "jpg", "png": "png"}
+
+    def __init__(self, source: Path, folder: Path, max_bytes: int) -> None:
+        self.source = source
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sizes: OrderedDict[str, int] = OrderedDict()
+        self._num_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+        existing = []
+        for path in folder.iterdir():
+            if path.suffix == ".tmp":
+                path.unlink(missing_ok=True)
+            elif path.is_file():
+                existing.append((path.stat(), path.name))
+        for stat, name in sorted(existing, key=lambda pair: pair[0].st_mtime):
+            self._sizes[name] = stat.st_size
+            self._num_bytes += stat.st_size
+        with self._lock:
+            self._evict()
+
+    def get_name(
+        self,
+        file: str,
+        fmt: str,
+        max_size: Optional[int] = None,
+        quality: int = 95,
+    ) -> str:
+        if Path(file).name != file:
+            raise ValueError(f"invalid image file '{file}'")
+        ext = self.formats.get(fmt)
+        if ext is None:
+            raise ValueError(f"unsupported image format '{fmt}'")
+        return f"{file}.{max_size or 0}-{quality}.{ext}"
+
+    def make(
+        self,
+        file: str,
+        fmt: str,
+        max_size: Optional[int] = None,
+        quality: int = 95,
+    ) -> Path:
+        """Return the path of the variant, will generate it (blocking) if needed."""
+
+        name = self.get_name(file, fmt, max_size, quality)
+        if self._hit(name):
+            return self.folder / name
+        return self._generate(file, name, fmt, max_size, quality)
+
+    async def get(
+        self,
+        file: str,
+        fmt: str,
+        max_size: Optional[int] = None,
+        quality: int = 95,
+    ) -> Path:
+        """Return the path of the variant, will generate it (offloaded) if needed."""
+
+        name = self.get_name(file, fmt, max_size, quality)
+        if self._hit(name):
+            return self.folder / name
+        pending = self._pending.get(name)
+        # futures are bound to their loops, so they can only be shared in the same loop
+        if pending is None or pending.get_loop() is not asyncio.get_running_loop():
+
+            async def _generate() -> Path:
+                return self._generate(file, name, fmt, max_size, quality)
+
+            pending = asyncio.ensure_future(offload(_generate()))
+            pending.add_done_callback(lambda f: self._on_done(name, f))
+            self._pending[name] = pending
+        # shielded so cancelling one request will not affect the others
+        return await asyncio.shield(pending)
+
+    def _on_done(self, name: str, future: asyncio.Future) -> None:
+        if self._pending.get(name) is future:
+            self._pending.pop(name)
+        # the error will be raised to the callers, if any
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                num_items=len(self._sizes),
+                num_bytes=self._num_bytes,
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+            )
+
+    def _hit(self, name: str) -> bool:
+        with self._lock:
+            if name in self._sizes and (self.folder / name).is_file():
+                self._sizes.move_to_end(name)
+                self._hits += 1
+                return True
+            self._misses += 1
+            return False
+
+    def _generate(
+        self,
+        file: str,
+        name: str,
+        fmt: str,
+        max_size: Optional[int],
+        quality: int,
+    ) -> Path:
+        image: Image.Image = Image.open(self.source / file)
+        if max_size is not None:
+            image.thumbnail((max_size, max_size))
+        kwargs: Dict[str, Any] = {}
+        if fmt == "jpeg":
+            image = to_rgb(image)
+            kwargs["quality"] = quality
+        path = self.folder / name
+        # write to a temporary file first, so readers never see partial variants
+        tmp_path = path.with_name(f"{name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        try:
+            image.save(tmp_path, format=fmt.upper(), **kwargs)
+            os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        size = path.stat().st_size
+        with self._lock:
+            self._num_bytes += size - self._sizes.pop(name, 0)
+            self._sizes[name] = size
+            self._evict(keep=name)
+        return path
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        while self._num_bytes > self.max_bytes and self._sizes:
+            name, size = next(iter(self._sizes.items()))
+            if name == keep:
+                break
+            del self._sizes[name]
+            self._num_bytes -= size
+            self._evictions += 1
+            (self.folder / name).unlink(missing_ok=True)
+
+
+@cache_resource
+def get_image_derivatives() -> ImageDerivatives:
+    config = get_config()
+    return ImageDerivatives(
+        config.upload_image_folder,
+        config.upload_derivative_folder,
+        config.derivative_cache_max_bytes,
+    )
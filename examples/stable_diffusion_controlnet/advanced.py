@@ -96,6 +96,7 @@ class ControlNetPlugin(IFieldsPlugin):
 
     async def process(self, data: ISocketRequest) -> List[Image.Image]:
         def callback(step: int, *_: Any) -> None:
+            self.cancel_token.raise_if_cancelled()
             self.send_progress(step / num_inference_steps)
 
         kwargs = shallow_copy_dict(data.extraData)
@@ -60,6 +60,7 @@ class InpaintingPlugin(IFieldsPlugin):
 
     async def process(self, data: ISocketRequest) -> List[Image.Image]:
         def callback(step: int, *_: Any) -> None:
+            self.cancel_token.raise_if_cancelled()
             self.send_progress(step / num_inference_steps)
 
         import numpy as np
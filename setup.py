@@ -35,7 +35,7 @@ setup(
         "safetensors",
         "python-multipart",
         "numpy>=1.22.3",
-        "fastapi>=0.95.1",
+        "fastapi>=0.115.0",
         "pydantic>=2.0.0",
         "websockets>=12.0",
         "charset-normalizer==2.1.0",